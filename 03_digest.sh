@@ -20,29 +20,14 @@ if [ ! -d "$OUTPUT_DIR" ]; then
 fi
 
 # Check if there are any JSON files to process
-if [ -z "$(ls -A $INPUT_DIR/page_*.json 2>/dev/null)" ]; then
+if [ -z "$(ls -A $INPUT_DIR/page_*.json* 2>/dev/null)" ]; then
     echo "Error: No JSON files found in the input directory '$INPUT_DIR'."
     exit 1
 fi
 
-# Export the necessary variables for parallel execution
-export INPUT_DIR OUTPUT_DIR
-
-# Function to process a single JSON file
-process_file() {
-    input_file=$1
-    output_file="$OUTPUT_DIR/$(basename "$input_file")"
-    python3 digest.py "$input_file" > "$output_file"
-    if [ $? -ne 0 ]; then
-        echo "Error: Failed to process '$input_file' with digest.py."
-        rm -f "$output_file" # Clean up incomplete output file
-    else
-        echo "Digested $input_file -> $output_file"
-    fi
-}
-
-# Export the function for parallel execution
-export -f process_file
-
-# Find all JSON files and process them in parallel
-find "$INPUT_DIR" -name 'page_*.json' -print0 | xargs -0 -n 1 -P 4 bash -c 'process_file "$0"'
+# Digest all extracts (page_*.json or compact page_*.json.gz) in one worker pool.
+# Each worker loads the dictionary once, and dictionary verdicts are cached across runs.
+if ! python3 digest.py --output-dir "$OUTPUT_DIR" "$INPUT_DIR"; then
+    echo "Error: Failed to process some files in '$INPUT_DIR' with digest.py."
+    exit 1
+fi
@@ -18,33 +18,12 @@ if [ ! -d "$OUTPUT_DIR" ]; then
         exit 1
     fi
 fi
-# Loop through all JSON files in the digests directory
-for file in "$INPUT_DIR"/*.json; do
-    # Check if file exists (in case there are no JSON files)
-    [ -e "$file" ] || continue
 
-    # Get the base filename
-    filename=$(basename "$file")
-    # Define the output file path
-    output_file="$OUTPUT_DIR/$filename"
-
-    # Check if the revised file already exists
-    if [ -f "$output_file" ]; then
-        echo "$output_file already exists. Skipping..."
-        continue
-    fi
-    # Process the file and capture the output in a temporary file
-    temp_output=$(mktemp)
-    if python revise.py "$file" > "$temp_output"; then
-        # If successful, move the temporary file to the final output location
-        mv "$temp_output" "$output_file"
-        echo "Created $output_file"
-    else
-        echo "Error: Failed to process $file with revise.py."
-        rm -f "$temp_output" # Clean up the temporary file
-        continue
-    fi
-
-done
+# Revise all pages concurrently under per-model rate limits.
+# Each page is written to the output directory as soon as it is done. LLM responses are
+# cached in .cache/llm, so a re-run only calls the API for pages whose digest changed.
+if ! python revise.py --output-dir "$OUTPUT_DIR" "$INPUT_DIR"; then
+    echo "Error: Failed to process some files with revise.py. Re-run to retry them."
+fi
 
-echo "Revision process complete."
\ No newline at end of file
+echo "Revision process complete."
@@ -0,0 +1,227 @@
+"""
+Word-level alignment between an OCR digest and its revision.
+
+The revision's 'Edits:' list is written by the model and often leaves changes out, so the
+review documents compute the changes themselves. Both sides are split into word and punctuation
+tokens and compared with Myers' O(ND) diff, which takes time proportional to the page length
+times the number of differences rather than to the product of the two lengths, so a lightly
+corrected page aligns in well under a millisecond and a whole book in seconds. The search
+gives up past half as many differences as the two sides have tokens, and such a page counts
+as changed throughout apart from its common start and end.
+
+align() maps the differences back to digest word indices (and so to their confidences) and to
+character spans of the revision text, which is what review.py highlights.
+
+Usage:
+    python align.py --digests-dir digests --revised-dir revised
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+LOW_CONFIDENCE = 0.8
+TOKEN = re.compile(r'\w+|[^\w\s]')
+
+def matching_blocks(a, b):
+    """
+    Myers' greedy O(ND) diff of two sequences of hashable items.
+
+    Returns:
+        list: (i, j, size) triples of equal runs a[i:i+size] == b[j:j+size], in order.
+    """
+    # Common ends cost nothing to match and keep D down to the actual edits
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < len(a) - prefix and suffix < len(b) - prefix
+           and a[len(a) - 1 - suffix] == b[len(b) - 1 - suffix]):
+        suffix += 1
+    core_a, core_b = a[prefix:len(a) - suffix], b[prefix:len(b) - suffix]
+
+    # Past this many differences the pages have little in common, and the search would only cost
+    # O(D^2) time and memory to find a few coincidental matches, so the rest is left unmatched
+    max_d = max(50, (len(core_a) + len(core_b)) // 2)
+    points = [(prefix + i, prefix + j) for i, j in _diagonals(core_a, core_b, max_d) or []]
+    points = [(i, i) for i in range(prefix)] + points
+    points += [(len(a) - suffix + k, len(b) - suffix + k) for k in range(suffix)]
+
+    blocks = []
+    for i, j in points:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([i, j, 1])
+    return [tuple(block) for block in blocks]
+
+def _diagonals(a, b, max_d):
+    """
+    Index pairs (i, j) with a[i] == b[j] on a shortest edit path, in order, or None if the path
+    has more than max_d differences.
+    """
+    n, m = len(a), len(b)
+    if not n or not m:
+        return []
+    # v[k] is the furthest x reached on diagonal k = x - y; each step's frontier is kept for the
+    # backtrack, which makes the memory O(D^2) for D differences
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    for d in range(min(n + m, max_d) + 1):
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, a, b, n, m)
+    return None
+
+def _backtrack(trace, a, b, x, y):
+    points = []
+    for d in range(len(trace) - 1, -1, -1):
+        frontier = trace[d]
+        k = x - y
+        if k == -d or (k != d and frontier[k - 1 + d + 1] < frontier[k + 1 + d + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = frontier[previous_k + d + 1] if d else 0
+        previous_y = previous_x - previous_k if d else 0
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            points.append((x, y))
+        x, y = previous_x, previous_y
+    points.reverse()
+    return points
+
+def opcodes(a, b):
+    """The diff of a and b as difflib-style ('equal' | 'replace' | 'delete' | 'insert', i1, i2, j1, j2) tuples."""
+    codes = []
+    i = j = 0
+    for block_i, block_j, size in matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if i < block_i and j < block_j:
+            codes.append(("replace", i, block_i, j, block_j))
+        elif i < block_i:
+            codes.append(("delete", i, block_i, j, j))
+        elif j < block_j:
+            codes.append(("insert", i, i, j, block_j))
+        if size:
+            codes.append(("equal", block_i, block_i + size, block_j, block_j + size))
+        i, j = block_i + size, block_j + size
+    return codes
+
+def tokenize_digest(words):
+    """(word index, token) for each word and punctuation token of the digest."""
+    return [(index, match.group()) for index, word in enumerate(words) for match in TOKEN.finditer(word["word"])]
+
+def tokenize_text(text):
+    """(start, end, token) for each word and punctuation token of text."""
+    return [(match.start(), match.end(), match.group()) for match in TOKEN.finditer(text)]
+
+def merge_spans(spans):
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(span) for span in merged]
+
+def align(words, revision_text, threshold=LOW_CONFIDENCE):
+    """
+    Aligns a digest's words with the revised text of the page.
+
+    Args:
+        words (list): Digest word dicts with 'word' and 'confidence'.
+        revision_text (str): The revised text.
+        threshold (float): Confidence below which a word counts as low.
+
+    Returns:
+        dict: 'opcodes' over the two token lists; 'changed_words' and 'low_confidence', sets of
+        digest word indices; 'changed_spans' and 'low_confidence_spans', merged (start, end)
+        character spans of revision_text; 'sources', the digest word index of each revision
+        token that was kept unchanged, or None.
+    """
+    digest_tokens = tokenize_digest(words)
+    revision_tokens = tokenize_text(revision_text)
+    ids = {}
+    a = [ids.setdefault(token, len(ids)) for _, token in digest_tokens]
+    b = [ids.setdefault(token, len(ids)) for _, _, token in revision_tokens]
+
+    codes = opcodes(a, b)
+    changed_words = set()
+    changed_spans = []
+    sources = [None] * len(revision_tokens)
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                sources[j1 + offset] = digest_tokens[i1 + offset][0]
+            continue
+        changed_words.update(digest_tokens[i][0] for i in range(i1, i2))
+        if j2 > j1:
+            changed_spans.append((revision_tokens[j1][0], revision_tokens[j2 - 1][1]))
+
+    low_confidence = {index for index, word in enumerate(words) if word.get("confidence", 0.0) < threshold}
+    low_confidence_spans = [(start, end) for (start, end, _), source in zip(revision_tokens, sources)
+                            if source in low_confidence]
+    return {
+        "opcodes": codes,
+        "changed_words": changed_words,
+        "changed_spans": merge_spans(changed_spans),
+        "low_confidence": low_confidence,
+        "low_confidence_spans": merge_spans(low_confidence_spans),
+        "sources": sources,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Align digests with their revisions and report the changed words per page.")
+    parser.add_argument("--digests-dir", default="digests", help="Directory of digests (default is 'digests')")
+    parser.add_argument("--revised-dir", default="revised", help="Directory of revisions (default is 'revised')")
+    parser.add_argument("--threshold", type=float, default=LOW_CONFIDENCE,
+                        help=f"Confidence below which a word counts as low (default is {LOW_CONFIDENCE})")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.revised_dir):
+        print(f"Error: The directory '{args.revised_dir}' does not exist.")
+        sys.exit(1)
+
+    pages = total_words = total_changed = total_low = 0
+    aligning = 0.0
+    for name in sorted(os.listdir(args.revised_dir)):
+        digest_path = os.path.join(args.digests_dir, name)
+        if not name.startswith("page_") or not name.endswith(".json") or not os.path.exists(digest_path):
+            continue
+        with open(digest_path, 'r', encoding='utf-8') as f:
+            words = json.load(f)
+        with open(os.path.join(args.revised_dir, name), 'r', encoding='utf-8') as f:
+            revision_text = json.load(f)["text"]
+
+        start = time.perf_counter()
+        alignment = align(words, revision_text, args.threshold)
+        aligning += time.perf_counter() - start
+
+        changed = len(alignment["changed_words"])
+        low_changed = len(alignment["changed_words"] & alignment["low_confidence"])
+        print(f"{os.path.splitext(name)[0]:<12}{len(words):>6} words  {changed:>5} changed  "
+              f"{len(alignment['low_confidence']):>5} low confidence  {low_changed:>5} both")
+        pages += 1
+        total_words += len(words)
+        total_changed += changed
+        total_low += len(alignment["low_confidence"])
+
+    print(f"Aligned {pages} pages, {total_words} words: {total_changed} changed, {total_low} low confidence, "
+          f"in {aligning:.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Assemble revised pages into the draft text and, given a chapter map, into per-chapter LaTeX files.
+
+The draft has the same shape 06_draft.sh always produced: a [[page_NNN]] marker, the page's
+revised text and a blank line, for every page in numeric order. Pages are read and written one
+at a time, so memory does not grow with the book.
+
+The chapter map is a JSON object from chapter name to an inclusive page range, for example
+{"chapter1": "1-2", "chapter2": "2-40"}. A page may start one chapter and end another; it is then
+emitted in both and split by hand. Chapter files follow book/chapterN_ru.tex: a \\pageimage{page_NNN}
+before every page and a \\label{PAGE-PARAGRAPH} before every paragraph. A chapter is rewritten only
+when one of its pages or the map is newer than its .tex file, and the file is left untouched when
+the result is the same, so latexmk only rebuilds what moved.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+from datetime import datetime
+
+from fsutil import write_if_changed
+
+# LaTeX special characters in revised text, escaped before they reach a chapter file
+LATEX_SPECIALS = {
+    "\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#", "_": r"\_",
+    "{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}",
+}
+LATEX_SPECIAL_PATTERN = re.compile("|".join(re.escape(c) for c in LATEX_SPECIALS))
+
+def page_number(path):
+    match = re.search(r'page_(\d+)', os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+def collect_revised(revised_dir):
+    """Returns (page number, path) for every revised/page_*.json in numeric order."""
+    pages = []
+    for name in os.listdir(revised_dir):
+        number = page_number(name)
+        if number is not None and name.endswith(".json"):
+            pages.append((number, os.path.join(revised_dir, name)))
+    return sorted(pages)
+
+def load_page_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)["text"]
+
+def page_name(path):
+    """'revised/page_012.json' -> 'page_012', keeping the file's own zero padding."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+def write_draft(revised_paths, output_file):
+    """Streams the pages into output_file through a temporary file. Returns the number of pages written."""
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    temp_file = output_file + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as out:
+        for path in revised_paths:
+            out.write(f"[[{page_name(path)}]]\n{load_page_text(path)}\n\n")
+    os.replace(temp_file, output_file)
+    return len(revised_paths)
+
+def load_chapter_map(path):
+    """Reads {chapter: "FIRST-LAST"} into {chapter: (first, last)}, keeping the file's order."""
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    chapters = {}
+    for chapter, pages in raw.items():
+        match = re.fullmatch(r'\s*(\d+)\s*-\s*(\d+)\s*', str(pages))
+        if not match:
+            raise ValueError(f"Invalid page range '{pages}' for {chapter}, expected FIRST-LAST")
+        chapters[chapter] = (int(match.group(1)), int(match.group(2)))
+    return chapters
+
+def escape_latex(text):
+    return LATEX_SPECIAL_PATTERN.sub(lambda m: LATEX_SPECIALS[m.group()], text)
+
+def page_to_tex(number, path):
+    """One page as chapter LaTeX: the page image, then each labelled paragraph."""
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', load_page_text(path)) if p.strip()]
+    parts = [f"\\pageimage{{{page_name(path)}}}\n"]
+    for index, paragraph in enumerate(paragraphs, 1):
+        parts.append(f"\\label{{{number}-{index}}}\n{escape_latex(paragraph)}\n\n")
+    return "".join(parts)
+
+def is_up_to_date(tex_file, source_paths):
+    """A chapter is up to date if its file exists and is newer than every page and the map."""
+    if not os.path.exists(tex_file):
+        return False
+    tex_mtime = os.path.getmtime(tex_file)
+    return all(os.path.getmtime(path) <= tex_mtime for path in source_paths)
+
+def write_chapters(pages, chapter_map_file, tex_dir, suffix="_ru", force=False):
+    """
+    Writes one .tex file per chapter in the map.
+
+    Returns:
+        dict: Chapter names by outcome, under 'written', 'unchanged' and 'up to date'.
+    """
+    chapters = load_chapter_map(chapter_map_file)
+    os.makedirs(tex_dir, exist_ok=True)
+    outcome = {"written": [], "unchanged": [], "up to date": []}
+    for chapter, (first, last) in chapters.items():
+        chapter_pages = [(number, path) for number, path in pages if first <= number <= last]
+        tex_file = os.path.join(tex_dir, f"{chapter}{suffix}.tex")
+        if not force and is_up_to_date(tex_file, [path for _, path in chapter_pages] + [chapter_map_file]):
+            outcome["up to date"].append(chapter)
+            continue
+        content = "".join(page_to_tex(number, path) for number, path in chapter_pages)
+        outcome["written" if write_if_changed(tex_file, content) else "unchanged"].append(chapter)
+    return outcome
+
+def main():
+    parser = argparse.ArgumentParser(description="Assemble revised pages into a draft and per-chapter LaTeX files.")
+    parser.add_argument("--revised-dir", default="revised", help="Directory of revised pages (default is 'revised')")
+    parser.add_argument("--output", help="Draft file (default is drafts/draft_ru_<date>_<time>.txt)")
+    parser.add_argument("--chapters", help="JSON map of chapter name to page range, e.g. {\"chapter2\": \"2-40\"}")
+    parser.add_argument("--tex-dir", default=os.path.join("drafts", "tex"),
+                        help="Directory for chapter .tex files (default is drafts/tex)")
+    parser.add_argument("--force", action="store_true", help="Rewrite chapters even if they look up to date")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.revised_dir):
+        print(f"Error: The directory '{args.revised_dir}' does not exist.")
+        sys.exit(1)
+    pages = collect_revised(args.revised_dir)
+
+    output_file = args.output or os.path.join("drafts", f"draft_ru_{datetime.now().strftime('%Y%m%d_%H%M')}.txt")
+    try:
+        count = write_draft([path for _, path in pages], output_file)
+    except (OSError, KeyError, json.JSONDecodeError) as e:
+        print(f"Error: Unable to write the draft. {e}")
+        sys.exit(1)
+    print(f"Draft text has been written to {output_file} ({count} pages)")
+
+    if args.chapters:
+        try:
+            outcome = write_chapters(pages, args.chapters, args.tex_dir, force=args.force)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: Unable to write the chapters. {e}")
+            sys.exit(1)
+        for status, chapters in outcome.items():
+            if chapters:
+                print(f"{status.capitalize()}: {', '.join(chapters)}")
+
+if __name__ == "__main__":
+    main()
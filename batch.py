@@ -0,0 +1,158 @@
+"""
+OpenAI Batch API submission for the LLM stages.
+
+For a full-book run latency does not matter but cost and rate limits do, and batch requests
+cost half as much and do not count against the per-minute limits. run_batch writes the
+requests as a Batch API JSONL file, uploads it, creates the batch, polls until it is done and
+returns each response matched back to its custom_id.
+
+The batch id is recorded next to the JSONL file, so an interrupted run picks up the same
+batch instead of submitting it again. Requests already in the CompletionCache are answered
+from it and never submitted; completed responses are added to it.
+
+Set OPENAI_BASE_URL to run against mock_openai.py, which implements the files and batches
+endpoints as well.
+"""
+import io
+import os
+import sys
+import json
+import time
+
+from cache import hash_key
+from fsutil import write_atomic
+from instrument import emit, timed
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+DEFAULT_POLL_INTERVAL = 30.0
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def add_batch_arguments(parser):
+    """Adds the --batch option shared by the LLM stages."""
+    parser.add_argument('--batch', metavar='JSONL',
+                        help='Submit the requests through the Batch API, writing them to this JSONL file, and wait for the results.')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f'Seconds between batch status checks (default is {DEFAULT_POLL_INTERVAL:g}).')
+
+def batch_line(custom_id, request):
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": request},
+                      ensure_ascii=False)
+
+def state_path_for(jsonl_path):
+    return jsonl_path + ".state.json"
+
+def load_state(jsonl_path, content_hash):
+    """Returns the batch id recorded for this exact JSONL content, or None."""
+    try:
+        with open(state_path_for(jsonl_path), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return state.get("batch_id") if state.get("content_hash") == content_hash else None
+
+def submit(client, jsonl_path, data, description):
+    """Uploads the JSONL data and creates a batch for it. Returns the batch id."""
+    with timed("batch", "submit", bytes_sent=len(data)) as fields:
+        upload = client.files.create(file=(os.path.basename(jsonl_path), io.BytesIO(data)), purpose="batch")
+        batch = client.batches.create(input_file_id=upload.id, endpoint=ENDPOINT,
+                                      completion_window=COMPLETION_WINDOW, metadata={"description": description})
+        fields["batch_id"] = batch.id
+    return batch.id
+
+def wait_for(client, batch_id, poll_interval):
+    """Polls a batch until it reaches a final status and returns it."""
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total})" if counts else ""
+        print(f"Batch {batch_id}: {batch.status}{progress}", file=sys.stderr)
+        if batch.status in FINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+def read_results(client, batch):
+    """
+    Downloads a finished batch's output and error files.
+
+    Returns:
+        tuple: ({custom_id: response body}, {custom_id: error message})
+    """
+    bodies, errors = {}, {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code", 200) != 200:
+                errors[record["custom_id"]] = str(record.get("error") or response.get("body"))
+            else:
+                bodies[record["custom_id"]] = response["body"]
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                errors[record["custom_id"]] = str(record.get("error") or (record.get("response") or {}).get("body"))
+    return bodies, errors
+
+def run_batch(client, items, jsonl_path, cache=None, poll_interval=DEFAULT_POLL_INTERVAL, stage="batch"):
+    """
+    Answers many chat completion requests through the Batch API.
+
+    Args:
+        client (OpenAI): Client to upload, submit and poll with.
+        items (list): (custom_id, request) tuples; custom ids must be unique.
+        jsonl_path (str): Where to write the batch input file.
+        cache (CompletionCache): Optional cache consulted before submitting and filled afterwards.
+        poll_interval (float): Seconds between status checks.
+        stage (str): Pipeline stage the events are recorded under.
+
+    Returns:
+        tuple: ({custom_id: message content}, {custom_id: error message})
+    """
+    contents, pending = {}, []
+    for custom_id, request in items:
+        cached = cache.get(request, client) if cache is not None else None
+        if cached is not None:
+            contents[custom_id] = cached
+        else:
+            pending.append((custom_id, request))
+    if contents:
+        emit(stage, "cache_hit", requests=len(contents))
+        print(f"{len(contents)} requests answered from the cache, {len(pending)} to submit.", file=sys.stderr)
+    if not pending:
+        return contents, {}
+
+    data = "".join(batch_line(custom_id, request) + "\n" for custom_id, request in pending).encode('utf-8')
+    write_atomic(jsonl_path, data)
+    content_hash = hash_key(data)
+    batch_id = load_state(jsonl_path, content_hash)
+    if batch_id:
+        print(f"Resuming batch {batch_id}.", file=sys.stderr)
+    else:
+        batch_id = submit(client, jsonl_path, data, f"{stage}: {len(pending)} requests")
+        write_atomic(state_path_for(jsonl_path), json.dumps({"batch_id": batch_id, "content_hash": content_hash}))
+        print(f"Submitted batch {batch_id} with {len(pending)} requests.", file=sys.stderr)
+
+    batch = wait_for(client, batch_id, poll_interval)
+    bodies, errors = read_results(client, batch)
+    requests = dict(pending)
+    prompt_tokens = completion_tokens = 0
+    for custom_id, body in bodies.items():
+        content = body["choices"][0]["message"]["content"]
+        contents[custom_id] = content
+        usage = body.get("usage") or {}
+        prompt_tokens += usage.get("prompt_tokens", 0)
+        completion_tokens += usage.get("completion_tokens", 0)
+        if cache is not None and custom_id in requests:
+            cache.put(requests[custom_id], content, client)
+    for custom_id, _ in pending:
+        if custom_id not in contents and custom_id not in errors:
+            errors[custom_id] = f"No result (batch {batch.status})"
+
+    emit(stage, "openai_batch", batch_id=batch_id, status=batch.status, requests=len(pending), failed=len(errors),
+         model=pending[0][1]["model"], prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    # A finished batch is never resumed, so a rerun with the same requests submits it again
+    os.remove(state_path_for(jsonl_path))
+    return contents, errors
@@ -0,0 +1,262 @@
+"""
+Offline benchmarks for the pipeline's local stages and its OpenAI client path.
+
+Synthetic books are built from fake_vision.synthetic_annotation responses, and revise runs
+against mock_openai.py with a configurable latency, so nothing here needs credentials or
+network access. Each stage is timed on its own and then run again under tracemalloc for
+its peak memory. Results are appended to bench_results.jsonl with the current commit, and
+--compare prints the change from the previous commit's results for the same stage and size.
+
+--startup measures instead what each stage script costs to start: a fresh interpreter importing
+the stage, which the shell scripts pay once per page and deda.py --files-from pays once per run.
+
+Usage:
+    python bench.py                      # 10-, 300- and 3000-page books
+    python bench.py --pages 300 --compare
+    python bench.py --startup
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+from fake_vision import synthetic_annotation
+from mock_openai import start_server
+
+RESULTS_PATH = "bench_results.jsonl"
+DEFAULT_SIZES = (10, 300, 3000)
+STARTUP_MODULES = ("slice", "extract", "digest", "revise", "review", "draft")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def make_extracts(pages, words_per_page):
+    """Synthetic Vision responses serialized the way extract.py stores them."""
+    return [json.dumps(synthetic_annotation(words_per_page, seed=page), ensure_ascii=False) for page in range(pages)]
+
+# Stages. Each takes the previous stage's output and returns its own.
+
+def bench_digest(extracts):
+    import digest
+    return [digest.combine_words_on_newline_break(digest.digest(json.loads(extract))) for extract in extracts]
+
+def bench_assemble(digests):
+    import revise
+    return [revise.assemble_text(page) for page in digests]
+
+def bench_draft_chunks(texts):
+    import draft
+    book = "".join(f"[[page_{i + 1:03d}]]\n{text}\n\n" for i, text in enumerate(texts))
+    return draft.split_into_chunks(book)
+
+def bench_review(digests, texts, image_path, output_dir):
+    import review
+    from docx import Document
+    # One 40-page document at a time, like 05_review.sh
+    for start in range(0, len(digests), review.PAGES_PER_REVIEW):
+        doc = Document()
+        for digest_data, text in zip(digests[start:start + review.PAGES_PER_REVIEW],
+                                     texts[start:start + review.PAGES_PER_REVIEW]):
+            review.add_review_table(doc, image_path, review.digest_to_text(digest_data), text, "- none", "bench",
+                                    digest_data)
+        doc.save(os.path.join(output_dir, f"review-{start + 1:04d}.docx"))
+
+def bench_align(digests, texts):
+    import align
+    # Every twentieth word of the revision is changed, roughly what a revise pass does
+    revisions = [" ".join("правка" if i % 20 == 10 else word for i, word in enumerate(text.split(" ")))
+                 for text in texts]
+    return [align.align(page, revision) for page, revision in zip(digests, revisions)]
+
+def bench_revise(texts, concurrency):
+    import revise
+    from llm import get_async_client
+    from ratelimit import RateLimiter
+
+    async def run():
+        async_client = get_async_client()
+        limiters = {revise.REFINE_MODEL: RateLimiter(100000, 10 ** 9), revise.FORMAT_MODEL: RateLimiter(100000, 10 ** 9)}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(text):
+            async with semaphore:
+                return await revise.refine_text_async(async_client, text, limiters)
+
+        try:
+            return await asyncio.gather(*(one(text) for text in texts))
+        finally:
+            await async_client.close()
+
+    return asyncio.run(run())
+
+def measure(function, *args):
+    """Returns (result, seconds, peak MB). Peak memory comes from a second run under tracemalloc."""
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+def run_size(pages, words_per_page, latency, concurrency, image_path, skip):
+    extracts = make_extracts(pages, words_per_page)
+    results = []
+
+    def record(stage, seconds, peak_mb, units):
+        results.append({"stage": stage, "pages": pages, "seconds": round(seconds, 4),
+                        "pages_per_s": round(pages / seconds, 2) if seconds else None,
+                        "units": units, "peak_mb": round(peak_mb, 2)})
+        print(f"{pages:>6} pages  {stage:<14}{seconds:>9.3f}s {pages / seconds if seconds else 0:>10.1f} pages/s"
+              f" {peak_mb:>9.1f} MB peak")
+
+    digests, seconds, peak = measure(bench_digest, extracts)
+    record("digest", seconds, peak, sum(len(d) for d in digests))
+
+    texts, seconds, peak = measure(bench_assemble, digests)
+    record("assemble_text", seconds, peak, sum(len(t) for t in texts))
+
+    chunks, seconds, peak = measure(bench_draft_chunks, texts)
+    record("draft_chunks", seconds, peak, len(chunks))
+
+    alignments, seconds, peak = measure(bench_align, digests, texts)
+    record("align", seconds, peak, sum(len(a["changed_words"]) for a in alignments))
+
+    if "review" not in skip:
+        with tempfile.TemporaryDirectory() as output_dir:
+            _, seconds, peak = measure(bench_review, digests, texts, image_path, output_dir)
+        record("review", seconds, peak, pages)
+
+    if "revise" not in skip:
+        server = start_server(latency=latency)
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        try:
+            # The network path is dominated by latency, so it is timed once without tracemalloc
+            start = time.perf_counter()
+            bench_revise(texts, concurrency)
+            record("revise_mock", time.perf_counter() - start, 0.0, server.requests)
+        finally:
+            server.shutdown()
+
+    return results
+
+def time_process(command, repeats):
+    """Median wall time of running command, or None if it fails."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if subprocess.run(command, capture_output=True).returncode != 0:
+            return None
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+def bench_startup(repeats, pages):
+    """Per-process startup cost of each stage: a fresh interpreter importing it, less a bare interpreter."""
+    bare = time_process([sys.executable, "-c", "pass"], repeats)
+    print(f"{'bare interpreter':<18}{bare * 1000:>9.1f} ms")
+    results = []
+    for module in STARTUP_MODULES:
+        seconds = time_process([sys.executable, "-c", f"import {module}"], repeats)
+        if seconds is None:
+            print(f"{module:<18}   failed to import, skipped")
+            continue
+        overhead = seconds - bare
+        print(f"{module:<18}{seconds * 1000:>9.1f} ms, {overhead * 1000:.1f} ms of imports; one process per page "
+              f"spends {seconds * pages:.1f}s starting up over {pages} pages, deda.py --files-from {seconds:.2f}s")
+        results.append({"stage": f"startup_{module}", "pages": pages, "seconds": round(seconds, 4),
+                        "pages_per_s": None, "units": 1, "peak_mb": 0.0})
+    return results
+
+def load_results(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def save_results(path, results):
+    with open(path, 'a', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    print(f"Results appended to {path}")
+
+def compare(previous, current):
+    """Prints the change in time and peak memory against the latest earlier commit's results."""
+    earlier = [r for r in previous if r["commit"] != current[0]["commit"]]
+    if not earlier:
+        print("No results from an earlier commit to compare with.")
+        return
+    baseline_commit = earlier[-1]["commit"]
+    baseline = {(r["stage"], r["pages"]): r for r in earlier if r["commit"] == baseline_commit}
+    print(f"\nCompared with {baseline_commit}:")
+    for r in current:
+        base = baseline.get((r["stage"], r["pages"]))
+        if not base or not base["seconds"]:
+            continue
+        time_change = 100.0 * (r["seconds"] - base["seconds"]) / base["seconds"]
+        memory_change = 100.0 * (r["peak_mb"] - base["peak_mb"]) / base["peak_mb"] if base["peak_mb"] else 0.0
+        flag = "  <-- slower" if time_change > 10 else ""
+        print(f"{r['pages']:>6} pages  {r['stage']:<14}{time_change:>+8.1f}% time {memory_change:>+8.1f}% memory{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic books, offline.")
+    parser.add_argument("--pages", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Book sizes in pages (default is 10 300 3000)")
+    parser.add_argument("--words-per-page", type=int, default=250, help="Words per synthetic page (default is 250)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock OpenAI latency in seconds (default is 0.05)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Pages in flight for revise (default is 32)")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["review", "revise"], help="Stages to leave out")
+    parser.add_argument("--results", default=RESULTS_PATH, help=f"Results file (default is {RESULTS_PATH})")
+    parser.add_argument("--compare", action="store_true", help="Compare with the previous commit's results")
+    parser.add_argument("--startup", action="store_true",
+                        help="Measure the startup cost of each stage script instead")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per stage for --startup (default is 5)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ["DEDA_METRICS"] = "0"
+    previous = load_results(args.results)
+    commit = git_commit()
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    if args.startup:
+        current = [{"commit": commit, "timestamp": timestamp, "python": sys.version.split()[0], **result}
+                   for result in bench_startup(args.repeats, max(args.pages))]
+        save_results(args.results, current)
+        if args.compare and current:
+            compare(previous, current)
+        return
+
+    # Imported up front so module loading is not counted against the first stage
+    import digest, revise, draft, review, align
+    digest.init_dictionary()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # A page-sized image for the review documents
+        import fitz
+        image_path = os.path.join(scratch, "page.png")
+        fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 1280, 1632), False).save(image_path)
+
+        current = []
+        for pages in args.pages:
+            for result in run_size(pages, args.words_per_page, args.latency, args.concurrency, image_path, args.skip):
+                current.append({"commit": commit, "timestamp": timestamp, "python": sys.version.split()[0], **result})
+
+    save_results(args.results, current)
+
+    if args.compare and current:
+        compare(previous, current)
+
+if __name__ == "__main__":
+    main()
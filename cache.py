@@ -0,0 +1,102 @@
+"""
+Content-addressed on-disk cache shared by the pipeline stages.
+
+Entries are files named by a hash key, so identical inputs map to the same entry no matter
+which page or path they came from. The store is bounded in size and evicts the least
+recently used entries; the modification time of an entry doubles as its last-access time.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+
+def hash_key(*parts):
+    """Returns a SHA-256 hex digest over the given str/bytes parts, each length-prefixed."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+class DiskCache:
+    """Size-bounded key/value store on disk with LRU eviction and hit/miss statistics."""
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        """Yields (path, mtime, size) for every entry in the store."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        """Returns the cached bytes for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        # Mark the entry as recently used
+        os.utime(path)
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores bytes under key, evicting old entries if the store grows past max_bytes."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False, suffix=".tmp") as f:
+            f.write(value)
+            temp_path = f.name
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self.total_bytes += len(value) - previous_size
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the store is back under 90% of its budget
+        target = self.max_bytes * 0.9
+        for path, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        """Returns a one-line summary of cache usage."""
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.evictions} evictions, {self.total_bytes / 1e6:.1f} MB stored")
@@ -0,0 +1,89 @@
+"""
+Single entry point for the pipeline stages.
+
+Each subcommand runs the stage script of the same name with the remaining arguments, importing
+only that stage, so `deda.py digest` never loads google-cloud-vision, openai or python-docx.
+With --files-from, the paths listed in a file (or on stdin with '-') are appended to the stage's
+arguments, so one process, with one Vision or OpenAI client, handles every page instead of one
+interpreter being started per page.
+
+Usage:
+    python deda.py extract --output-dir extracts slices
+    ls digests/page_1*.json | python deda.py revise --files-from - --output-dir revised
+    python deda.py digest --output-dir digests --files-from changed.txt
+"""
+import sys
+import argparse
+import importlib
+
+# Subcommand -> (module, summary)
+STAGES = {
+    "slice": ("slice", "Render PDF pages to images"),
+    "dedupe": ("dedupe", "Find duplicate and re-scanned page images"),
+    "extract": ("extract", "OCR page images with Google Cloud Vision"),
+    "digest": ("digest", "Reduce OCR responses to words, confidences and breaks"),
+    "revise": ("revise", "Correct OCR text with OpenAI"),
+    "review": ("review", "Build the review documents"),
+    "assemble": ("assemble", "Assemble revised pages into the draft and chapter files"),
+    "draft": ("draft", "Format the draft with OpenAI"),
+    "translate": ("translate", "Translate the Russian chapter files into English"),
+    "pipeline": ("pipeline", "Run every stage incrementally, page by page"),
+}
+
+# Stages whose command line takes any number of input paths
+FILE_LIST_STAGES = ("extract", "digest", "revise")
+
+def read_file_list(source):
+    """Reads one path per line from a file, or from stdin for '-', skipping blank lines and # comments."""
+    stream = sys.stdin if source == "-" else open(source, 'r', encoding='utf-8')
+    try:
+        return [line.strip() for line in stream if line.strip() and not line.lstrip().startswith("#")]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def run_stage(stage, args):
+    """Imports a stage module and runs its command line with args."""
+    module_name = STAGES[stage][0]
+    module = importlib.import_module(module_name)
+    sys.argv = [f"deda.py {stage}"] + args
+    return module.main()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a pipeline stage. Everything after the stage name is passed to it; "
+                    "see 'deda.py STAGE --help'.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="stages:\n" + "\n".join(f"  {name:<10}{summary}" for name, (_, summary) in STAGES.items()))
+    parser.add_argument("--files-from", metavar="FILE",
+                        help=f"Append the paths listed in FILE ('-' for stdin) to the stage's inputs "
+                             f"({', '.join(FILE_LIST_STAGES)})")
+    parser.add_argument("stage", choices=STAGES, help="Stage to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments for the stage")
+    args = parser.parse_args()
+
+    stage_args = args.args
+    # --files-from may also follow the stage name
+    files_from = args.files_from
+    if "--files-from" in stage_args:
+        position = stage_args.index("--files-from")
+        if position + 1 >= len(stage_args):
+            parser.error("--files-from requires a file name")
+        files_from = stage_args[position + 1]
+        stage_args = stage_args[:position] + stage_args[position + 2:]
+
+    if files_from:
+        if args.stage not in FILE_LIST_STAGES:
+            parser.error(f"--files-from is not supported by {args.stage}")
+        try:
+            paths = read_file_list(files_from)
+        except OSError as e:
+            parser.error(f"Unable to read {files_from}: {e}")
+        if not paths:
+            parser.error(f"No paths in {files_from}")
+        stage_args = stage_args + paths
+
+    run_stage(args.stage, stage_args)
+
+if __name__ == "__main__":
+    main()
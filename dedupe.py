@@ -0,0 +1,251 @@
+"""
+Duplicate page detection across overlapping scans.
+
+Scans arrive as range-named PDFs, and a re-scan or an overlapping range gives the same page
+again under another slices/page_NNN.png. Each page image is reduced to a perceptual hash: the
+image is shrunk and converted to grayscale by PyMuPDF, averaged down to 64x64 with NumPy, and
+the signs of its 16x16 lowest 2-D DCT frequencies against their median make a 256-bit hash.
+On the book's slices a re-scanned page lands within about 25 bits of the first scan, while
+different pages are 70 or more bits apart.
+
+Near-duplicates are found in one pass over the pages with a banded index: the hash is cut into
+32 bands of 8 bits and two pages are compared only if they share a band, which by the pigeonhole
+principle never misses a pair within 31 bits. Each duplicate is mapped to the first page it
+repeats, and the map is written to duplicates.json:
+
+    {"page_183": {"original": "page_181", "distance": 4}, ...}
+
+extract.py and revise.py take --duplicates to copy the original's result for such pages
+instead of calling Vision or OpenAI again. Hashes are cached by file size and modification
+time, so a rerun only hashes new or re-sliced pages.
+
+Usage:
+    python dedupe.py slices
+    python dedupe.py slices --max-distance 12 --output duplicates.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from fsutil import IMAGE_EXTENSIONS, unique_images, write_atomic, write_if_changed
+from slice import load_pixmap
+
+DEFAULT_MAP_PATH = "duplicates.json"
+DEFAULT_HASH_CACHE = os.path.join(".cache", "phash.json")
+
+SAMPLE_SIZE = 64       # side of the averaged grayscale image
+HASH_SIZE = 16         # side of the block of low frequencies kept; the hash has HASH_SIZE**2 bits
+BAND_BITS = 8
+DEFAULT_MAX_DISTANCE = 28
+# Pages this flat (blank or nearly so) are not hashed; they would all match each other
+MIN_CONTRAST = 2.0
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II matrix, so the 2-D DCT of x is D @ x @ D.T."""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+DCT = _dct_matrix(SAMPLE_SIZE)
+
+def page_name(path):
+    """page_NNN for slices/page_NNN.png, digests/page_NNN.json or extracts/page_NNN.json.gz."""
+    return os.path.basename(path).split(".", 1)[0]
+
+def grayscale_sample(image_path, size=SAMPLE_SIZE):
+    """The image as a size x size float array of mean gray levels."""
+    pix = load_pixmap(image_path)
+    # Halve the image while it stays at least twice the sample size, before converting it
+    shrink = 0
+    while min(pix.width, pix.height) >> (shrink + 1) >= 2 * size:
+        shrink += 1
+    if shrink:
+        pix.shrink(shrink)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.n != 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+    # Area average into size x size cells
+    rows = np.linspace(0, pix.height, size + 1).astype(int)
+    columns = np.linspace(0, pix.width, size + 1).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(pixels.astype(np.float64), rows[:-1], axis=0), columns[:-1], axis=1)
+    return sums / np.outer(np.diff(rows), np.diff(columns))
+
+def perceptual_hash(image_path):
+    """
+    The 256-bit perceptual hash of an image as an int, or None for a blank page.
+    """
+    sample = grayscale_sample(image_path)
+    if sample.std() < MIN_CONTRAST:
+        return None
+    low = (DCT @ sample @ DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only says how dark the page is, so it is left out of the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def _hash_file(image_path):
+    return image_path, perceptual_hash(image_path)
+
+def collect_images(paths):
+    """Expands directories into the page images they contain."""
+    image_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            image_paths.extend(os.path.join(path, name) for name in os.listdir(path)
+                               if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            image_paths.append(path)
+    return sorted(unique_images(image_paths), key=lambda path: (page_number(path), path))
+
+def page_number(path):
+    match = re.search(r'(\d+)', os.path.basename(path))
+    return int(match.group(1)) if match else 0
+
+def hash_images(image_paths, cache_path=DEFAULT_HASH_CACHE, jobs=None):
+    """
+    Perceptual hashes of the images, in a process pool for those not in the hash cache.
+
+    Returns:
+        dict: {image path: hash or None}
+    """
+    cache = {}
+    if cache_path:
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            cache = {}
+
+    hashes, stamps, pending = {}, {}, []
+    for image_path in image_paths:
+        stat = os.stat(image_path)
+        stamps[image_path] = f"{stat.st_size}:{stat.st_mtime_ns}"
+        entry = cache.get(os.path.abspath(image_path))
+        if entry and entry[0] == stamps[image_path]:
+            hashes[image_path] = int(entry[1], 16) if entry[1] else None
+        else:
+            pending.append(image_path)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for image_path, value in executor.map(_hash_file, pending, chunksize=16):
+                hashes[image_path] = value
+                cache[os.path.abspath(image_path)] = [stamps[image_path], f"{value:x}" if value is not None else None]
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            write_atomic(cache_path, json.dumps(cache))
+    return hashes
+
+def find_duplicates(hashes, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Maps each page that repeats an earlier page to that page.
+
+    Args:
+        hashes (list): (page name, hash or None) in page order.
+        max_distance (int): Largest Hamming distance between the hashes of duplicates; below
+            HASH_SIZE**2 / BAND_BITS, so the banded index cannot miss a pair.
+
+    Returns:
+        dict: {page name: {"original": page name, "distance": bits}}
+    """
+    bands = HASH_SIZE * HASH_SIZE // BAND_BITS
+    if max_distance >= bands:
+        raise ValueError(f"max_distance must be below {bands}")
+    mask = (1 << BAND_BITS) - 1
+    buckets = [{} for _ in range(bands)]
+    values = {}
+    duplicates = {}
+
+    for name, value in hashes:
+        if value is None:
+            continue
+        keys = [(value >> (band * BAND_BITS)) & mask for band in range(bands)]
+        candidates = set()
+        for bucket, key in zip(buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        best = min(((value ^ values[candidate]).bit_count(), candidate) for candidate in candidates) if candidates else None
+        if best and best[0] <= max_distance:
+            original = duplicates[best[1]]["original"] if best[1] in duplicates else best[1]
+            duplicates[name] = {"original": original, "distance": best[0]}
+        values[name] = value
+        for bucket, key in zip(buckets, keys):
+            bucket.setdefault(key, []).append(name)
+    return duplicates
+
+def load_duplicates(path):
+    """Reads a duplicates map into {page name: original page name}."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return {name: entry["original"] for name, entry in json.load(f).items()}
+
+def split_duplicates(paths, duplicates, has_result):
+    """
+    Separates the inputs whose result can be taken from their original page.
+
+    A duplicate is reused when its original is among the inputs too, and so is processed in the
+    same run, or when has_result(original page name) says the original was processed before.
+
+    Returns:
+        tuple: (paths to process, {path: original page name})
+    """
+    names = {page_name(path) for path in paths}
+    process, reused = [], {}
+    for path in paths:
+        original = duplicates.get(page_name(path))
+        if original and (original in names or has_result(original)):
+            reused[path] = original
+        else:
+            process.append(path)
+    return process, reused
+
+def copy_result(source, destination):
+    """Copies an original page's result to its duplicate. Returns True if the duplicate changed."""
+    with open(source, 'rb') as f:
+        return write_if_changed(destination, f.read())
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate and re-scanned pages among the page images.")
+    parser.add_argument("images", nargs="+", help="Page images or directories of them, such as slices")
+    parser.add_argument("--output", default=DEFAULT_MAP_PATH, help=f"Duplicates map to write (default is {DEFAULT_MAP_PATH})")
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE,
+                        help=f"Largest hash distance, in bits of {HASH_SIZE * HASH_SIZE}, between duplicates "
+                             f"(default is {DEFAULT_MAX_DISTANCE})")
+    parser.add_argument("--hash-cache", default=DEFAULT_HASH_CACHE,
+                        help=f"File that keeps page hashes between runs (default is {DEFAULT_HASH_CACHE})")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of worker processes (default is the number of CPUs)")
+    args = parser.parse_args()
+
+    image_paths = collect_images(args.images)
+    if not image_paths:
+        print("Error: No page images found.")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    hashes = hash_images(image_paths, args.hash_cache, args.jobs)
+    hashed = time.perf_counter()
+    try:
+        duplicates = find_duplicates([(page_name(path), hashes[path]) for path in image_paths], args.max_distance)
+    except ValueError as e:
+        parser.error(str(e))
+    matched = time.perf_counter()
+
+    for name, entry in duplicates.items():
+        print(f"{name} duplicates {entry['original']} ({entry['distance']} bits)")
+    blank = sum(1 for value in hashes.values() if value is None)
+    if write_if_changed(args.output, json.dumps(duplicates, indent=2) + "\n"):
+        print(f"Wrote {args.output}")
+    print(f"{len(duplicates)} duplicates among {len(image_paths)} pages ({blank} blank pages not compared); "
+          f"hashing {hashed - start:.2f}s, matching {(matched - hashed) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,32 @@
+import os
 import json
+import gzip
+import time
 import argparse
 import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import enchant
 
+from fsutil import write_atomic
+from instrument import timed
+from layout import analyze
+
+DICTIONARY_LANGUAGE = "ru_RU"
+
+# Dictionary verdicts are memoized in a bounded LRU map and persisted between runs
+DEFAULT_VERDICT_CACHE = os.path.join(".cache", f"dict_{DICTIONARY_LANGUAGE}.json")
+VERDICT_CACHE_SIZE = 200000
+
+_verdicts = OrderedDict()
+_new_verdicts = {}
+dictionary_seconds = 0.0
+
 def digest(json_data):
     """
     Process the fullTextAnnotation object from the given JSON data.
-    Extract words, their confidence levels, and detected breaks.
+    Extract words, their confidence levels, detected breaks and bounding boxes.
     """
     word_objects = []
 
@@ -37,11 +56,17 @@ def digest(json_data):
                             if "detectedBreak" in symbol_property:
                                 detected_break = symbol_property["detectedBreak"].get("type", "")
 
+                        # Bounding box as [x0, y0, x1, y1]; Vision leaves out coordinates that are 0
+                        vertices = word.get("boundingBox", {}).get("vertices", [])
+                        xs = [vertex.get("x", 0) for vertex in vertices] or [0]
+                        ys = [vertex.get("y", 0) for vertex in vertices] or [0]
+
                         # Add the word with its metadata to the list
                         word_objects.append({
                             "word": word_text,
                             "confidence": confidence,
-                            "detected_break": detected_break
+                            "detected_break": detected_break,
+                            "box": [min(xs), min(ys), max(xs), max(ys)]
                         })
 
         return word_objects
@@ -54,8 +79,9 @@ def digest(json_data):
 
 def combine_words_on_newline_break(word_objects):
     """
-    Combine words with a newline detected break if the combined word exists in the dictionary.
-    The detected break and confidence of the first word will be preserved.
+    Combine words with a newline or hyphen detected break if the combined word exists in the dictionary.
+    The detected break and confidence of the first word will be preserved; a hyphen break gives way to
+    the break of the second word.
 
     Args:
         word_objects: List of word objects with 'word', 'confidence', and 'detected_break'.
@@ -73,8 +99,8 @@ def combine_words_on_newline_break(word_objects):
         detected_break = word_obj["detected_break"]
         confidence = word_obj["confidence"]
 
-        # Check if the detected break is a newline (3 or 5)
-        if detected_break in [3, 5] and i + 1 < len(word_objects):
+        # Check if the detected break ends a line (3, 4 for a hyphen, or 5)
+        if detected_break in [3, 4, 5] and i + 1 < len(word_objects):
             # Get the next word
             next_word_obj = word_objects[i + 1]
             next_word = next_word_obj["word"]
@@ -89,11 +115,15 @@ def combine_words_on_newline_break(word_objects):
             # Check if the combined word exists in the dictionary
             if is_valid_russian_word(combined_word):
                 # If valid, replace the two words with the combined word
-                combined_result.append({
+                combined_word_obj = {
                     "word": combined_word,
                     "confidence": confidence,  # Keep the confidence of the first word
-                    "detected_break": detected_break  # Preserve the detected break of the first word
-                })
+                    # Preserve the detected break of the first word, unless it is the hyphen just removed
+                    "detected_break": next_word_obj["detected_break"] if detected_break == 4 else detected_break
+                }
+                if "box" in word_obj:
+                    combined_word_obj["box"] = word_obj["box"]  # and the box of the first word
+                combined_result.append(combined_word_obj)
                 # Skip the next word since it's already combined
                 i += 2
                 continue
@@ -105,26 +135,190 @@ def combine_words_on_newline_break(word_objects):
     return combined_result
 
 
+def load_extract(path):
+    """Loads an extract written by extract.py, either plain JSON or the compact .json.gz format."""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def is_valid_russian_word(word):
-    return russian_dict.check(word)
+    global dictionary_seconds
+    start = time.perf_counter()
+
+    verdict = _verdicts.get(word)
+    if verdict is None:
+        verdict = russian_dict.check(word)
+        _new_verdicts[word] = verdict
+        _verdicts[word] = verdict
+        if len(_verdicts) > VERDICT_CACHE_SIZE:
+            _verdicts.popitem(last=False)
+    else:
+        _verdicts.move_to_end(word)
+
+    dictionary_seconds += time.perf_counter() - start
+    return verdict
+
+def load_verdicts(path):
+    """Loads persisted dictionary verdicts, or an empty map if there are none yet."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_verdicts(path, verdicts):
+    """Persists the most recent VERDICT_CACHE_SIZE dictionary verdicts."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    recent = dict(list(verdicts.items())[-VERDICT_CACHE_SIZE:])
+    write_atomic(path, json.dumps(recent, ensure_ascii=False))
+
+def init_dictionary(verdicts=None):
+    """Initializes the Russian dictionary and seeds the verdict cache. Runs once per worker."""
+    global russian_dict
+    russian_dict = enchant.Dict(DICTIONARY_LANGUAGE)
+    _verdicts.clear()
+    _verdicts.update(verdicts or {})
+
+def output_path_for(input_file, output_dir):
+    # Compact extracts (page_NNN.json.gz) produce plain page_NNN.json digests
+    base_filename = os.path.basename(input_file)
+    if base_filename.endswith('.gz'):
+        base_filename = base_filename[:-3]
+    return os.path.join(output_dir, base_filename)
+
+def digest_file(input_file, output_file, layout=False):
+    """
+    Digests one extract into output_file in a worker process. With layout, words also get the
+    line and paragraph fields of layout.analyze.
+
+    Returns:
+        tuple: (input_file, error message or None, timings, dictionary verdicts learned from this file)
+    """
+    global dictionary_seconds
+    dictionary_seconds = 0.0
+    _new_verdicts.clear()
+    timings = {}
+
+    try:
+        with timed("digest", "file", file=os.path.basename(input_file)) as fields:
+            start = time.perf_counter()
+            json_data = load_extract(input_file)
+            timings["parse"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            processed_data = combine_words_on_newline_break(digest(json_data))
+            timings["dictionary"] = dictionary_seconds
+            timings["word_walk"] = time.perf_counter() - start - dictionary_seconds
+
+            if layout:
+                start = time.perf_counter()
+                analyze(processed_data)
+                timings["layout"] = time.perf_counter() - start
+
+            output = json.dumps(processed_data, ensure_ascii=False, indent=2)
+            write_atomic(output_file, output)
+            fields.update({name: round(seconds, 6) for name, seconds in timings.items()})
+            fields["words"] = len(processed_data)
+            fields["bytes_written"] = len(output.encode('utf-8'))
+        error = None
+    except Exception as e:
+        error = str(e)
+
+    return input_file, error, timings, dict(_new_verdicts)
+
+def collect_extracts(paths):
+    """Expands directories into the page_*.json and page_*.json.gz extracts they contain."""
+    input_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            input_files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                      if name.startswith('page_') and name.endswith(('.json', '.json.gz'))))
+        else:
+            input_files.append(path)
+    return input_files
+
+def digest_batch(input_files, output_dir, jobs=None, verdict_cache=DEFAULT_VERDICT_CACHE, layout=False):
+    """
+    Digests many extracts in a process pool that loads the dictionary once per worker,
+    then prints a timing report split into parse, word-walk and dictionary time.
+
+    Returns:
+        int: number of files that failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    verdicts = load_verdicts(verdict_cache) if verdict_cache else {}
+    known_verdicts = len(verdicts)
+
+    totals = {"parse": 0.0, "word_walk": 0.0, "dictionary": 0.0}
+    if layout:
+        totals["layout"] = 0.0
+    failed = 0
+    wall_start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_dictionary, initargs=(verdicts,)) as executor:
+        futures = [executor.submit(digest_file, input_file, output_path_for(input_file, output_dir), layout)
+                   for input_file in input_files]
+        for future in futures:
+            input_file, error, timings, new_verdicts = future.result()
+            if error:
+                failed += 1
+                print(f"Error: Failed to process '{input_file}': {error}")
+                continue
+            for name, seconds in timings.items():
+                totals[name] += seconds
+            verdicts.update(new_verdicts)
+            print(f"Digested {input_file} -> {output_path_for(input_file, output_dir)}")
+
+    if verdict_cache:
+        save_verdicts(verdict_cache, verdicts)
+
+    # Timing report; per-stage times are summed over all workers
+    wall = time.perf_counter() - wall_start
+    print(f"Digested {len(input_files) - failed} files, {failed} failed, in {wall:.2f}s wall time")
+    for name, seconds in totals.items():
+        print(f"  {name:<11}{seconds:8.3f}s")
+    print(f"  dictionary verdicts: {known_verdicts} cached before, {len(verdicts) - known_verdicts} learned")
+    return failed
 
 def main():
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Process a JSON file to extract full text annotation into sentences with confidence.")
-    parser.add_argument("input_file", help="Path to the input JSON file.")
+    parser.add_argument("input_file", nargs="+",
+                        help="Path to the input JSON file (.json, or .json.gz in the compact format). "
+                             "With --output-dir, any number of files or directories of extracts.")
+    parser.add_argument("--output-dir", help="Write one digest per input to this directory using a worker pool.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of worker processes (default is the number of CPUs).")
+    parser.add_argument("--verdict-cache", default=DEFAULT_VERDICT_CACHE,
+                        help=f"File that persists dictionary verdicts between runs (default is {DEFAULT_VERDICT_CACHE}).")
+    parser.add_argument("--no-verdict-cache", action="store_true", help="Do not read or write persisted dictionary verdicts.")
+    parser.add_argument("--layout", action="store_true",
+                        help="Reconstruct lines and paragraphs from the word boxes and record them on each word.")
     args = parser.parse_args()
 
+    verdict_cache = None if args.no_verdict_cache else args.verdict_cache
+
+    if args.output_dir:
+        failed = digest_batch(collect_extracts(args.input_file), args.output_dir, args.jobs, verdict_cache,
+                              args.layout)
+        sys.exit(1 if failed else 0)
+
+    if len(args.input_file) != 1:
+        parser.error("multiple input files require --output-dir")
+    args.input_file = args.input_file[0]
+
     # Initialize a Russian dictionary
-    global russian_dict
-    russian_dict = enchant.Dict("ru_RU")
+    init_dictionary(load_verdicts(verdict_cache) if verdict_cache else None)
     try:
         # Load the JSON data from the input file
-        with open(args.input_file, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
+        json_data = load_extract(args.input_file)
 
         # Process the JSON data to extract sentences and confidence
         processed_data = digest(json_data)
         processed_data = combine_words_on_newline_break(processed_data)
+        if args.layout:
+            analyze(processed_data)
 
         # Output the result as JSON to stdout
         print(json.dumps(processed_data, ensure_ascii=False, indent=2))
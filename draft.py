@@ -1,18 +1,27 @@
 import os
 import re
-from openai import OpenAI
+import asyncio
 from dotenv import load_dotenv
 import argparse
 import sys
 
+from batch import DEFAULT_POLL_INTERVAL, add_batch_arguments, run_batch
+from cache import hash_key
+from fsutil import write_atomic
+from llm import add_cache_arguments, cache_from_args, complete, complete_async, get_async_client, get_client
+from ratelimit import RateLimiter
+from tokens import count_tokens
+
 # Load environment variables
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
+FORMAT_MODEL = "gpt-4o-mini"
+
+# Input tokens per chunk. The model returns the whole chunk plus a list of edits,
+# so this has to stay well below the model's output token limit.
+DEFAULT_CHUNK_TOKENS = 3500
 
-def format_text(text):
+def format_request(text):
     prompt = f"""
         Take this draft of a book and make only white space formatting changes to it. Tell me what changes you made at a high-level.
         Desired Output: Provide the corrected version of the text. Do not prefix the output with any text.
@@ -20,73 +29,185 @@ def format_text(text):
         {text}
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    return dict(
+        model=FORMAT_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that formats text."},
             {"role": "user", "content": prompt}
         ],
     )
-    return response.choices[0].message.content
 
-def split_into_chunks(content, chunk_size=10000):
+def format_text(text, cache=None):
+    return complete(get_client(), format_request(text), cache, stage="draft")
+
+def split_into_chunks(content, max_tokens=DEFAULT_CHUNK_TOKENS):
+    """
+    Splits a draft into chunks of whole pages, cutting only in front of [[page_N]] markers.
+    Each chunk holds as many pages as fit in max_tokens; a page longer than that gets a chunk of its own.
+    """
     chunks = []
-    current_chunk = ""
-    for page in re.split(r'(\[\[page_\d+\]\])', content):
-        if page.startswith('[[page_'):
-            if len(current_chunk) + len(page) > chunk_size and current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = page
-            else:
-                current_chunk += page
-        else:
-            if len(current_chunk) + len(page) > chunk_size:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = page
-            else:
-                current_chunk += page
-    if current_chunk:
-        chunks.append(current_chunk)
+    current_pages = []
+    current_tokens = 0
+    for page in re.split(r'(?=\[\[page_\d+\]\])', content):
+        if not page:
+            continue
+        page_tokens = count_tokens(page, FORMAT_MODEL)
+        if current_pages and current_tokens + page_tokens > max_tokens:
+            chunks.append("".join(current_pages))
+            current_pages = []
+            current_tokens = 0
+        current_pages.append(page)
+        current_tokens += page_tokens
+    if current_pages:
+        chunks.append("".join(current_pages))
     return chunks
 
-def process_file(input_file, output_file):
+def split_result(result):
+    """Splits a model response into the formatted text and the description of changes."""
+    parts = result.split("\nEdits:", 1)
+    if len(parts) == 2:
+        return parts[0], parts[1].strip()
+    return parts[0], "No changes described."
+
+def checkpoint_dir_for(output_file):
+    return output_file + ".chunks"
+
+def checkpoint_path(checkpoint_dir, chunk):
+    # Named by the full request so a changed chunk or prompt is never answered from a stale checkpoint
+    return os.path.join(checkpoint_dir, hash_key(repr(format_request(chunk))) + ".txt")
+
+async def format_chunk(async_client, chunk, limiter, checkpoint_dir, cache=None):
+    """Formats one chunk, reusing its checkpoint from an earlier interrupted run if there is one."""
+    path = checkpoint_path(checkpoint_dir, chunk)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    result = await complete_async(async_client, format_request(chunk), limiter, cache, stage="draft")
+    write_atomic(path, result)
+    return result
+
+async def process_file_async(input_file, output_file, max_tokens=DEFAULT_CHUNK_TOKENS, concurrency=4,
+                             rpm=500, tpm=200000, cache=None):
+    """
+    Formats a draft chunk by chunk with several chunks in flight at once.
+
+    Results are streamed in the original order, as soon as every earlier chunk is done, into a
+    temporary file that replaces output_file once every chunk is written, so a failed run never
+    leaves a truncated output. Each completed chunk is also checkpointed next to the output, so
+    a failed run can be resumed without formatting finished chunks again; the checkpoints are
+    removed once the whole file has been written.
+    """
     with open(input_file, 'r', encoding='utf-8') as f:
         content = f.read()
 
-    chunks = split_into_chunks(content)
-    formatted_content = ""
-    all_changes = []
+    chunks = split_into_chunks(content, max_tokens)
+    checkpoint_dir = checkpoint_dir_for(output_file)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    async_client = get_async_client()
+    limiter = RateLimiter(rpm, tpm)
+    semaphore = asyncio.Semaphore(concurrency)
 
-    for i, chunk in enumerate(chunks):
-        print(f"Processing chunk {i+1}/{len(chunks)}...", file=sys.stderr)
-        result = format_text(chunk)
+    async def run(i, chunk):
+        async with semaphore:
+            print(f"Processing chunk {i+1}/{len(chunks)}...", file=sys.stderr)
+            return i, await format_chunk(async_client, chunk, limiter, checkpoint_dir, cache)
 
-        parts = result.split("\nEdits:", 1)
-        if len(parts) == 2:
-            formatted_text, change_description = parts
-        else:
-            formatted_text = parts[0]
-            change_description = "No changes described."
+    all_changes = [None] * len(chunks)
+    finished = {}
+    next_to_write = 0
+    temp_file = output_file + ".tmp"
+    tasks = [asyncio.ensure_future(run(i, chunk)) for i, chunk in enumerate(chunks)]
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as out:
+            for task in asyncio.as_completed(tasks):
+                i, result = await task
+                finished[i] = result
 
-        formatted_content += formatted_text
-        all_changes.append(change_description.strip())
+                # Stream every chunk whose predecessors are all written
+                while next_to_write in finished:
+                    formatted_text, change_description = split_result(finished.pop(next_to_write))
+                    out.write(formatted_text)
+                    out.flush()
+                    all_changes[next_to_write] = change_description
+                    next_to_write += 1
+        os.replace(temp_file, output_file)
+    finally:
+        # On failure, stop the chunks still in flight; finished ones are kept as checkpoints
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        await async_client.close()
 
-    # Write formatted content to output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(formatted_content)
+    for name in os.listdir(checkpoint_dir):
+        os.remove(os.path.join(checkpoint_dir, name))
+    os.rmdir(checkpoint_dir)
 
     print(f"Formatted text written to {output_file}", file=sys.stderr)
     print("\nFormatting changes:", file=sys.stderr)
     print("\n".join(all_changes), file=sys.stderr)
+    if cache is not None:
+        print(f"\nLLM cache: {cache.stats()}", file=sys.stderr)
+
+def process_file(input_file, output_file, cache=None, max_tokens=DEFAULT_CHUNK_TOKENS, concurrency=4,
+                 rpm=500, tpm=200000):
+    asyncio.run(process_file_async(input_file, output_file, max_tokens, concurrency, rpm, tpm, cache))
+
+def process_file_batch(input_file, output_file, jsonl_path, cache=None, max_tokens=DEFAULT_CHUNK_TOKENS,
+                       poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Formats a draft through the Batch API, one request per chunk, and writes the chunks in order.
+    Nothing is written unless every chunk came back.
+
+    Returns:
+        int: number of chunks that failed.
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    chunks = split_into_chunks(content, max_tokens)
+    items = [(f"chunk-{i + 1:04d}", format_request(chunk)) for i, chunk in enumerate(chunks)]
+    contents, errors = run_batch(get_client(), items, jsonl_path, cache, poll_interval, stage="draft")
+    if errors:
+        for custom_id, error in errors.items():
+            print(f"Error: Failed to format {custom_id}: {error}", file=sys.stderr)
+        return len(errors)
+
+    formatted_texts, all_changes = [], []
+    for custom_id, _ in items:
+        formatted_text, change_description = split_result(contents[custom_id])
+        formatted_texts.append(formatted_text)
+        all_changes.append(change_description)
+    write_atomic(output_file, "".join(formatted_texts))
+
+    print(f"Formatted text written to {output_file}", file=sys.stderr)
+    print("\nFormatting changes:", file=sys.stderr)
+    print("\n".join(all_changes), file=sys.stderr)
+    return 0
 
 def main():
     parser = argparse.ArgumentParser(description="Format text using OpenAI's GPT-4 model.")
     parser.add_argument('input_file', help="Path to the input file containing the text to be formatted.")
     parser.add_argument('output_file', help="Path to the output file where the formatted text will be written.")
+    parser.add_argument('--chunk-tokens', type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help=f"Token budget per chunk of whole pages (default is {DEFAULT_CHUNK_TOKENS}).")
+    parser.add_argument('--concurrency', type=int, default=4, help="Maximum chunks in flight (default is 4).")
+    parser.add_argument('--rpm', type=int, default=500, help="Requests-per-minute budget (default is 500).")
+    parser.add_argument('--tpm', type=int, default=200000, help="Tokens-per-minute budget (default is 200000).")
+    add_cache_arguments(parser)
+    add_batch_arguments(parser)
     args = parser.parse_args()
 
-    process_file(args.input_file, args.output_file)
+    if args.batch:
+        failed = process_file_batch(args.input_file, args.output_file, args.batch, cache_from_args(args),
+                                    args.chunk_tokens, args.poll_interval)
+        sys.exit(1 if failed else 0)
+
+    process_file(args.input_file, args.output_file, cache_from_args(args), args.chunk_tokens, args.concurrency,
+                 args.rpm, args.tpm)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
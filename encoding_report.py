@@ -0,0 +1,82 @@
+"""
+Compare slice settings by upload size and OCR confidence.
+
+Each run is a slices directory and the digests directory produced from it, for example one made with
+`python slice.py --dpi 150 --grayscale --output-format "page_%03d.jpg" --quality 80 pdfs slices_jpeg80/`
+and then extracted and digested into digests_jpeg80/. Pages are matched by name, so runs can be compared
+page for page.
+
+Usage:
+    python encoding_report.py --run slices digests --run slices_jpeg80 digests_jpeg80
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+
+from fsutil import IMAGE_EXTENSIONS
+
+# Words below this confidence are the ones worth an LLM correction pass
+LOW_CONFIDENCE = 0.8
+
+def page_name(path):
+    """'slices/page_012.png' and 'digests/page_012.json' are both page 'page_012'."""
+    return re.sub(r'\.(json|png|jpe?g|webp)$', '', os.path.basename(path), flags=re.IGNORECASE)
+
+def image_sizes(slices_dir):
+    return {page_name(name): os.path.getsize(os.path.join(slices_dir, name))
+            for name in os.listdir(slices_dir) if name.lower().endswith(IMAGE_EXTENSIONS)}
+
+def digest_confidences(digests_dir):
+    confidences = {}
+    for name in os.listdir(digests_dir):
+        if name.endswith(".json"):
+            with open(os.path.join(digests_dir, name), 'r', encoding='utf-8') as f:
+                confidences[page_name(name)] = [word.get("confidence", 0.0) for word in json.load(f)]
+    return confidences
+
+def summarize_run(slices_dir, digests_dir):
+    sizes = image_sizes(slices_dir)
+    confidences = digest_confidences(digests_dir)
+    pages = sorted(set(sizes) & set(confidences))
+    words = [confidence for page in pages for confidence in confidences[page]]
+    page_means = [statistics.fmean(confidences[page]) for page in pages if confidences[page]]
+    return {
+        "run": slices_dir,
+        "pages": len(pages),
+        "unmatched": len(set(sizes) ^ set(confidences)),
+        "bytes_per_page": statistics.fmean(sizes[page] for page in pages) if pages else 0,
+        "total_mb": sum(sizes[page] for page in pages) / 1e6,
+        "mean_confidence": statistics.fmean(words) if words else 0.0,
+        "low_confidence_words": sum(1 for c in words if c < LOW_CONFIDENCE) / len(words) if words else 0.0,
+        "worst_page": min(page_means) if page_means else 0.0,
+    }
+
+def print_report(summaries):
+    print(f"{'run':<24}{'pages':>6}{'KB/page':>10}{'total MB':>10}{'mean conf':>11}{'low conf':>10}{'worst page':>12}")
+    for s in summaries:
+        print(f"{s['run']:<24}{s['pages']:>6}{s['bytes_per_page'] / 1000:>10.1f}{s['total_mb']:>10.2f}"
+              f"{s['mean_confidence']:>11.4f}{s['low_confidence_words']:>9.1%}{s['worst_page']:>12.4f}")
+        if s["unmatched"]:
+            print(f"  {s['unmatched']} pages have an image or a digest but not both and were left out.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report bytes per page and OCR confidence for slice settings.")
+    parser.add_argument("--run", nargs=2, action="append", metavar=("SLICES_DIR", "DIGESTS_DIR"),
+                        help="A slices directory and its digests; repeat to compare settings "
+                             "(default is slices digests)")
+    args = parser.parse_args()
+
+    runs = args.run or [("slices", "digests")]
+    for slices_dir, digests_dir in runs:
+        for directory in (slices_dir, digests_dir):
+            if not os.path.isdir(directory):
+                print(f"Error: The directory '{directory}' does not exist.")
+                sys.exit(1)
+
+    print_report([summarize_run(slices_dir, digests_dir) for slices_dir, digests_dir in runs])
+
+if __name__ == "__main__":
+    main()
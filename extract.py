@@ -1,32 +1,127 @@
 import os
 import io
+import sys
+import gzip
+import time
+import random
 import argparse
-from google.cloud import vision
-from google.auth.exceptions import DefaultCredentialsError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 from dotenv import load_dotenv
 
+from cache import DiskCache, hash_key
+from fsutil import IMAGE_EXTENSIONS, unique_images, write_atomic, write_if_changed
+from instrument import emit, timed
+
 load_dotenv()
 
-# Load environment variables
-GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Vision accepts at most 16 images per synchronous batch_annotate_images request
+MAX_BATCH_SIZE = 16
+
+# Everything about the request besides the image bytes; part of the OCR cache key
+FEATURE_CONFIG = json.dumps({"features": ["DOCUMENT_TEXT_DETECTION"]}, sort_keys=True)
+
+# Output formats for batch mode: the full response as JSON, or a pruned, gzip-compressed
+# JSON with only what digest.py and later stages read
+OUTPUT_FORMATS = {"json": ".json", "compact": ".json.gz"}
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "ocr")
+DEFAULT_CACHE_MAX_MB = 2048
+
+_client = None
+
+def transient_errors():
+    """The gRPC errors worth retrying; anything else fails the batch immediately."""
+    # The Vision and gRPC libraries are imported only once a request is made
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.Aborted,
+    )
+
+def get_client():
+    """Returns the Google Cloud Vision client, creating it on first use."""
+    global _client
+    if _client is None:
+        from google.cloud import vision
+        from google.auth.exceptions import DefaultCredentialsError
+
+        # Check if the Google Application Credentials are set
+        if not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+            raise EnvironmentError("The GOOGLE_APPLICATION_CREDENTIALS environment variable is not set.")
 
-# Check if the Google Application Credentials are set
-if not GOOGLE_APPLICATION_CREDENTIALS:
-    raise EnvironmentError("The GOOGLE_APPLICATION_CREDENTIALS environment variable is not set.")
+        # Initialize the Google Cloud Vision client
+        try:
+            _client = vision.ImageAnnotatorClient()
+        except DefaultCredentialsError as e:
+            raise DefaultCredentialsError(f"Failed to authenticate with Google Cloud: {e}")
+    return _client
 
-# Initialize the Google Cloud Vision client
-try:
-    client = vision.ImageAnnotatorClient()
-except DefaultCredentialsError as e:
-    raise DefaultCredentialsError(f"Failed to authenticate with Google Cloud: {e}")
+def response_to_json_string(response):
+    """Converts an AnnotateImageResponse to a JSON string without Unicode escape sequences."""
+    # to_dict goes straight from the message to Python objects, without an intermediate JSON string
+    response_json = type(response).to_dict(response, preserving_proto_field_name=False)
+    return json.dumps(response_json, ensure_ascii=False)
+
+def prune_response(response_json):
+    """
+    Keeps only the parts of a response that downstream stages read: page sizes, word boxes and
+    confidences, and symbol text with detected breaks. The nesting of fullTextAnnotation is
+    preserved, so digest.py reads the result like a full response.
+    """
+    pages = []
+    for page in response_json.get("fullTextAnnotation", {}).get("pages", []):
+        blocks = []
+        for block in page.get("blocks", []):
+            paragraphs = []
+            for paragraph in block.get("paragraphs", []):
+                words = []
+                for word in paragraph.get("words", []):
+                    symbols = []
+                    for symbol in word.get("symbols", []):
+                        pruned_symbol = {"text": symbol.get("text", "")}
+                        detected_break = symbol.get("property", {}).get("detectedBreak")
+                        if detected_break:
+                            pruned_symbol["property"] = {"detectedBreak": {"type": detected_break.get("type", 0)}}
+                        symbols.append(pruned_symbol)
+                    words.append({
+                        "boundingBox": {"vertices": word.get("boundingBox", {}).get("vertices", [])},
+                        "confidence": word.get("confidence", 0.0),
+                        "symbols": symbols,
+                    })
+                paragraphs.append({"words": words})
+            blocks.append({"paragraphs": paragraphs})
+        pages.append({"width": page.get("width", 0), "height": page.get("height", 0), "blocks": blocks})
+    return {"fullTextAnnotation": {"pages": pages}}
+
+def compact_json_bytes(response_json_string):
+    """Converts a full response JSON string into the gzip-compressed pruned format."""
+    pruned = prune_response(json.loads(response_json_string))
+    # mtime=0 keeps the bytes the same for the same response, so unchanged pages are not rewritten
+    return gzip.compress(json.dumps(pruned, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), mtime=0)
+
+def ocr_cache_key(content, client=None):
+    """
+    Cache key for an image: its bytes plus the Vision feature configuration. Stand-in clients
+    such as the fake one name a cache_namespace, so their responses never answer real requests.
+    """
+    namespace = getattr(client, "cache_namespace", None)
+    if namespace:
+        return hash_key(namespace, FEATURE_CONFIG, content)
+    return hash_key(FEATURE_CONFIG, content)
 
-def extract_text_from_image(image_path):
+def extract_text_from_image(image_path, client=None, cache=None):
     """
     Extracts text from an image using Google Cloud Vision API.
 
     Args:
         image_path (str): Path to the image file.
+        client: Vision client to use. Defaults to the shared client from get_client().
+        cache (DiskCache): Optional OCR response cache. Images whose bytes were seen before
+            are answered from the cache without calling Vision.
 
     Returns:
         str: Extracted text from the image in JSON format without Unicode escape sequences.
@@ -39,18 +134,30 @@ def extract_text_from_image(image_path):
         # Load image into memory
         with io.open(image_path, 'rb') as image_file:
             content = image_file.read()
+
+        if cache is not None:
+            cached = cache.get(ocr_cache_key(content, client))
+            if cached is not None:
+                emit("extract", "cache_hit", image=os.path.basename(image_path))
+                return cached.decode('utf-8')
+
+        from google.cloud import vision
+
+        client = client or get_client()
         image = vision.Image(content=content)
 
-        # Perform text detection on the image
-        response = client.document_text_detection(image=image)
+        with timed("extract", "call", image=os.path.basename(image_path), bytes_sent=len(content)) as fields:
+            # Perform text detection on the image
+            response = client.document_text_detection(image=image)
 
-        # Check for errors in the response
-        if response.error.message:
-            raise Exception(f"Error during text detection: {response.error.message}")
+            # Check for errors in the response
+            if response.error.message:
+                raise Exception(f"Error during text detection: {response.error.message}")
 
-        # Convert response to JSON string and ensure characters are not escaped
-        response_json = json.loads(vision.AnnotateImageResponse.to_json(response))
-        response_json_string = json.dumps(response_json, ensure_ascii=False)
+            response_json_string = response_to_json_string(response)
+            fields["bytes_received"] = len(response_json_string.encode('utf-8'))
+        if cache is not None:
+            cache.put(ocr_cache_key(content, client), response_json_string.encode('utf-8'))
 
         return response_json_string
 
@@ -58,14 +165,240 @@ def extract_text_from_image(image_path):
         print(f"An error occurred: {e}")
         return ""
 
+def call_with_retries(call, max_retries=5, base_delay=1.0, max_delay=32.0, fields=None):
+    """
+    Calls `call()`, retrying transient gRPC errors with jittered exponential backoff.
+    Retries are counted in fields["retries"] if instrumentation fields are given.
+    """
+    for attempt in range(max_retries + 1):
+        if attempt and fields is not None:
+            fields["retries"] = attempt
+        try:
+            return call()
+        except transient_errors() as e:
+            if attempt == max_retries:
+                raise
+            # Full jitter: sleep a random amount up to the exponential backoff ceiling
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Transient error: {e}. Retrying in {delay:.1f}s...", file=sys.stderr)
+            time.sleep(delay)
+
+def annotate_batch(client, image_paths, max_retries=5):
+    """
+    Sends one batch_annotate_images request for the given images.
+
+    Responses are converted to JSON strings here, on the worker thread.
+
+    Returns:
+        list: (image_path, content, response JSON string or None, error message) tuples in the order of image_paths.
+    """
+    from google.cloud import vision
+
+    contents = []
+    requests = []
+    for image_path in image_paths:
+        with io.open(image_path, 'rb') as image_file:
+            content = image_file.read()
+        contents.append(content)
+        requests.append({
+            "image": {"content": content},
+            "features": [{"type_": vision.Feature.Type.DOCUMENT_TEXT_DETECTION}],
+        })
+
+    with timed("extract", "batch", images=len(requests), bytes_sent=sum(len(c) for c in contents)) as fields:
+        batch_response = call_with_retries(lambda: client.batch_annotate_images(requests=requests), max_retries,
+                                           fields=fields)
+        results = []
+        for image_path, content, response in zip(image_paths, contents, batch_response.responses):
+            if response.error.message:
+                results.append((image_path, content, None, response.error.message))
+            else:
+                results.append((image_path, content, response_to_json_string(response), None))
+        fields["bytes_received"] = sum(len(r[2].encode('utf-8')) for r in results if r[2])
+    return results
+
+def encode_output(response_json_string, output_format):
+    """Returns the bytes to write for a response in the given output format."""
+    if output_format == "compact":
+        return compact_json_bytes(response_json_string)
+    return response_json_string.encode('utf-8')
+
+def collect_images(paths):
+    """
+    Expands directories into the image files they contain, sorted by name. A page found in two
+    formats is taken once, from its newest file, since both would write the same output.
+    """
+    image_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            image_paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                      if name.lower().endswith(IMAGE_EXTENSIONS)))
+        else:
+            image_paths.append(path)
+    return unique_images(image_paths)
+
+def output_path_for(image_path, output_dir, output_format="json"):
+    base_filename = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_dir, base_filename + OUTPUT_FORMATS[output_format])
+
+def is_up_to_date(json_file, image_path):
+    """An output is up to date if it exists and is newer than its image."""
+    return os.path.exists(json_file) and os.path.getmtime(json_file) >= os.path.getmtime(image_path)
+
+def extract_batch(image_paths, output_dir, client=None, batch_size=MAX_BATCH_SIZE, max_in_flight=4,
+                  max_retries=5, force=False, cache=None, output_format="json", duplicates=None):
+    """
+    Extracts text from many images with batched, concurrent Vision requests.
+    Each result is written atomically to output_dir/<image name>.json (or .json.gz for the
+    compact format) as soon as its batch returns.
+
+    With a cache, an image is sent to Vision only if its bytes have not been seen before and it
+    has no output newer than itself, so re-sliced pages are always re-extracted and renamed,
+    moved or previously extracted pages never are. Without a cache, images that already have an
+    output file are skipped. Force sends every image.
+
+    With a duplicates map from dedupe.py, a page that repeats another page is not sent to Vision;
+    it gets a copy of the original page's output once that exists.
+
+    Returns:
+        tuple: (saved, skipped, failed) counts.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    def original_output(name):
+        return os.path.join(output_dir, name + OUTPUT_FORMATS[output_format])
+
+    reused = {}
+    if duplicates:
+        # dedupe loads PyMuPDF and NumPy, which only runs with a duplicates map need
+        from dedupe import copy_result, split_duplicates
+        image_paths, reused = split_duplicates(image_paths, duplicates,
+                                               lambda name: os.path.exists(original_output(name)))
+
+    pending = []
+    skipped = 0
+    for image_path in image_paths:
+        json_file = output_path_for(image_path, output_dir, output_format)
+        if cache is not None and not force:
+            with io.open(image_path, 'rb') as image_file:
+                cached = cache.get(ocr_cache_key(image_file.read(), client))
+            if cached is not None:
+                emit("extract", "cache_hit", image=os.path.basename(image_path))
+                if write_if_changed(json_file, encode_output(cached.decode('utf-8'), output_format)):
+                    print(f"Saved cached output to {json_file}")
+                skipped += 1
+                continue
+            # Not in the cache, as for pages extracted before it existed: an output written
+            # after the image was last sliced still belongs to it
+            if is_up_to_date(json_file, image_path):
+                skipped += 1
+                continue
+        elif not force and os.path.exists(json_file):
+            skipped += 1
+            continue
+        pending.append(image_path)
+
+    if pending:
+        client = client or get_client()
+
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    saved = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {executor.submit(annotate_batch, client, batch, max_retries): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                failed += len(futures[future])
+                print(f"Error: Batch starting at {futures[future][0]} failed: {e}")
+                continue
+
+            for image_path, content, response_json_string, error in results:
+                if error:
+                    failed += 1
+                    print(f"Error: Failed to process {image_path}: {error}")
+                    continue
+                json_file = output_path_for(image_path, output_dir, output_format)
+                write_atomic(json_file, encode_output(response_json_string, output_format))
+                if cache is not None:
+                    cache.put(ocr_cache_key(content, client), response_json_string.encode('utf-8'))
+                saved += 1
+                print(f"Saved output to {json_file}")
+
+    for image_path, original in reused.items():
+        json_file = output_path_for(image_path, output_dir, output_format)
+        source = original_output(original)
+        if not os.path.exists(source):
+            failed += 1
+            print(f"Error: Failed to process {image_path}: {original}, which it duplicates, has no output")
+            continue
+        if copy_result(source, json_file):
+            print(f"Saved output of {original} to {json_file}")
+        emit("extract", "duplicate", image=os.path.basename(image_path), original=original)
+        skipped += 1
+
+    duplicate_note = f" ({len(reused)} duplicate pages)" if reused else ""
+    print(f"Extracted {saved} images, {skipped} already extracted{duplicate_note}, {failed} failed.")
+    if cache is not None:
+        print(f"OCR cache: {cache.stats()}")
+    return saved, skipped, failed
+
 def main():
     # Set up argument parsing
     parser = argparse.ArgumentParser(description='Extract text from an image using Google Cloud Vision API.')
-    parser.add_argument('image_path', type=str, help='Path to the image file')
+    parser.add_argument('image_path', type=str, nargs='+',
+                        help='Path to the image file. With --output-dir, any number of images or directories of images')
+    parser.add_argument('--output-dir', type=str,
+                        help='Write one JSON file per image to this directory using batched requests')
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default='json',
+                        help="Output format for --output-dir: full 'json' or pruned, gzip-compressed 'compact' (.json.gz)")
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE,
+                        help=f'Images per batch_annotate_images request (default and maximum is {MAX_BATCH_SIZE})')
+    parser.add_argument('--max-in-flight', type=int, default=4, help='Maximum concurrent requests (default is 4)')
+    parser.add_argument('--max-retries', type=int, default=5, help='Retries for transient errors (default is 5)')
+    parser.add_argument('--force', action='store_true',
+                        help='Send every image to Vision, ignoring existing output and cached responses')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                        help=f'Directory of the OCR response cache (default is {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_MB,
+                        help=f'Size limit of the OCR response cache in MB (default is {DEFAULT_CACHE_MAX_MB})')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the OCR response cache')
+    parser.add_argument('--duplicates', metavar='JSON',
+                        help='Duplicates map from dedupe.py; with --output-dir, duplicate pages reuse their original\'s output')
+    parser.add_argument('--fake', action='store_true',
+                        help='Use the offline fake Vision client from fake_vision.py instead of the real API')
+    parser.add_argument('--fake-latency', type=float, default=0.5,
+                        help='Simulated request latency in seconds for --fake (default is 0.5)')
     args = parser.parse_args()
 
+    client = None
+    if args.fake:
+        from fake_vision import FakeImageAnnotatorClient
+        client = FakeImageAnnotatorClient(latency=args.fake_latency)
+
+    cache = None
+    if not args.no_cache:
+        cache = DiskCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+
+    duplicates = None
+    if args.duplicates:
+        from dedupe import load_duplicates
+        duplicates = load_duplicates(args.duplicates)
+
+    if args.output_dir:
+        _, _, failed = extract_batch(collect_images(args.image_path), args.output_dir, client, args.batch_size,
+                                     args.max_in_flight, args.max_retries, args.force, cache, args.format,
+                                     duplicates)
+        sys.exit(1 if failed else 0)
+
+    if len(args.image_path) != 1:
+        parser.error('multiple images require --output-dir')
+
     # Extract text from the specified image
-    extracted_text_json = extract_text_from_image(args.image_path)
+    extracted_text_json = extract_text_from_image(args.image_path[0], client, None if args.force else cache)
 
     if extracted_text_json:
         print(extracted_text_json)
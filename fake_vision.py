@@ -0,0 +1,151 @@
+"""
+Offline stand-in for google.cloud.vision.ImageAnnotatorClient.
+
+Returns synthetic but realistically shaped fullTextAnnotation responses after a configurable
+latency, and can inject transient gRPC errors, so extract.py can be tested and benchmarked
+without credentials or network access.
+"""
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+
+from google.api_core import exceptions as google_exceptions
+
+# Vision BreakType values
+SPACE = 1
+EOL_SURE_SPACE = 3
+HYPHEN = 4
+LINE_BREAK = 5
+
+VOCABULARY = (
+    "война семья память отец мама брат сестра город улица дом школа работа письмо время "
+    "годы жизнь люди родные Москва Киев завод фронт поезд станция лагерь пионерский учитель "
+    "который когда потом только тогда после вместе первый последний большой старший младший "
+    "и в на с по из за к от до не что как это был была были мы они он она я"
+).split()
+
+class FakeResponse:
+    """Mimics the parts of AnnotateImageResponse that extract.py uses."""
+
+    def __init__(self, data, error_message=""):
+        self.data = data
+        self.error = SimpleNamespace(message=error_message)
+
+    @classmethod
+    def to_json(cls, instance, **kwargs):
+        return json.dumps(instance.data, ensure_ascii=False)
+
+    @classmethod
+    def to_dict(cls, instance, **kwargs):
+        return json.loads(json.dumps(instance.data))
+
+def synthetic_word(text, confidence, break_type, x, y, width, height):
+    """Builds one Vision word with per-symbol text and a detected break on the last symbol."""
+    symbols = [{"text": char, "confidence": confidence} for char in text]
+    if break_type:
+        symbols[-1]["property"] = {"detectedBreak": {"type": break_type}}
+    return {
+        "boundingBox": {"vertices": [{"x": x, "y": y}, {"x": x + width, "y": y},
+                                     {"x": x + width, "y": y + height}, {"x": x, "y": y + height}]},
+        "symbols": symbols,
+        "confidence": confidence,
+    }
+
+def synthetic_annotation(n_words=250, seed=0, words_per_line=9, lines_per_paragraph=6):
+    """
+    Generates a fullTextAnnotation-shaped response for one handwritten page.
+
+    Words are laid out on lines with bounding boxes, lines end with EOL_SURE_SPACE or a HYPHEN
+    that splits a word across two lines, and paragraphs are grouped into blocks, which is what
+    digest.py walks.
+    """
+    rng = random.Random(seed)
+    char_width, line_height, left_margin = 18, 48, 120
+
+    paragraphs = []
+    words = []
+    line = 0
+    x = left_margin
+    remainder = None
+    for i in range(n_words):
+        text = rng.choice(VOCABULARY)
+        confidence = round(min(1.0, max(0.2, rng.gauss(0.88, 0.1))), 3)
+        end_of_line = (i + 1) % words_per_line == 0 or i == n_words - 1
+        end_of_paragraph = end_of_line and ((line + 1) % lines_per_paragraph == 0 or i == n_words - 1)
+
+        if remainder:
+            # The second half of a word hyphenated at the end of the previous line
+            width = char_width * len(remainder)
+            words.append(synthetic_word(remainder, confidence, SPACE, x, 100 + line * line_height, width, line_height - 8))
+            x += width + char_width
+            remainder = None
+
+        break_type = SPACE
+        if end_of_line:
+            # Some line ends split a word with a hyphen, like handwriting does
+            if not end_of_paragraph and rng.random() < 0.15 and len(text) > 3:
+                text, remainder = text[:len(text) // 2] + "-", text[len(text) // 2:]
+                break_type = HYPHEN
+            else:
+                break_type = EOL_SURE_SPACE
+
+        width = char_width * len(text)
+        words.append(synthetic_word(text, confidence, break_type, x, 100 + line * line_height, width, line_height - 8))
+        x += width + char_width
+
+        if end_of_line:
+            line += 1
+            x = left_margin
+            if line % lines_per_paragraph == 0 or i == n_words - 1:
+                paragraphs.append({"words": words, "confidence": confidence})
+                words = []
+
+    text = " ".join("".join(s["text"] for s in w["symbols"]) for p in paragraphs for w in p["words"])
+    return {
+        "fullTextAnnotation": {
+            "pages": [{
+                "width": 1280,
+                "height": 1632,
+                "blocks": [{"paragraphs": [paragraph], "blockType": 1} for paragraph in paragraphs],
+            }],
+            "text": text,
+        }
+    }
+
+class FakeImageAnnotatorClient:
+    """
+    Drop-in replacement for vision.ImageAnnotatorClient's document_text_detection and
+    batch_annotate_images. Responses are deterministic for the same image bytes.
+    """
+
+    # Keeps fake responses in the OCR cache apart from real ones (see extract.ocr_cache_key)
+    cache_namespace = "fake"
+
+    def __init__(self, latency=0.5, failure_rate=0.0, words_per_page=250):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.words_per_page = words_per_page
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _respond(self, content):
+        seed = int.from_bytes(hashlib.sha256(content).digest()[:8], "big")
+        return FakeResponse(synthetic_annotation(self.words_per_page, seed))
+
+    def _simulate_call(self):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise google_exceptions.ServiceUnavailable("fake transient failure")
+
+    def document_text_detection(self, image):
+        self._simulate_call()
+        return self._respond(image["content"] if isinstance(image, dict) else image.content)
+
+    def batch_annotate_images(self, requests):
+        self._simulate_call()
+        return SimpleNamespace(responses=[self._respond(request["image"]["content"]) for request in requests])
@@ -0,0 +1,139 @@
+"""
+Deterministic whitespace and punctuation-spacing formatter for Russian text.
+
+This does in-process what the gpt-4o-mini formatting pass in revise.py used to do: it
+removes extra spaces and stray newlines while keeping paragraphs distinct. Every rule that
+fires is reported in an edit list shaped like the LLM's "Edits:" section, with the first few
+changes it made quoted in context.
+
+A word hyphenated across a line break is joined only if the joined word is in the Russian
+dictionary, as digest.py joins words at line breaks; otherwise the hyphen belongs to a compound
+such as кто-нибудь or из-за and only the line break is removed. Without enchant or its Russian
+dictionary no word counts as a dictionary word, so such hyphens are all kept.
+"""
+import functools
+import re
+
+LETTER = r'[А-Яа-яЁёA-Za-z]'
+LOWER = r'[а-яёa-z]'
+UPPER = r'[А-ЯЁA-Z]'
+
+# How many changes of each rule the edit list quotes
+EXAMPLES_PER_RULE = 3
+
+@functools.lru_cache(maxsize=None)
+def load_dictionary():
+    """
+    Sets up digest.py's Russian dictionary on first use.
+
+    Returns:
+        module: digest, or None if enchant or its Russian dictionary is not installed.
+    """
+    # digest loads enchant, which only text with hyphenated line ends needs
+    try:
+        import digest
+    except ImportError as e:
+        print(f"Warning: The Russian dictionary is unavailable, keeping hyphens at line breaks. {str(e).splitlines()[0]}")
+        return None
+    if "russian_dict" not in vars(digest):
+        try:
+            digest.init_dictionary(digest.load_verdicts(digest.DEFAULT_VERDICT_CACHE))
+        except digest.enchant.errors.Error as e:
+            print(f"Warning: The Russian dictionary is unavailable, keeping hyphens at line breaks. {str(e).splitlines()[0]}")
+            return None
+    return digest
+
+def is_dictionary_word(word):
+    """Checks a word against digest.py's Russian dictionary, if it is available."""
+    digest = load_dictionary()
+    return digest is not None and digest.is_valid_russian_word(word)
+
+def join_hyphenated(match):
+    """Joins the halves of a word hyphenated across a line break if they make a dictionary word."""
+    joined = match.group(1) + match.group(2)
+    return joined if is_dictionary_word(joined) else match.group(0)
+
+# Rules applied within a paragraph, in order: (edit description, pattern, replacement)
+RULES = [
+    ("Replaced tabs with spaces", re.compile(r'\t'), ' '),
+    ("Joined words hyphenated across line breaks",
+     re.compile(rf'({LETTER}+)-[ ]*\n[ ]*({LOWER}{LETTER}*)'), join_hyphenated),
+    ("Joined compounds hyphenated across line breaks, keeping the hyphen",
+     re.compile(rf'({LETTER})-[ ]*\n[ ]*({LETTER})'), r'\1-\2'),
+    ("Joined lines within a paragraph", re.compile(r'[ ]*\n[ ]*'), ' '),
+    ("Replaced double hyphens with em dashes", re.compile(r'--'), '—'),
+    ("Replaced spaced hyphens with em dashes", re.compile(r'(?<=\S) - (?=\S)'), ' — '),
+    ("Put single spaces around em dashes between words",
+     re.compile(rf'(?<={LETTER}|[,.!?»“)])[ ]*—[ ]*(?={LETTER}|[«„(])'), ' — '),
+    ("Removed extra spaces between words", re.compile(r'[ ]{2,}'), ' '),
+    ("Removed spaces before punctuation and closing quotes", re.compile(r'[ ]+([,.;:!?…)\]»“])'), r'\1'),
+    ("Removed spaces after opening brackets and quotes", re.compile(r'([(\[«„])[ ]+'), r'\1'),
+    ("Added missing spaces after punctuation", re.compile(rf'([,;:!?…])(?={LETTER}|[«„(])'), r'\1 '),
+    ("Added missing spaces between sentences", re.compile(rf'(?:(?<={LOWER}{{2}})|(?<=[»“)]))\.(?={UPPER})'), '. '),
+    ("Added missing spaces around brackets and quotes", re.compile(rf'(?<={LETTER})([(«„])|([)»“])(?={LETTER})'),
+     lambda m: f' {m.group(1)}' if m.group(1) else f'{m.group(2)} '),
+]
+
+# Paragraph boundaries: blank lines, and line breaks before a line of dialogue
+PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n\s*|\n(?=[ \t]*[—–][ ])')
+
+def quote_change(match, new):
+    """Quotes a change with the surrounding word characters, showing line breaks as \\n."""
+    before = re.search(r'\S{0,12}$', match.string[:match.start()]).group(0)
+    after = re.match(r'\S{0,12}', match.string[match.end():]).group(0)
+    def show(s):
+        return '"' + (before + s + after).replace('\n', '\\n').replace('\t', '\\t') + '"'
+    return f"{show(match.group(0))} → {show(new)}"
+
+def format_spacing(text):
+    """
+    Cleans up spacing in text.
+
+    Paragraphs are separated by blank lines in the input, and a line starting with a dash
+    opens a new paragraph of dialogue. Other newlines inside a paragraph are joined, and so
+    are words hyphenated across them when the joined word is in the dictionary. The output separates paragraphs with one
+    blank line.
+
+    Returns:
+        tuple: (formatted text, edits) where edits lists the changes one per line.
+    """
+    counts = {}
+    examples = {}
+    paragraphs = []
+
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        paragraph = paragraph.strip()
+        for description, pattern, replacement in RULES:
+            changed = 0
+
+            def substitute(match):
+                nonlocal changed
+                new = replacement(match) if callable(replacement) else match.expand(replacement)
+                if new != match.group(0):
+                    changed += 1
+                    quoted = examples.setdefault(description, [])
+                    if len(quoted) < EXAMPLES_PER_RULE:
+                        quoted.append(quote_change(match, new))
+                return new
+
+            paragraph = pattern.sub(substitute, paragraph)
+            if changed:
+                counts[description] = counts.get(description, 0) + changed
+        paragraph = paragraph.strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+
+    formatted_text = "\n\n".join(paragraphs)
+
+    # Collapsing runs of blank lines between paragraphs
+    blank_runs = len(re.findall(r'\n[ \t]*\n(?:[ \t]*\n)+', text.strip()))
+    if blank_runs:
+        counts["Collapsed repeated blank lines between paragraphs"] = blank_runs
+
+    def describe(description, n):
+        quoted = examples.get(description, [])
+        more = f", and {n - len(quoted)} more" if n > len(quoted) else ""
+        return f"- {description} ({n}x)" + (f": {', '.join(quoted)}{more}." if quoted else ".")
+
+    edits = "\n".join(describe(description, n) for description, n in counts.items())
+    return formatted_text, edits or "- No formatting changes."
@@ -0,0 +1,46 @@
+"""File helpers shared by the pipeline stages."""
+import os
+import tempfile
+
+# Page image formats slice.py can write, in the order a page's slice is looked for
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+def write_atomic(path, data):
+    """Writes text or bytes to path through a temporary file so readers never see a partial file."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False, suffix=".tmp") as f:
+        f.write(data)
+        temp_path = f.name
+    os.replace(temp_path, path)
+
+def write_if_changed(path, data):
+    """Writes data atomically unless the file already holds exactly this data. Returns True if written."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    write_atomic(path, data)
+    return True
+
+def find_image(directory, name):
+    """The path of the image directory/name.<ext> in any of IMAGE_EXTENSIONS, the newest if several exist, or None."""
+    paths = [os.path.join(directory, name + extension) for extension in IMAGE_EXTENSIONS]
+    paths = [path for path in paths if os.path.exists(path)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+def unique_images(image_paths):
+    """
+    Keeps one image per directory and file name without extension, the newest, so a page
+    sliced in two formats is only processed once. The order of the kept paths is preserved.
+    """
+    newest = {}
+    for path in image_paths:
+        stem = os.path.splitext(path)[0]
+        if stem not in newest or os.path.getmtime(path) > os.path.getmtime(newest[stem]):
+            newest[stem] = path
+    kept = set(newest.values())
+    return [path for path in image_paths if path in kept]
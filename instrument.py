@@ -0,0 +1,166 @@
+"""
+Structured timing, traffic and token instrumentation for the pipeline stages.
+
+Every entry point appends JSON lines to metrics/<run id>.jsonl: one event per unit of work
+with its stage, wall time, status and whatever the stage knows about it (bytes sent and
+received, retries, prompt and completion tokens). Processes started with the same
+DEDA_RUN_ID environment variable write to the same run; otherwise each process starts a
+run named after its start time. Set DEDA_METRICS=0 to turn recording off.
+
+Traffic columns of the summary: "MB out" is bytes sent to an API plus bytes written locally,
+"MB in" is bytes received from an API.
+
+Usage:
+    python instrument.py summary              # summarize the latest run
+    python instrument.py summary RUN_ID ...   # summarize specific runs (ids or .jsonl paths)
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+METRICS_DIR = "metrics"
+
+# USD per million tokens (input, output)
+TOKEN_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+# USD per image for Vision DOCUMENT_TEXT_DETECTION
+VISION_PRICE_PER_IMAGE = 1.50 / 1000
+# Batch API requests are billed at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+
+_lock = threading.Lock()
+
+def enabled():
+    return os.environ.get("DEDA_METRICS", "1") != "0"
+
+def run_id():
+    """Returns the current run id, starting a new run if none is set. Child processes inherit it."""
+    if "DEDA_RUN_ID" not in os.environ:
+        os.environ["DEDA_RUN_ID"] = time.strftime("%Y%m%d_%H%M%S") + f"_{os.getpid()}"
+    return os.environ["DEDA_RUN_ID"]
+
+def metrics_path(run=None):
+    return os.path.join(METRICS_DIR, f"{run or run_id()}.jsonl")
+
+def emit(stage, event, **fields):
+    """Appends one event to the current run."""
+    if not enabled():
+        return
+    record = {"ts": time.time(), "pid": os.getpid(), "stage": stage, "event": event, **fields}
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _lock:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        # Appends of one short line are atomic, so concurrent processes can share the file
+        with open(metrics_path(), 'a', encoding='utf-8') as f:
+            f.write(line)
+
+@contextmanager
+def timed(stage, event="call", **fields):
+    """
+    Times the enclosed block and emits it as one event.
+    Yields the event's fields so the block can add to them, e.g. fields["bytes_sent"] = n.
+    """
+    fields = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield fields
+        fields.setdefault("status", "ok")
+    except BaseException as e:
+        fields["status"] = "error"
+        fields["error"] = str(e)[:200]
+        raise
+    finally:
+        emit(stage, event, wall=round(time.perf_counter() - start, 6), **fields)
+
+def add_usage(fields, response):
+    """Copies prompt and completion token counts from an OpenAI response's usage into fields."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        fields["prompt_tokens"] = usage.prompt_tokens
+        fields["completion_tokens"] = usage.completion_tokens
+
+# Summary
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100.0
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+def event_cost(event):
+    if event["event"] == "openai" and event.get("status") == "ok":
+        input_price, output_price = TOKEN_PRICES.get(event.get("model"), (0.0, 0.0))
+        return (event.get("prompt_tokens", 0) * input_price + event.get("completion_tokens", 0) * output_price) / 1e6
+    if event["event"] == "openai_batch":
+        input_price, output_price = TOKEN_PRICES.get(event.get("model"), (0.0, 0.0))
+        return BATCH_PRICE_FACTOR * (event.get("prompt_tokens", 0) * input_price
+                                     + event.get("completion_tokens", 0) * output_price) / 1e6
+    if event["stage"] == "extract" and event["event"] in ("call", "batch") and event.get("status") == "ok":
+        return event.get("images", 1) * VISION_PRICE_PER_IMAGE
+    return 0.0
+
+def load_events(paths):
+    events = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    return events
+
+def summarize(events):
+    """Prints per-stage count, p50/p95 latency, throughput, traffic, tokens and cost."""
+    groups = defaultdict(list)
+    for event in events:
+        groups[(event["stage"], event["event"], event.get("model", ""))].append(event)
+
+    header = f"{'stage':<10}{'event':<12}{'model':<13}{'count':>7}{'err':>5}{'p50 s':>9}{'p95 s':>9}{'per s':>8}{'MB out':>8}{'MB in':>8}{'retries':>8}{'tok in':>9}{'tok out':>9}{'cost $':>9}"
+    print(header)
+    print("-" * len(header))
+    total_cost = 0.0
+    for (stage, event_name, model), group in sorted(groups.items()):
+        walls = [e.get("wall", 0.0) for e in group]
+        span = max(e["ts"] + e.get("wall", 0.0) for e in group) - min(e["ts"] for e in group)
+        cost = sum(event_cost(e) for e in group)
+        total_cost += cost
+        print(f"{stage:<10}{event_name:<12}{model:<13}{len(group):>7}"
+              f"{sum(e.get('status') == 'error' for e in group):>5}"
+              f"{percentile(walls, 50):>9.3f}{percentile(walls, 95):>9.3f}"
+              f"{(len(group) / span if span > 0 else 0.0):>8.1f}"
+              f"{sum(e.get('bytes_sent', 0) + e.get('bytes_written', 0) for e in group) / 1e6:>8.2f}"
+              f"{sum(e.get('bytes_received', 0) for e in group) / 1e6:>8.2f}"
+              f"{sum(e.get('retries', 0) for e in group):>8}"
+              f"{sum(e.get('prompt_tokens', 0) for e in group):>9}"
+              f"{sum(e.get('completion_tokens', 0) for e in group):>9}"
+              f"{cost:>9.4f}")
+    print(f"Total cost: ${total_cost:.4f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize pipeline instrumentation.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary = subparsers.add_parser("summary", help="Print per-stage latency, throughput and cost")
+    summary.add_argument("runs", nargs="*", help="Run ids or .jsonl paths (default is the latest run)")
+    args = parser.parse_args()
+
+    paths = [run if run.endswith(".jsonl") else metrics_path(run) for run in args.runs]
+    if not paths:
+        runs = sorted((os.path.join(METRICS_DIR, name) for name in os.listdir(METRICS_DIR) if name.endswith(".jsonl")),
+                      key=os.path.getmtime) if os.path.isdir(METRICS_DIR) else []
+        if not runs:
+            print(f"Error: No runs found in '{METRICS_DIR}'.")
+            sys.exit(1)
+        paths = runs[-1:]
+
+    print(f"Runs: {', '.join(os.path.basename(p) for p in paths)}")
+    summarize(load_events(paths))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Geometry-based line and paragraph reconstruction for digests.
+
+Vision's detected breaks only say where it thinks a line ended, and on handwriting they often
+miss paragraph ends or mark every line alike. The word boxes carry the rest: analyze() loads a
+page's boxes into NumPy arrays and, without per-word Python loops, groups the words into lines,
+finds the body column, flags indented lines and notes written in the margins, and splits the
+body into paragraphs at indents, larger vertical gaps and lines that end well short of the
+right edge. Each word gets 'line', 'paragraph', 'indent' and 'margin_note' fields.
+
+word_separators() turns those fields (or, for digests without them, the detected breaks) into
+the text placed after each word, which is how revise.assemble_text lays out a page.
+"""
+import numpy as np
+
+# Thresholds in multiples of the median word height
+LINE_JUMP = 0.6          # vertical shift of the word centre that starts a new line
+LINE_GAP = 3.0           # horizontal gap between words that starts a new line, as for a margin note
+INDENT = 1.2             # left offset from the body column that makes a line indented
+SHORT_LINE = 4.0         # gap to the right edge that makes a line end its paragraph
+MARGIN = 1.0             # distance outside the body column for a line to be a margin note
+PARAGRAPH_GAP = 1.6      # line spacing, relative to the median spacing, that starts a paragraph
+
+BREAK_SEPARATORS = {1: " ", 3: "\n", 5: "\n\n"}
+
+def analyze(words):
+    """
+    Adds layout fields to a page's digest words in place and returns them.
+    Words without a usable 'box' are left as they are.
+    """
+    if not words or not all(word.get("box") for word in words):
+        return words
+
+    boxes = np.asarray([word["box"] for word in words], dtype=np.float64)
+    x0, y0, x1, y1 = boxes.T
+    centre = (y0 + y1) / 2
+    height = np.median(np.maximum(y1 - y0, 1.0))
+    count = len(words)
+
+    # Lines: words come in reading order, so a new line starts where the centre jumps
+    # vertically, the next word starts well to the left of the previous one or far to its right
+    new_line = np.ones(count, dtype=bool)
+    new_line[1:] = ((np.abs(np.diff(centre)) > LINE_JUMP * height)
+                    | (np.diff(x0) < -height)
+                    | (x0[1:] - x1[:-1] > LINE_GAP * height))
+    line_of_word = np.cumsum(new_line) - 1
+    starts = np.flatnonzero(new_line)
+    sizes = np.diff(np.append(starts, count))
+    line_x0 = np.minimum.reduceat(x0, starts)
+    line_x1 = np.maximum.reduceat(x1, starts)
+    line_centre = np.add.reduceat(centre, starts) / sizes
+
+    # The body column: most lines start near its left edge and many reach its right edge
+    left = np.percentile(line_x0, 20)
+    right = np.percentile(line_x1, 90)
+    margin = (line_x1 <= left - MARGIN * height) | (line_x0 >= right + MARGIN * height)
+    indent = ~margin & (line_x0 - left > INDENT * height)
+
+    # Paragraphs start at a change between body and margin, and within the body at an indented
+    # line, after a large vertical gap or after a line that ended short of the right edge
+    starts_paragraph = np.ones(len(starts), dtype=bool)
+    starts_paragraph[1:] = margin[1:] != margin[:-1]
+    body = np.flatnonzero(~margin)
+    if len(body) > 1:
+        spacing = np.diff(line_centre[body])
+        typical = np.median(spacing[spacing > 0]) if np.any(spacing > 0) else height
+        body_start = (indent[body[1:]]
+                      | (spacing > PARAGRAPH_GAP * typical)
+                      | (line_x1[body[:-1]] < right - SHORT_LINE * height))
+        starts_paragraph[body[1:]] |= body_start
+    paragraph_of_line = np.cumsum(starts_paragraph) - 1
+
+    for word, line in zip(words, line_of_word.tolist()):
+        word["line"] = line
+        word["paragraph"] = int(paragraph_of_line[line])
+        word["indent"] = bool(indent[line])
+        word["margin_note"] = bool(margin[line])
+    return words
+
+def word_separators(words):
+    """
+    The text that follows each word when a page is assembled.
+
+    With layout fields, words on one line are separated by spaces (or nothing where Vision saw
+    no break, as before punctuation), lines by a newline and paragraphs by a blank line.
+    Without them, the detected break types decide as they always have.
+    """
+    if not words or "line" not in words[0]:
+        return [BREAK_SEPARATORS.get(word.get("detected_break", ""), "") for word in words]
+
+    separators = []
+    for word, following in zip(words, words[1:]):
+        if following["paragraph"] != word["paragraph"]:
+            separators.append("\n\n")
+        elif word.get("detected_break") == 4:
+            # A word hyphenated across lines is joined as Vision's breaks always joined it
+            separators.append("")
+        elif following["line"] != word["line"]:
+            separators.append("\n")
+        else:
+            separators.append(" " if word.get("detected_break") not in ("", 0, 4) else "")
+    separators.append("")
+    return separators
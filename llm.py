@@ -0,0 +1,187 @@
+"""
+Shared helpers for OpenAI chat completion calls.
+
+The async path is used by the batch modes: it waits on a RateLimiter before each request,
+honours 429 Retry-After by pausing the limiter, and retries transient errors with jittered
+exponential backoff.
+
+CompletionCache keeps completions on disk keyed by a hash of the whole request (model,
+temperature, system prompt and the user prompt with its input text) and of the server it went
+to, so re-running a stage only pays for requests whose input actually changed.
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from cache import DiskCache, hash_key
+from instrument import add_usage, emit, timed
+from tokens import estimate_request_tokens
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "llm")
+DEFAULT_CACHE_MAX_MB = 512
+# The server the clients talk to unless OPENAI_BASE_URL says otherwise
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# Transient errors worth retrying besides rate limiting
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+_client = None
+
+def get_client():
+    """Returns the process-wide OpenAI client, creating it on first use so its connection pool is shared."""
+    global _client
+    if _client is None:
+        _client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    return _client
+
+def get_async_client():
+    """Creates an async OpenAI client. Retries are handled here rather than by the client.
+    Set OPENAI_BASE_URL to point it at an OpenAI-compatible server such as mock_openai.py."""
+    return AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+
+class CompletionCache:
+    """Persistent, size-bounded cache of completion texts keyed by request."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_mb=DEFAULT_CACHE_MAX_MB, refresh=False):
+        self.store = DiskCache(directory, max_bytes=max_mb * 1024 * 1024)
+        # With refresh set, every request goes to the API and its answer replaces the cached one
+        self.refresh = refresh
+
+    @staticmethod
+    def key(request, client=None):
+        """
+        Hashes the request. A client pointed at another server than the OpenAI API, such as
+        mock_openai.py, adds its base URL, so its answers never stand in for the real API's.
+        """
+        body = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        base_url = str(client.base_url) if client is not None else os.environ.get("OPENAI_BASE_URL", OPENAI_BASE_URL)
+        if base_url.rstrip("/") != OPENAI_BASE_URL.rstrip("/"):
+            return hash_key(base_url, body)
+        return hash_key(body)
+
+    def get(self, request, client=None):
+        if self.refresh:
+            self.store.misses += 1
+            return None
+        value = self.store.get(self.key(request, client))
+        return value.decode('utf-8') if value is not None else None
+
+    def put(self, request, content, client=None):
+        self.store.put(self.key(request, client), content.encode('utf-8'))
+
+    def stats(self):
+        return self.store.stats()
+
+def add_cache_arguments(parser):
+    """Adds the --no-cache, --refresh and --cache-dir options shared by the LLM stages."""
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the LLM response cache.')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Send every request to the API and replace cached responses.')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f'Directory of the LLM response cache (default is {DEFAULT_CACHE_DIR}).')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_MB,
+                        help=f'Size limit of the LLM response cache in MB (default is {DEFAULT_CACHE_MAX_MB}).')
+
+def cache_from_args(args):
+    """Builds the CompletionCache selected by add_cache_arguments options, or None."""
+    if args.no_cache:
+        return None
+    return CompletionCache(args.cache_dir, args.cache_max_mb, args.refresh)
+
+def complete(client, request, cache=None, stage="openai"):
+    """
+    Sends one chat completion request and returns the message content, answering from cache when possible.
+    The call is recorded as an 'openai' event of the given pipeline stage.
+    """
+    if cache is not None:
+        content = cache.get(request, client)
+        if content is not None:
+            emit(stage, "cache_hit", model=request["model"])
+            return content
+
+    with timed(stage, "openai", model=request["model"], bytes_sent=request_size(request)) as fields:
+        response = client.chat.completions.create(**request)
+        content = response.choices[0].message.content
+        add_usage(fields, response)
+        fields["bytes_received"] = len(content.encode('utf-8'))
+
+    if cache is not None:
+        cache.put(request, content, client)
+    return content
+
+async def complete_async(client, request, limiter, cache=None, stage="openai"):
+    """
+    Async version of complete() that sends cache misses through create_completion_async.
+    Each attempt is recorded as an 'openai' event timing only the request, and the wait for
+    the rate limiter before it as a 'ratelimit' event.
+    """
+    if cache is not None:
+        content = cache.get(request, client)
+        if content is not None:
+            emit(stage, "cache_hit", model=request["model"])
+            return content
+
+    response = await create_completion_async(client, request, limiter, stage=stage)
+    content = response.choices[0].message.content
+
+    if cache is not None:
+        cache.put(request, content, client)
+    return content
+
+def request_size(request):
+    return len(json.dumps(request, ensure_ascii=False).encode('utf-8'))
+
+def retry_after_seconds(error):
+    """Reads the Retry-After delay from a rate limit error's response headers, if present."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+async def create_completion_async(client, request, limiter, max_retries=6, base_delay=1.0, max_delay=60.0,
+                                  stage="openai"):
+    """
+    Sends one chat completion request under the rate limiter and returns the response.
+
+    Args:
+        client (AsyncOpenAI): Client to send the request with.
+        request (dict): Keyword arguments for chat.completions.create.
+        limiter (RateLimiter): Limiter for the request's model.
+        stage (str): Pipeline stage the 'ratelimit' and 'openai' events are recorded under;
+            a retried attempt's event has retries=1.
+    """
+    tokens = estimate_request_tokens(request)
+    for attempt in range(max_retries + 1):
+        with timed(stage, "ratelimit", model=request["model"]):
+            await limiter.acquire(tokens)
+        try:
+            with timed(stage, "openai", model=request["model"], bytes_sent=request_size(request)) as fields:
+                if attempt:
+                    fields["retries"] = 1
+                response = await client.chat.completions.create(**request)
+                add_usage(fields, response)
+                fields["bytes_received"] = len(response.choices[0].message.content.encode('utf-8'))
+            return response
+        except openai.RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_after_seconds(e) or random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            # Every request on this model backs off, not just this one
+            limiter.pause(delay)
+            print(f"Rate limited on {request['model']}; pausing {delay:.1f}s...", file=sys.stderr)
+        except TRANSIENT_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Transient error: {e}. Retrying in {delay:.1f}s...", file=sys.stderr)
+            await asyncio.sleep(delay)
@@ -0,0 +1,221 @@
+"""
+Local mock of the OpenAI chat completions API for testing and benchmarking offline.
+
+Every completion echoes the Russian text of the last user message back (lines containing
+Cyrillic or [[page_N]] markers; the English instructions are dropped), followed by an
+"Edits:" section, which is the shape revise.py and draft.py parse. Latency and the share of requests answered with
+429 and a Retry-After header are configurable.
+
+The files and batches endpoints used by batch.py are mocked too: an uploaded JSONL batch is
+answered line by line with the same echo completions, after --batch-latency seconds.
+
+Usage:
+    python mock_openai.py --port 8199 --latency 0.5 --rate-limit-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8199/v1 OPENAI_API_KEY=mock python revise.py --output-dir revised digests
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from tokens import estimate_tokens
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    # Set on the server instance: latency, rate_limit_rate, retry_after
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def not_found(self):
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            self.chat_completions(self.read_json())
+        elif path.endswith("/files"):
+            self.upload_file()
+        elif path.endswith("/batches"):
+            self.create_batch(self.read_json())
+        else:
+            self.not_found()
+
+    def do_GET(self):
+        match = re.search(r'/(files|batches)/([^/]+)(/content)?$', self.path.split("?")[0])
+        server = self.server
+        if not match:
+            self.not_found()
+        elif match.group(1) == "batches" and match.group(2) in server.batches:
+            with server.lock:
+                self.send_json(200, server.batches[match.group(2)])
+        elif match.group(1) == "files" and match.group(2) in server.files:
+            data, file_object = server.files[match.group(2)]
+            if match.group(3):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self.send_json(200, file_object)
+        else:
+            self.not_found()
+
+    def upload_file(self):
+        """Stores a multipart upload the way the files endpoint does."""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        data = fields["file"].get_payload(decode=True)
+        purpose = fields["purpose"].get_payload(decode=True).decode() if "purpose" in fields else "batch"
+        self.send_json(200, self.server.add_file(data, fields["file"].get_filename() or "upload.jsonl", purpose))
+
+    def create_batch(self, request):
+        server = self.server
+        if request.get("input_file_id") not in server.files:
+            self.send_json(404, {"error": {"message": "No such file", "type": "invalid_request_error"}})
+            return
+        batch_id = f"batch_mock_{random.getrandbits(48):x}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": request.get("endpoint"),
+            "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window", "24h"),
+            "status": "validating", "created_at": int(time.time()), "output_file_id": None, "error_file_id": None,
+            "metadata": request.get("metadata"), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with server.lock:
+            server.batches[batch_id] = batch
+        threading.Thread(target=server.run_batch, args=(batch_id,), daemon=True).start()
+        self.send_json(200, batch)
+
+    def chat_completions(self, request):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        if random.random() < server.rate_limit_rate:
+            with server.lock:
+                server.rate_limited += 1
+            self.send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                           {"Retry-After": str(server.retry_after)})
+            return
+
+        time.sleep(server.latency)
+        self.send_json(200, completion_payload(request))
+
+# Lines of a prompt that belong to the text being edited rather than to the instructions
+TEXT_LINE = re.compile(r'[\u0400-\u04FF]|\[\[page_\d+\]\]')
+
+def echo_text(prompt):
+    """Returns the lines of the prompt that contain Russian text or page markers."""
+    return "\n".join(line.strip() for line in prompt.splitlines() if TEXT_LINE.search(line))
+
+def completion_payload(request):
+    """Builds a chat.completion response that echoes the text of the last user message."""
+    user_messages = [m["content"] for m in request.get("messages", []) if m.get("role") == "user"]
+    prompt = user_messages[-1] if user_messages else ""
+    content = f"{echo_text(prompt)}\nEdits:\n- No changes (mock)."
+    prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in request.get("messages", []))
+    completion_tokens = estimate_tokens(content)
+    return {
+        "id": f"chatcmpl-mock-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """Holds the uploaded files and the batches answered from them."""
+
+    def add_file(self, data, filename, purpose):
+        file_id = f"file-mock-{random.getrandbits(48):x}"
+        file_object = {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                       "filename": filename, "purpose": purpose, "status": "processed"}
+        with self.lock:
+            self.files[file_id] = (data, file_object)
+        return file_object
+
+    def run_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        lines = [json.loads(line) for line in self.files[batch["input_file_id"]][0].decode('utf-8').splitlines()
+                 if line.strip()]
+        with self.lock:
+            batch.update(status="in_progress", request_counts={"total": len(lines), "completed": 0, "failed": 0})
+        time.sleep(self.batch_latency)
+
+        output = []
+        for line in lines:
+            body = completion_payload(line.get("body", {}))
+            output.append(json.dumps({"id": f"batch_req_{random.getrandbits(48):x}", "custom_id": line["custom_id"],
+                                      "response": {"status_code": 200, "request_id": "mock", "body": body},
+                                      "error": None}, ensure_ascii=False))
+        output_file = self.add_file(("\n".join(output) + "\n").encode('utf-8'), f"{batch_id}_output.jsonl",
+                                    "batch_output")
+        with self.lock:
+            self.requests += len(lines)
+            batch.update(status="completed", output_file_id=output_file["id"], completed_at=int(time.time()),
+                         request_counts={"total": len(lines), "completed": len(lines), "failed": 0})
+
+def start_server(port=0, latency=0.5, rate_limit_rate=0.0, retry_after=1, batch_latency=1.0):
+    """Starts the mock server on a background thread and returns it; server.base_url is the API base URL."""
+    server = MockOpenAIServer(("127.0.0.1", port), MockOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.rate_limit_rate = rate_limit_rate
+    server.retry_after = retry_after
+    server.batch_latency = batch_latency
+    server.files = {}
+    server.batches = {}
+    server.requests = 0
+    server.rate_limited = 0
+    server.lock = threading.Lock()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI chat completions API.")
+    parser.add_argument("--port", type=int, default=8199, help="Port to listen on (default is 8199)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds to wait before each completion (default is 0.5)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="Share of requests answered with 429 (default is 0)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429 (default is 1)")
+    parser.add_argument("--batch-latency", type=float, default=1.0,
+                        help="Seconds before a submitted batch completes (default is 1)")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.rate_limit_rate, args.retry_after, args.batch_latency)
+    print(f"Mock OpenAI API listening on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(f"Served {server.requests} requests, {server.rate_limited} rate limited.")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Packing of consecutive pages into one revise request.
+
+A handwritten page is often only a few hundred words, so a request per page mostly pays for the
+instruction prompt. Packing sends several consecutive pages in one request, each introduced by
+its [[page_N]] marker, and splits the answer back on those markers. A packed answer is only
+trusted if every marker came back exactly once and in order; otherwise the caller revises the
+pages one by one.
+"""
+import os
+import re
+
+from tokens import estimate_tokens
+
+MARKER = re.compile(r'\[\[([^\[\]\n]+)\]\]')
+
+def page_marker(path):
+    """'digests/page_012.json' -> 'page_012', the name used in [[page_012]]."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+def pack_pages(pages, max_tokens):
+    """
+    Groups consecutive pages so each group's text stays within max_tokens.
+    A page larger than the budget gets a group of its own.
+
+    Args:
+        pages (list): (marker, text) tuples in page order.
+
+    Returns:
+        list: Lists of (marker, text) tuples.
+    """
+    groups = []
+    current, current_tokens = [], 0
+    for marker, text in pages:
+        tokens = estimate_tokens(text) + estimate_tokens(marker) + 2
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append((marker, text))
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def packed_text(group):
+    return "\n\n".join(f"[[{marker}]]\n{text}" for marker, text in group)
+
+def split_by_marker(text):
+    """Splits text on [[marker]] lines. Returns the text before the first marker and a list of (marker, text)."""
+    pieces = MARKER.split(text)
+    return pieces[0], [(pieces[i], pieces[i + 1].strip()) for i in range(1, len(pieces), 2)]
+
+def unpack_response(group, corrected_text, edits_section):
+    """
+    Splits a packed answer back into pages.
+
+    Edits listed under a page's marker are attributed to that page; edits that name no page
+    are attributed to every page of the group.
+
+    Returns:
+        list: (marker, text, edits) per page in group order, or None if a marker was lost,
+        repeated, reordered or a page came back empty.
+    """
+    _, pages = split_by_marker(corrected_text)
+    expected = [marker for marker, _ in group]
+    if [marker for marker, _ in pages] != expected or not all(text for _, text in pages):
+        return None
+
+    unattributed, page_edits = split_by_marker(edits_section)
+    edits_by_page = {}
+    for marker, edits in page_edits:
+        edits_by_page[marker] = (edits_by_page.get(marker, "") + "\n" + edits).strip()
+    shared = unattributed.strip()
+    return [(marker, text, edits_by_page.get(marker) or shared or "- No changes.") for marker, text in pages]
@@ -0,0 +1,394 @@
+"""
+Incremental per-page pipeline runner: slice -> extract -> digest -> revise, then review and draft.
+
+Each page moves to its next stage as soon as its previous stage is done, and every stage has
+its own concurrency limit. A stage reruns for a page only if the content hash of its inputs,
+the source code of the stage, or its configuration changed since the last successful run, as
+recorded in .pipeline/manifest.json. Unchanged outputs therefore never trigger downstream work,
+and a changed digest always triggers a new revision. Only a changed digest does: revisions,
+which may have been corrected by hand, are kept through code and manifest changes.
+
+Pages that reach extract together share batched Vision requests. The manifest is written once
+the per-page stages are done and again after the review and draft stages.
+
+Usage:
+    python pipeline.py                 # bring everything up to date
+    python pipeline.py --dry-run       # list the stale work without doing it
+    python pipeline.py --pages 1-40    # limit the per-page stages to a range of pages
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+import assemble
+import digest
+import slice as slicer
+from cache import DiskCache, hash_key
+from fsutil import IMAGE_EXTENSIONS, find_image, write_atomic, write_if_changed
+from instrument import timed
+
+PDF_DIR = "pdfs"
+SLICES_DIR = "slices"
+EXTRACTS_DIR = "extracts"
+DIGESTS_DIR = "digests"
+REVISED_DIR = "revised"
+REVIEWS_DIR = "reviews"
+DRAFTS_DIR = "drafts"
+MANIFEST_PATH = os.path.join(".pipeline", "manifest.json")
+
+PAGE_FORMAT = "page_%03d"
+PAGES_PER_REVIEW = 40
+
+# Source files whose changes invalidate a stage's outputs. Revisions are kept while their digest
+# is unchanged (see revise.revision_is_current), so revise sources only decide what is checked
+STAGE_SOURCES = {
+    "slice": ["slice.py"],
+    "extract": ["extract.py"],
+    "digest": ["digest.py"],
+    "revise": ["revise.py", "formatter.py", "layout.py"],
+    "review": ["review.py", "align.py"],
+    "draft": ["assemble.py"],
+}
+
+# Extract admits enough pages to fill a few batch_annotate_images requests of 16 images
+DEFAULT_CONCURRENCY = {"slice": os.cpu_count() or 4, "extract": 64, "digest": os.cpu_count() or 4,
+                       "revise": 8, "review": 4}
+# Seconds a page waits for others to join its Vision batch
+OCR_BATCH_WAIT = 0.2
+
+_file_hashes = {}
+
+def file_hash(path):
+    """SHA-256 of a file's contents, memoized by size and modification time. Missing files hash to ''."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return ""
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        digest_ = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest_.update(block)
+        _file_hashes[memo_key] = digest_.hexdigest()
+    return _file_hashes[memo_key]
+
+def code_hash(stage):
+    here = os.path.dirname(os.path.abspath(__file__))
+    return hash_key(*(file_hash(os.path.join(here, source)) for source in STAGE_SOURCES[stage]))
+
+class Page:
+    def __init__(self, number, pdf_path=None, page_index=None):
+        self.number = number
+        self.pdf_path = pdf_path
+        self.page_index = page_index
+        self.name = PAGE_FORMAT % number
+
+    def path(self, directory, extension=".json"):
+        return os.path.join(directory, self.name + extension)
+
+    def slice_path(self):
+        """The page's slice in whichever image format slice.py wrote it, or the PNG it is rendered to."""
+        return find_image(SLICES_DIR, self.name) or self.path(SLICES_DIR, ".png")
+
+def discover_pages():
+    """Lists pages from the PDFs (numbered from their file names) and from slices that have no PDF."""
+    pages = {}
+    if os.path.isdir(PDF_DIR):
+        for name in sorted(os.listdir(PDF_DIR)):
+            if not name.lower().endswith(".pdf"):
+                continue
+            pdf_path = os.path.join(PDF_DIR, name)
+            start_page_num = slicer.start_page_from_filename(pdf_path)
+            with fitz.open(pdf_path) as doc:
+                for page_index in range(len(doc)):
+                    pages[start_page_num + page_index] = Page(start_page_num + page_index, pdf_path, page_index)
+    if os.path.isdir(SLICES_DIR):
+        for name in os.listdir(SLICES_DIR):
+            match = re.fullmatch(r'page_(\d+)(\.\w+)', name)
+            if match and match.group(2) in IMAGE_EXTENSIONS and int(match.group(1)) not in pages:
+                pages[int(match.group(1))] = Page(int(match.group(1)))
+    return [pages[number] for number in sorted(pages)]
+
+class Pipeline:
+    def __init__(self, concurrency, dry_run=False, llm_format=False):
+        self.dry_run = dry_run
+        self.llm_format = llm_format
+        self.semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in concurrency.items()}
+        self.concurrency = concurrency
+        self.counts = Counter()
+        self.code_hashes = {stage: code_hash(stage) for stage in STAGE_SOURCES}
+        self.manifest = self.load_manifest()
+        self._manifest_changed = False
+        self._executors = {}
+        self._revise_context = None
+        self._digest_hashes = None
+        self._ocr_cache = None
+        self._ocr_queue = []
+        self._ocr_timer = None
+        self._ocr_batches = set()
+        self.verdicts = {}
+
+    @staticmethod
+    def load_manifest():
+        try:
+            with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_manifest(self):
+        """Writes the manifest if units finished since it was last written."""
+        if not self._manifest_changed:
+            return
+        os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+        write_atomic(MANIFEST_PATH, json.dumps(self.manifest, indent=1, sort_keys=True))
+        self._manifest_changed = False
+
+    def executor(self, stage, **kwargs):
+        if stage not in self._executors:
+            self._executors[stage] = ProcessPoolExecutor(max_workers=self.concurrency[stage], **kwargs)
+        return self._executors[stage]
+
+    async def run_stage(self, stage, unit, inputs, outputs, action, config=""):
+        """
+        Runs action() for one unit of a stage unless its recorded key is current and its outputs exist.
+
+        Returns:
+            bool: True if the outputs are up to date afterwards.
+        """
+        key = hash_key(stage, self.code_hashes[stage], config, *(file_hash(path) for path in inputs))
+        manifest_key = f"{stage}:{unit}"
+        if self.manifest.get(manifest_key) == key and all(os.path.exists(path) for path in outputs):
+            self.counts[stage, "fresh"] += 1
+            return True
+
+        if self.dry_run:
+            print(f"Stale: {stage} {unit}")
+            self.counts[stage, "stale"] += 1
+            return True
+
+        async with self.semaphores.get(stage, asyncio.Semaphore(1)):
+            try:
+                with timed("pipeline", stage, unit=unit):
+                    await action()
+            except Exception as e:
+                print(f"Error: {stage} {unit} failed: {e}")
+                self.counts[stage, "failed"] += 1
+                return False
+
+        self.manifest[manifest_key] = key
+        self._manifest_changed = True
+        self.counts[stage, "ran"] += 1
+        print(f"Done: {stage} {unit}")
+        return True
+
+    # Per-page stage actions
+
+    async def slice_page(self, page, image_path):
+        os.makedirs(SLICES_DIR, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        _, _, error = await loop.run_in_executor(self.executor("slice"), slicer._render_page,
+                                                 (page.pdf_path, page.page_index, image_path))
+        if error:
+            raise RuntimeError(error)
+
+    async def extract_page(self, image_path, json_path):
+        import extract
+        if self._ocr_cache is None:
+            self._ocr_cache = DiskCache(extract.DEFAULT_CACHE_DIR, extract.DEFAULT_CACHE_MAX_MB * 1024 * 1024)
+        with open(image_path, 'rb') as f:
+            cached = self._ocr_cache.get(extract.ocr_cache_key(f.read()))
+        if cached is not None:
+            response_json_string = cached.decode('utf-8')
+        else:
+            content, response_json_string, error = await self.annotate(image_path)
+            if error:
+                raise RuntimeError(error)
+            self._ocr_cache.put(extract.ocr_cache_key(content), response_json_string.encode('utf-8'))
+        os.makedirs(EXTRACTS_DIR, exist_ok=True)
+        write_if_changed(json_path, response_json_string)
+
+    async def annotate(self, image_path):
+        """
+        Queues an image for Vision and waits for its result. Pages reaching extract together
+        share one batch_annotate_images request of up to extract.MAX_BATCH_SIZE images.
+
+        Returns:
+            tuple: (image bytes, response JSON string or None, error message or None)
+        """
+        import extract
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._ocr_queue.append((image_path, future))
+        if len(self._ocr_queue) >= extract.MAX_BATCH_SIZE:
+            self.flush_ocr_queue()
+        elif self._ocr_timer is None:
+            self._ocr_timer = loop.call_later(OCR_BATCH_WAIT, self.flush_ocr_queue)
+        return await future
+
+    def flush_ocr_queue(self):
+        if self._ocr_timer is not None:
+            self._ocr_timer.cancel()
+            self._ocr_timer = None
+        queue, self._ocr_queue = self._ocr_queue, []
+        if queue:
+            task = asyncio.ensure_future(self.annotate_batch(queue))
+            self._ocr_batches.add(task)
+            task.add_done_callback(self._ocr_batches.discard)
+
+    async def annotate_batch(self, queue):
+        import extract
+        try:
+            results = await asyncio.to_thread(extract.annotate_batch, extract.get_client(),
+                                              [image_path for image_path, _ in queue])
+        except Exception as e:
+            for _, future in queue:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), (_, content, response_json_string, error) in zip(queue, results):
+            if not future.done():
+                future.set_result((content, response_json_string, error))
+
+    async def digest_page(self, json_path, digest_path):
+        os.makedirs(DIGESTS_DIR, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        executor = self.executor("digest", initializer=digest.init_dictionary,
+                                 initargs=(digest.load_verdicts(digest.DEFAULT_VERDICT_CACHE),))
+        _, error, _, new_verdicts = await loop.run_in_executor(executor, digest.digest_file, json_path, digest_path)
+        if error:
+            raise RuntimeError(error)
+        self.verdicts.update(new_verdicts)
+
+    async def revise_page(self, digest_path, revised_path):
+        import revise
+        if self._digest_hashes is None:
+            self._digest_hashes = revise.load_digest_hashes(REVISED_DIR)
+        if revise.revision_is_current(digest_path, REVISED_DIR, self._digest_hashes):
+            # Written from this digest, and maybe corrected by hand since; only a new digest replaces it
+            return
+        from llm import CompletionCache, get_async_client
+        from ratelimit import RateLimiter
+        if self._revise_context is None:
+            self._revise_context = (get_async_client(),
+                                    {revise.REFINE_MODEL: RateLimiter(500, 30000),
+                                     revise.FORMAT_MODEL: RateLimiter(500, 30000)},
+                                    CompletionCache())
+        async_client, limiters, cache = self._revise_context
+        raw_text = revise.assemble_text(revise.load_json(digest_path))
+        corrected_text, edits = await revise.refine_text_async(async_client, raw_text, limiters, self.llm_format, cache)
+        os.makedirs(REVISED_DIR, exist_ok=True)
+        write_if_changed(revised_path, revise.revision_json(corrected_text, edits))
+        self._digest_hashes[os.path.basename(revised_path)] = revise.digest_hash(digest_path)
+
+    async def run_page(self, page):
+        """Moves one page through slice, extract, digest and revise, stopping at the first failure."""
+        image_path = page.slice_path()
+        json_path = page.path(EXTRACTS_DIR)
+        digest_path = page.path(DIGESTS_DIR)
+        revised_path = page.path(REVISED_DIR)
+
+        if page.pdf_path:
+            if not await self.run_stage("slice", page.name, [page.pdf_path], [image_path],
+                                        lambda: self.slice_page(page, image_path), config=str(page.page_index)):
+                return False
+        return (await self.run_stage("extract", page.name, [image_path], [json_path],
+                                     lambda: self.extract_page(image_path, json_path))
+                and await self.run_stage("digest", page.name, [json_path], [digest_path],
+                                         lambda: self.digest_page(json_path, digest_path))
+                and await self.run_stage("revise", page.name, [digest_path], [revised_path],
+                                         lambda: self.revise_page(digest_path, revised_path),
+                                         config=f"llm_format={self.llm_format}"))
+
+    # Whole-book stages, run once every page is through revise
+
+    async def review_group(self, docx_file, revised_paths):
+        import review
+        loop = asyncio.get_running_loop()
+        _, _, errors = await loop.run_in_executor(self.executor("review"), review.build_review_document, docx_file,
+                                                  revised_paths, SLICES_DIR, DIGESTS_DIR)
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+    async def write_draft(self, draft_path, revised_paths):
+        await asyncio.to_thread(assemble.write_draft, revised_paths, draft_path)
+
+    async def run_book(self, pages):
+        revised = [page for page in pages if os.path.exists(page.path(REVISED_DIR))]
+        tasks = []
+        for start in range(0, len(revised), PAGES_PER_REVIEW):
+            group = revised[start:start + PAGES_PER_REVIEW]
+            docx_file = os.path.join(REVIEWS_DIR, f"review-{start + 1:03d}-{start + len(group):03d}.docx")
+            revised_paths = [page.path(REVISED_DIR) for page in group]
+            inputs = revised_paths + [page.path(DIGESTS_DIR) for page in group] + [page.slice_path() for page in group]
+            os.makedirs(REVIEWS_DIR, exist_ok=True)
+            tasks.append(self.run_stage("review", os.path.basename(docx_file), inputs, [docx_file],
+                                        lambda d=docx_file, r=revised_paths: self.review_group(d, r)))
+
+        draft_path = os.path.join(DRAFTS_DIR, "draft_ru.txt")
+        revised_paths = [page.path(REVISED_DIR) for page in revised]
+        tasks.append(self.run_stage("draft", "draft_ru", revised_paths, [draft_path],
+                                    lambda: self.write_draft(draft_path, revised_paths)))
+        await asyncio.gather(*tasks)
+
+    async def run(self, pages, book_pages):
+        try:
+            results = await asyncio.gather(*(self.run_page(page) for page in pages))
+            self.save_manifest()
+            await self.run_book(book_pages)
+        finally:
+            self.save_manifest()
+            if self._digest_hashes is not None:
+                import revise
+                revise.save_digest_hashes(REVISED_DIR, self._digest_hashes)
+            if self.verdicts:
+                merged = digest.load_verdicts(digest.DEFAULT_VERDICT_CACHE)
+                merged.update(self.verdicts)
+                digest.save_verdicts(digest.DEFAULT_VERDICT_CACHE, merged)
+            if self._revise_context is not None:
+                await self._revise_context[0].close()
+            for executor in self._executors.values():
+                executor.shutdown()
+        return results.count(False)
+
+    def report(self):
+        for stage in STAGE_SOURCES:
+            counts = {status: self.counts[stage, status] for status in ("ran", "fresh", "stale", "failed")
+                      if self.counts[stage, status]}
+            if counts:
+                print(f"{stage:<8}" + ", ".join(f"{n} {status}" for status, n in counts.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the memoir pipeline incrementally, page by page.")
+    parser.add_argument("--pages", help="Only run the per-page stages for this range of page numbers, e.g. 1-40")
+    parser.add_argument("--dry-run", action="store_true", help="List stale stages without running them")
+    parser.add_argument("--llm-format", action="store_true", help="Use the LLM formatting pass in revise")
+    for stage, limit in DEFAULT_CONCURRENCY.items():
+        parser.add_argument(f"--{stage}-jobs", type=int, default=limit,
+                            help=f"Concurrency limit of the {stage} stage (default is {limit})")
+    args = parser.parse_args()
+
+    pages = discover_pages()
+    selected = pages
+    if args.pages:
+        first, _, last = args.pages.partition("-")
+        selected = [page for page in pages
+                    if (not first or page.number >= int(first)) and (not last or page.number <= int(last))]
+
+    concurrency = {stage: getattr(args, f"{stage}_jobs") for stage in DEFAULT_CONCURRENCY}
+    pipeline = Pipeline(concurrency, args.dry_run, args.llm_format)
+    failed = asyncio.run(pipeline.run(selected, pages))
+    pipeline.report()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Client-side rate limiting for API calls.
+
+RateLimiter combines a requests-per-minute and a tokens-per-minute token bucket. Callers
+await acquire() with the number of tokens a request will use before sending it, and call
+pause() when the server answers 429 so every caller backs off for the Retry-After period.
+"""
+import time
+import asyncio
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to a capacity of one minute's budget."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be consumed. Amounts above capacity wait for a full bucket."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.available) / self.rate)
+
+    def consume(self, amount):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+class RateLimiter:
+    """Async limiter driven by requests-per-minute and tokens-per-minute budgets."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=0):
+        """Waits until one request of the given token size fits in both budgets, then consumes it."""
+        # Waiters queue on the lock, so requests are admitted in arrival order
+        async with self._lock:
+            while True:
+                wait = max(self.paused_until - time.monotonic(),
+                           self.requests.wait_time(1),
+                           self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Stops admitting requests for the given number of seconds, e.g. after a 429 with Retry-After."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -1,15 +1,44 @@
 import os
+import re
+import sys
 import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
 from docx import Document
-from docx.shared import Inches, Pt
+from docx.enum.text import WD_COLOR_INDEX
+from docx.shared import Inches, Pt, RGBColor
 from dotenv import load_dotenv
 from datetime import datetime
 
-def append_review_to_docx(docx_file, image_path, digest, revision_text, revision_edits, metadata):
+from align import align
+from cache import hash_key
+from fsutil import find_image
+from instrument import timed
+from slice import load_pixmap
+
+DEFAULT_THUMBNAIL_DIR = os.path.join(".cache", "thumbs")
+# The image column is 1.5 inches wide; 300 pixels keep it legible at 200 dpi
+THUMBNAIL_WIDTH = 300
+PAGES_PER_REVIEW = 40
+# Changed words are highlighted, low-confidence words are set in red
+CHANGED_HIGHLIGHT = WD_COLOR_INDEX.YELLOW
+LOW_CONFIDENCE_COLOR = RGBColor(0xC0, 0x00, 0x00)
+
+def append_review_to_docx(docx_file, image_path, digest, revision_text, revision_edits, metadata, digest_words=None):
     """Add a table with an image on the left and combined text on the right to the .docx file."""
     doc = Document(docx_file) if os.path.exists(docx_file) else Document()
+    add_review_table(doc, image_path, digest, revision_text, revision_edits, metadata, digest_words)
+    with timed("review", "save", document=os.path.basename(docx_file)) as fields:
+        doc.save(docx_file)
+        fields["bytes_written"] = os.path.getsize(docx_file)
 
+def add_review_table(doc, image_path, digest, revision_text, revision_edits, metadata, digest_words=None):
+    """
+    Add a table with an image on the left and combined text on the right to an open document.
+    With digest_words, the digest is aligned with the revision and changed and low-confidence
+    words are highlighted on both sides.
+    """
     table = doc.add_table(rows=1, cols=3)
 
     # Set the table to take the whole page width
@@ -35,15 +64,26 @@ def append_review_to_docx(docx_file, image_path, digest, revision_text, revision
     run = cell1.paragraphs[0].add_run()
     run.add_picture(image_path, width=Inches(1.5))  # Adjust image size
     cell1.add_paragraph(metadata)
-    cell1.add_paragraph(revision_edits)
 
-    # First row, second cell: Add the digest text
-    cell2 = table.cell(0, 1)
-    cell2.text = digest
+    if digest_words is None:
+        # First row, second cell: Add the digest text
+        cell2 = table.cell(0, 1)
+        cell2.text = digest
 
-    # First row, third cell: Add the revision text
-    cell3 = table.cell(0, 2)
-    cell3.text = revision_text
+        # First row, third cell: Add the revision text
+        cell3 = table.cell(0, 2)
+        cell3.text = revision_text
+    else:
+        alignment = align(digest_words, revision_text)
+        digest, word_spans = digest_to_text(digest_words, with_spans=True)
+        add_styled_text(table.cell(0, 1).paragraphs[0], digest,
+                        [word_spans[i] for i in sorted(alignment["changed_words"])],
+                        [word_spans[i] for i in sorted(alignment["low_confidence"])])
+        add_styled_text(table.cell(0, 2).paragraphs[0], revision_text,
+                        alignment["changed_spans"], alignment["low_confidence_spans"])
+        cell1.add_paragraph(f"Changed words: {len(alignment['changed_words'])} of {len(digest_words)}, "
+                            f"low confidence: {len(alignment['low_confidence'])}")
+    cell1.add_paragraph(revision_edits)
 
     # Set font size for digest and revision text to 8 (smaller)
     for cell in [table.cell(0, 1), table.cell(0, 2)]:
@@ -56,49 +96,204 @@ def append_review_to_docx(docx_file, image_path, digest, revision_text, revision
         for run in paragraph.runs:
             run.font.size = Pt(6)
 
-    doc.save(docx_file)
-def digest_to_text(word_objects):
+def add_styled_text(paragraph, text, changed_spans, low_confidence_spans):
+    """Adds text to a paragraph as runs, highlighting the changed spans and coloring the low-confidence ones."""
+    styles = bytearray(len(text) + 1)
+    for start, end in low_confidence_spans:
+        styles[start:end] = b"\x02" * (end - start)
+    for start, end in changed_spans:
+        styles[start:end] = bytes(style | 1 for style in styles[start:end])
+    styles[len(text)] = 0xFF  # Sentinel that ends the last run
+
+    start = 0
+    for position in range(1, len(text) + 1):
+        if styles[position] != styles[start]:
+            run = paragraph.add_run(text[start:position])
+            if styles[start] & 1:
+                run.font.highlight_color = CHANGED_HIGHLIGHT
+            if styles[start] & 2:
+                run.font.color.rgb = LOW_CONFIDENCE_COLOR
+            start = position
+
+def make_thumbnail(image_path, thumbnail_dir=DEFAULT_THUMBNAIL_DIR, width=THUMBNAIL_WIDTH):
+    """
+    Returns the path of a downscaled JPEG copy of the image, creating it if needed.
+    Thumbnails are cached by source path, size and modification time, so they are rebuilt only when the slice changes.
+    """
+    stat = os.stat(image_path)
+    key = hash_key(os.path.abspath(image_path), str(stat.st_size), str(stat.st_mtime_ns), str(width))
+    thumbnail_path = os.path.join(thumbnail_dir, key + ".jpg")
+    if os.path.exists(thumbnail_path):
+        return thumbnail_path
+
+    pix = load_pixmap(image_path)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)  # JPEG has no alpha channel
+    # Halve the image until the next halving would make it narrower than the target
+    shrink = 0
+    while pix.width >> (shrink + 1) >= width:
+        shrink += 1
+    if shrink:
+        pix.shrink(shrink)
+
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    temp_path = thumbnail_path + f".{os.getpid()}.tmp"
+    pix.save(temp_path, output="jpeg", jpg_quality=80)
+    os.replace(temp_path, thumbnail_path)
+    return thumbnail_path
+
+def page_number(path):
+    match = re.search(r'(\d+)', os.path.basename(path))
+    return int(match.group(1)) if match else 0
+
+def build_review_document(docx_file, revision_files, slices_dir, digests_dir, thumbnail_dir=DEFAULT_THUMBNAIL_DIR,
+                          highlight=True):
+    """
+    Builds a whole review document in one pass: one table per revised page, saved once at the end.
+    With highlight, changed and low-confidence words are marked (see add_review_table).
+
+    Returns:
+        tuple: (docx_file, pages added, list of error messages)
+    """
+    doc = Document()
+    added = 0
+    errors = []
+
+    for revision_path in revision_files:
+        base_filename = os.path.basename(revision_path)
+        image_path = find_image(slices_dir, os.path.splitext(base_filename)[0])
+        digest_path = os.path.join(digests_dir, base_filename)
+
+        # Check if the slice and digest files exist
+        if not os.path.exists(digest_path) or image_path is None:
+            errors.append(f"Missing slice or digest file for {revision_path}.")
+            continue
+
+        try:
+            with open(digest_path, 'r', encoding='utf-8') as f:
+                digest_data = json.load(f)
+            digest_text = digest_to_text(digest_data)
+            revision_text, revision_edits = load_revision(revision_path)
+            metadata = f"Image: {os.path.basename(image_path)}\nDigest: {os.path.basename(digest_path)}\nRevision: {base_filename}\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            with timed("review", "page", page=base_filename):
+                add_review_table(doc, make_thumbnail(image_path, thumbnail_dir), digest_text, revision_text,
+                                 revision_edits, metadata, digest_data if highlight else None)
+            added += 1
+        except Exception as e:
+            errors.append(f"Failed to review {revision_path}: {e}")
+
+    with timed("review", "save", document=os.path.basename(docx_file), pages=added) as fields:
+        doc.save(docx_file)
+        fields["bytes_written"] = os.path.getsize(docx_file)
+    return docx_file, added, errors
+
+def build_reviews(revised_dir, slices_dir, digests_dir, output_dir, pages_per_file=PAGES_PER_REVIEW,
+                  first_page=None, last_page=None, jobs=None, thumbnail_dir=DEFAULT_THUMBNAIL_DIR, highlight=True):
+    """
+    Builds review-NNN-MMM.docx files of pages_per_file pages each, one document per worker process.
+    The numbers in the file names count revised pages in order, like 05_review.sh always did.
+    With a page range, only the documents holding pages in that range are rebuilt, each with
+    all of its pages, so their names and contents stay those of a full run.
+
+    Returns:
+        int: number of pages that could not be reviewed.
+    """
+    revision_files = sorted((os.path.join(revised_dir, name) for name in os.listdir(revised_dir)
+                             if name.startswith('page_') and name.endswith('.json')), key=page_number)
+
+    def selected(revision_file):
+        return ((first_page is None or page_number(revision_file) >= first_page)
+                and (last_page is None or page_number(revision_file) <= last_page))
+
+    os.makedirs(output_dir, exist_ok=True)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for start in range(0, len(revision_files), pages_per_file):
+            batch = revision_files[start:start + pages_per_file]
+            if not any(selected(revision_file) for revision_file in batch):
+                continue
+            docx_file = os.path.join(output_dir, f"review-{start + 1:03d}-{start + len(batch):03d}.docx")
+            futures.append(executor.submit(build_review_document, docx_file, batch, slices_dir, digests_dir,
+                                           thumbnail_dir, highlight))
+        for future in futures:
+            docx_file, added, errors = future.result()
+            for error in errors:
+                print(f"Error: {error}")
+            failed += len(errors)
+            print(f"Wrote {docx_file} with {added} pages")
+    return failed
+
+def digest_to_text(word_objects, with_spans=False):
     """
     Converts the processed word objects into a single piece of text.
     Line breaks should be represented as newlines, and words should be separated by spaces.
+    With with_spans, also returns the (start, end) of each word in the text.
     """
-    text_lines = []
-    current_line = []
+    parts = []
+    spans = []
+    position = 0
 
-    for word_obj in word_objects:
+    for index, word_obj in enumerate(word_objects):
         word = word_obj['word']
         detected_break = word_obj['detected_break']
 
         # Add the word to the current line
-        current_line.append(word)
+        parts.append(word)
+        spans.append((position, position + len(word)))
+        position += len(word)
 
-        # If the detected break is a newline (3 or 5), flush the current line
-        if detected_break in [3, 5]:
-            text_lines.append(' '.join(current_line))
-            current_line = []  # Start a new line
+        # If the detected break is a newline (3 or 5), start a new line
+        if index < len(word_objects) - 1:
+            separator = '\n' if detected_break in [3, 5] else ' '
+            parts.append(separator)
+            position += 1
 
-    # Add any remaining words that didn't trigger a newline
-    if current_line:
-        text_lines.append(' '.join(current_line))
-
-    # Join all the lines with newlines and return the final text
-    return '\n'.join(text_lines)
+    text = ''.join(parts)
+    return (text, spans) if with_spans else text
 
 def load_revision(revision_path):
     with open(revision_path, 'r', encoding='utf-8') as f:
         revision_data = json.load(f)
     return revision_data['text'], revision_data['edits']
 
+def parse_page_range(value):
+    """Parses 'START-END', 'START-' or '-END' into a (first, last) tuple of page numbers or None."""
+    match = re.fullmatch(r'(\d*)-(\d*)', value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid page range '{value}', expected START-END")
+    return tuple(int(n) if n else None for n in match.groups())
+
 def main():
     parser = argparse.ArgumentParser(description="Populate a .docx with digests, revisions, and images for manual review.")
-    parser.add_argument('docx_file', help='Path to the .docx file to populate or create')
-    parser.add_argument('image_file', help='Path to the image file')
-    parser.add_argument('digest_file', help='Path to the digest JSON file')
-    parser.add_argument('revision_file', help='Path to the revision JSON file')
+    parser.add_argument('docx_file', nargs='?', help='Path to the .docx file to populate or create')
+    parser.add_argument('image_file', nargs='?', help='Path to the image file')
+    parser.add_argument('digest_file', nargs='?', help='Path to the digest JSON file')
+    parser.add_argument('revision_file', nargs='?', help='Path to the revision JSON file')
+    parser.add_argument('--output-dir', help='Build all review documents into this directory in one pass')
+    parser.add_argument('--revised-dir', default='revised', help="Directory of revisions for --output-dir (default is 'revised')")
+    parser.add_argument('--slices-dir', default='slices', help="Directory of page images for --output-dir (default is 'slices')")
+    parser.add_argument('--digests-dir', default='digests', help="Directory of digests for --output-dir (default is 'digests')")
+    parser.add_argument('--pages', type=parse_page_range, default=(None, None),
+                        help='Only rebuild the review documents holding pages in this range of page numbers, e.g. 1-120')
+    parser.add_argument('--pages-per-file', type=int, default=PAGES_PER_REVIEW,
+                        help=f'Pages per review document (default is {PAGES_PER_REVIEW})')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of documents built in parallel (default is the number of CPUs)')
+    parser.add_argument('--no-highlight', action='store_true',
+                        help='Show the digest and revision as plain text, without marking changed and low-confidence words')
     args = parser.parse_args()
 
     load_dotenv()
 
+    if args.output_dir:
+        failed = build_reviews(args.revised_dir, args.slices_dir, args.digests_dir, args.output_dir,
+                               args.pages_per_file, args.pages[0], args.pages[1], args.jobs,
+                               highlight=not args.no_highlight)
+        sys.exit(1 if failed else 0)
+
+    if not args.revision_file:
+        parser.error('docx_file, image_file, digest_file and revision_file are required without --output-dir')
+
     docx_file = args.docx_file
     image_path = args.image_file
     digest_path = args.digest_file
@@ -117,7 +312,8 @@ def main():
     digest_text = digest_to_text(digest_data)
     revision_text, revision_edits = load_revision(revision_path)
     metadata = f"Image: {os.path.basename(image_path)}\nDigest: {os.path.basename(digest_path)}\nRevision: {os.path.basename(revision_path)}\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    append_review_to_docx(docx_file, image_path, digest_text, revision_text, revision_edits, metadata)
+    append_review_to_docx(docx_file, image_path, digest_text, revision_text, revision_edits, metadata,
+                          None if args.no_highlight else digest_data)
 
     print(f'Processed digest {digest_path} with image {image_path}')
 
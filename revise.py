@@ -1,14 +1,29 @@
 import argparse
+import asyncio
 import json
-from openai import OpenAI
+import sys
 import os
 from dotenv import load_dotenv
 
+from batch import DEFAULT_POLL_INTERVAL, add_batch_arguments, run_batch
+from cache import hash_key
+from formatter import format_spacing
+from fsutil import write_if_changed
+from instrument import emit
+from layout import word_separators
+from llm import add_cache_arguments, cache_from_args, complete, complete_async, get_async_client, get_client
+from packing import pack_pages, packed_text, page_marker, unpack_response
+from ratelimit import RateLimiter
+from selective import (add_selective_arguments, fragments, parse_corrections, plan_page, selective_from_args,
+                       splice_corrections)
+from tokens import estimate_request_tokens
+
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
+REFINE_MODEL = "gpt-4o"
+FORMAT_MODEL = "gpt-4o-mini"
+# Kept in the output directory: {revision file name: hash of the digest it was revised from}
+DIGEST_HASHES = ".digests.json"
 
 def load_json(file_path):
     """Loads the JSON data from the provided file path."""
@@ -16,27 +31,16 @@ def load_json(file_path):
         return json.load(json_file)
 
 def assemble_text(ocr_data):
-    """Assembles OCR data from JSON into a single text string while respecting detected_break values."""
-    text = ""
-    for item in ocr_data:
-        word = item['word']
-        detected_break = item.get('detected_break', '')
-
-        # Append the word to the text
-        text += word
-
-        # Handle the detected break types
-        if detected_break == 1:  # Space break
-            text += " "
-        elif detected_break == 3:  # Line break
-            text += "\n"
-        elif detected_break == 5:  # Line break (not paragraph break)
-            text += "\n\n"
-
+    """
+    Assembles OCR data from JSON into a single text string. Digests written with --layout are
+    split into lines and paragraphs by their geometry, others by their detected_break values.
+    """
+    separators = word_separators(ocr_data)
+    text = "".join(item['word'] + separator for item, separator in zip(ocr_data, separators))
     return text.strip()  # Remove any leading or trailing whitespace
 
-def refine_text_with_openai(text):
-    """Sends the assembled text to OpenAI API for refinement."""
+def refine_request(text):
+    """Builds the chat completion request that corrects OCR errors in the assembled text."""
     prompt = f"""
       i am transcribing a russian book.
       i need you to take this ocred text and tell which errors exist.
@@ -50,9 +54,8 @@ def refine_text_with_openai(text):
       Then provide all the edits that were made prefixing that section with the string Edits:
     """
 
-    # Make a call to the OpenAI API for text refinement
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    return dict(
+        model=REFINE_MODEL,
         messages=[
             {"role": "system", "content": "You are an expert editor with a focus on maintaining accuracy in transcriptions."},
             {"role": "user", "content": prompt}
@@ -60,12 +63,8 @@ def refine_text_with_openai(text):
         temperature=0.3,
     )
 
-    # Extract the content and edits from the assistant's message
-    content = response.choices[0].message.content
-
-    # Split the content into corrected text and edits
-    corrected_text, edits_section = content.split("Edits:", 1)
-
+def format_request(corrected_text):
+    """Builds the chat completion request that cleans up spacing in the corrected text."""
     format_prompt = f"""
     Take this text and clean up all spacing issues. Specifically:
     - Remove all extra spaces between words or after punctuation marks.
@@ -78,8 +77,8 @@ def refine_text_with_openai(text):
     {corrected_text}
     """
 
-    format_response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    return dict(
+        model=FORMAT_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful editor that formats books."},
             {"role": "user", "content": format_prompt}
@@ -87,43 +86,529 @@ def refine_text_with_openai(text):
         temperature=0.7,
     )
 
+def spans_request(fragment_texts):
+    """Builds the chat completion request that corrects only the uncertain fragments of a page."""
+    numbered = "\n".join(f"{number}: {fragment}" for number, fragment in enumerate(fragment_texts, 1))
+    prompt = f"""
+      i am transcribing a russian book.
+      below are numbered fragments of one ocred page. words in ⟦ ⟧ were recognized with low confidence.
+      fix the ocr errors in each fragment, using the rest of the fragment as context.
+      try to keep the text as close to the original as possible and do not join or split fragments.
+
+      {numbered}
+
+      Desired Output: Each corrected fragment on its own line as its number, a colon and the text, without the ⟦ ⟧ marks.
+      Then provide all the edits that were made prefixing that section with the string Edits:
+    """
+
+    return dict(
+        model=REFINE_MODEL,
+        messages=[
+            {"role": "system", "content": "You are an expert editor with a focus on maintaining accuracy in transcriptions."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+    )
+
+def packed_request(group):
+    """Builds one correction request for several consecutive pages delimited by [[page_N]] markers."""
+    prompt = f"""
+      i am transcribing a russian book.
+      below are several consecutive ocred pages, each starting with its [[page_N]] marker on its own line.
+      i need you to take this ocred text and tell which errors exist.
+      then re-write the text as necessary, page by page.
+      finally, provide basic formatting for things like quotes and others to make it easier to convert to a book.
+      try to keep the text as close to the original as possible. keep every [[page_N]] marker exactly as it is,
+      on its own line, and keep each page's text after its own marker even when a sentence continues on the next page.
+
+      {packed_text(group)}
+
+      Desired Output: Provide the corrected version of the text with all the page markers. Do not prefix the output with any text.
+      Then provide all the edits that were made prefixing that section with the string Edits:
+      and list the edits of each page under its [[page_N]] marker.
+    """
+
+    return dict(
+        model=REFINE_MODEL,
+        messages=[
+            {"role": "system", "content": "You are an expert editor with a focus on maintaining accuracy in transcriptions."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+    )
+
+def combine_edits(edits_section, format_edits):
+    """Combines the correction edits and the formatting edits into one report."""
+    return f"{edits_section.strip()}\n\nFormatting edits:\n{format_edits}"
+
+def refine_text_with_openai(text, llm_format=False, cache=None):
+    """
+    Sends the assembled text to OpenAI API for refinement.
+    Spacing is then cleaned up locally by formatter.py, or by a second gpt-4o-mini pass if llm_format is set.
+    With a CompletionCache, requests that were answered before are not sent again.
+    """
+    # Make a call to the OpenAI API for text refinement and extract the content and edits
+    content = complete(get_client(), refine_request(text), cache, stage="revise")
+
+    # Split the content into corrected text and edits
+    corrected_text, edits_section = content.split("Edits:", 1)
+
+    if not llm_format:
+        formatted_text, format_edits = format_spacing(corrected_text)
+        return formatted_text, combine_edits(edits_section, format_edits)
+
     # Extract formatted text and formatting edits
-    format_content = format_response.choices[0].message.content
+    format_content = complete(get_client(), format_request(corrected_text), cache, stage="revise")
     formatted_text, format_edits = format_content.split("Edits:", 1)
     formatted_text = formatted_text.strip()
     format_edits = format_edits.strip()
 
     # Combine both sets of edits
-    combined_edits = f"{edits_section.strip()}\n\nFormatting edits:\n{format_edits}"
+    combined_edits = combine_edits(edits_section, format_edits)
 
     return formatted_text, combined_edits
 
-def main(json_file):
+async def refine_text_async(async_client, text, limiters, llm_format=False, cache=None):
+    """Async version of refine_text_with_openai that waits on the per-model rate limiters."""
+    request = refine_request(text)
+    content = await complete_async(async_client, request, limiters[request["model"]], cache, stage="revise")
+    corrected_text, edits_section = content.split("Edits:", 1)
+
+    if not llm_format:
+        formatted_text, format_edits = format_spacing(corrected_text)
+        return formatted_text, combine_edits(edits_section, format_edits)
+
+    request = format_request(corrected_text)
+    format_content = await complete_async(async_client, request, limiters[request["model"]], cache, stage="revise")
+    formatted_text, format_edits = format_content.split("Edits:", 1)
+
+    return formatted_text.strip(), combine_edits(edits_section, format_edits.strip())
+
+async def refine_group_async(async_client, group, limiters, llm_format=False, cache=None):
+    """
+    Revises a group of consecutive pages with one packed request.
+
+    Returns:
+        list: (marker, text, edits) per page, or None if the answer lost a page marker and the
+        pages have to be revised one by one.
+    """
+    request = packed_request(group)
+    content = await complete_async(async_client, request, limiters[request["model"]], cache, stage="revise")
+    corrected_text, _, edits_section = content.partition("Edits:")
+    pages = unpack_response(group, corrected_text, edits_section)
+    if pages is None:
+        return None
+
+    results = []
+    for marker, text, edits in pages:
+        if llm_format:
+            request = format_request(text)
+            format_content = await complete_async(async_client, request, limiters[request["model"]], cache,
+                                                  stage="revise")
+            text, format_edits = format_content.split("Edits:", 1)
+            results.append((marker, text.strip(), combine_edits(edits, format_edits.strip())))
+        else:
+            formatted_text, format_edits = format_spacing(text)
+            results.append((marker, formatted_text, combine_edits(edits, format_edits)))
+    return results
+
+def full_revision_tokens(text, llm_format=False):
+    """Estimated tokens of revising a whole page, the baseline selective revision is measured against."""
+    tokens = estimate_request_tokens(refine_request(text))
+    if llm_format:
+        tokens += estimate_request_tokens(format_request(text))
+    return tokens
+
+def plan_revision(ocr_data, settings, llm_format=False):
+    """
+    Plans a page's selective revision (see selective.plan_page). A page planned for span
+    revision is revised in full instead when the span request is not estimated to be smaller,
+    as happens when the context around scattered uncertain words covers most lines.
+    """
+    plan = plan_page(ocr_data, settings)
+    if plan["mode"] == "spans":
+        plan["request"] = spans_request(fragments(ocr_data, plan))
+        if estimate_request_tokens(plan["request"]) >= full_revision_tokens(plan["text"], llm_format):
+            plan["mode"] = "full"
+    return plan
+
+def selective_result(plan, text, edits, llm_format, sent_requests):
+    """Formats a selectively revised page and works out the calls and tokens it saved."""
+    formatted_text, format_edits = format_spacing(text)
+    full_calls = 2 if llm_format else 1
+    sent_tokens = sum(estimate_request_tokens(request) for request in sent_requests)
+    savings = {"mode": plan["mode"], "calls_saved": full_calls - len(sent_requests),
+               "tokens_saved": full_revision_tokens(plan["text"], llm_format) - sent_tokens}
+    return formatted_text, combine_edits(edits, format_edits), savings
+
+def revise_selective(ocr_data, settings, llm_format=False, cache=None):
+    """
+    Revises a page as much as its OCR confidence calls for (see selective.py). Pages that skip
+    the LLM or are revised by span are formatted locally, even with llm_format.
+
+    Returns:
+        tuple: (text, edits, savings) where savings holds the page's 'mode' and the estimated
+        'calls_saved' and 'tokens_saved' against a full revision.
+    """
+    plan = plan_revision(ocr_data, settings, llm_format)
+    if plan["mode"] == "full":
+        text, edits = refine_text_with_openai(plan["text"], llm_format, cache)
+        return text, edits, {"mode": "full", "calls_saved": 0, "tokens_saved": 0}
+    if plan["mode"] == "skip":
+        return selective_result(plan, plan["text"], "- Skipped: OCR confidence is high.", llm_format, [])
+
+    request = plan["request"]
+    corrections, edits = parse_corrections(complete(get_client(), request, cache, stage="revise"))
+    text, _ = splice_corrections(plan, corrections)
+    return selective_result(plan, text, edits, llm_format, [request])
+
+async def revise_selective_async(async_client, ocr_data, limiters, settings, llm_format=False, cache=None):
+    """Async version of revise_selective that waits on the per-model rate limiters."""
+    plan = plan_revision(ocr_data, settings, llm_format)
+    if plan["mode"] == "full":
+        text, edits = await refine_text_async(async_client, plan["text"], limiters, llm_format, cache)
+        return text, edits, {"mode": "full", "calls_saved": 0, "tokens_saved": 0}
+    if plan["mode"] == "skip":
+        return selective_result(plan, plan["text"], "- Skipped: OCR confidence is high.", llm_format, [])
+
+    request = plan["request"]
+    content = await complete_async(async_client, request, limiters[request["model"]], cache, stage="revise")
+    corrections, edits = parse_corrections(content)
+    text, _ = splice_corrections(plan, corrections)
+    return selective_result(plan, text, edits, llm_format, [request])
+
+def report_savings(savings):
+    """Prints and records how selective revision split the pages and what it saved."""
+    modes = {mode: sum(1 for s in savings if s["mode"] == mode) for mode in ("skip", "spans", "full")}
+    calls_saved = sum(s["calls_saved"] for s in savings)
+    tokens_saved = sum(s["tokens_saved"] for s in savings)
+    outcome = (f"about {calls_saved} calls and {tokens_saved} tokens saved" if tokens_saved >= 0
+               else f"about {-tokens_saved} more tokens than revising every page in full")
+    print(f"Selective revision: {modes['skip']} pages formatted locally, {modes['spans']} revised by span, "
+          f"{modes['full']} revised in full; {outcome}.")
+    emit("revise", "selective", pages=len(savings), calls_saved=calls_saved, tokens_saved=tokens_saved,
+         **{f"pages_{mode}": count for mode, count in modes.items()})
+
+def revision_json(corrected_text, edits):
+    """Serializes a revision the way it is stored in revised/."""
+    return json.dumps({"text": corrected_text, "edits": edits}, ensure_ascii=False, indent=2)
+
+def collect_digests(paths):
+    """Expands directories into the JSON digests they contain, sorted by name."""
+    input_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            input_files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.json')))
+        else:
+            input_files.append(path)
+    return input_files
+
+def digest_hash(json_file):
+    with open(json_file, 'rb') as f:
+        return hash_key(f.read())
+
+def load_digest_hashes(output_dir):
+    try:
+        with open(os.path.join(output_dir, DIGEST_HASHES), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_digest_hashes(output_dir, hashes):
+    write_if_changed(os.path.join(output_dir, DIGEST_HASHES), json.dumps(hashes, indent=1, sort_keys=True))
+
+def revision_is_current(json_file, output_dir, hashes):
+    """
+    True if the digest has a revision in output_dir written from its current content. A revision
+    written before digest hashes were kept, possibly corrected by hand since, is taken to match
+    its digest as it is now, and that hash is added to hashes.
+    """
+    name = os.path.basename(json_file)
+    if not os.path.exists(os.path.join(output_dir, name)):
+        return False
+    current = digest_hash(json_file)
+    return hashes.setdefault(name, current) == current
+
+def pending_digests(input_files, output_dir, force=False):
+    """
+    Picks the digests to revise: those without a current revision in output_dir (see
+    revision_is_current), or all of them with force.
+
+    Returns:
+        tuple: (digests to revise, {revision file name: digest hash} to update and save)
+    """
+    hashes = load_digest_hashes(output_dir)
+    pending = [json_file for json_file in input_files
+               if force or not revision_is_current(json_file, output_dir, hashes)]
+    print(f"{len(input_files) - len(pending)} pages already revised, {len(pending)} to go.")
+    return pending, hashes
+
+async def revise_batch(input_files, output_dir, concurrency=8, rpm=500, tpm=30000, llm_format=False, cache=None,
+                       selective=None, pack_tokens=0, force=False):
+    """
+    Revises many digests concurrently.
+
+    Each page's revision is checkpointed to output_dir as soon as it completes, so an
+    interrupted run resumes where it stopped. Pages whose revision was written from the same
+    digest are skipped unless force is set, so revisions corrected by hand are kept until their
+    digest changes. Requests are admitted by one RateLimiter per model built from the
+    rpm and tpm budgets. With selective settings, pages are revised as much as their OCR
+    confidence calls for and the savings are reported at the end.
+
+    With pack_tokens, consecutive pages that are revised in full are packed into requests of
+    up to that many text tokens. A group whose answer lost a page marker is revised page by page.
+
+    Returns:
+        int: number of pages that failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pending, hashes = pending_digests(input_files, output_dir, force)
+
+    async_client = get_async_client()
+    limiters = {REFINE_MODEL: RateLimiter(rpm, tpm), FORMAT_MODEL: RateLimiter(rpm, tpm)}
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+    savings = []
+
+    async def revise_page(json_file):
+        nonlocal failed
+        output_file = os.path.join(output_dir, os.path.basename(json_file))
+        async with semaphore:
+            try:
+                if selective is not None:
+                    corrected_text, edits, page_savings = await revise_selective_async(
+                        async_client, load_json(json_file), limiters, selective, llm_format, cache)
+                    savings.append(page_savings)
+                else:
+                    raw_text = assemble_text(load_json(json_file))
+                    corrected_text, edits = await refine_text_async(async_client, raw_text, limiters, llm_format, cache)
+            except Exception as e:
+                failed += 1
+                print(f"Error: Failed to process {json_file}: {e}")
+                return
+        if write_if_changed(output_file, revision_json(corrected_text, edits)):
+            print(f"Created {output_file}")
+        hashes[os.path.basename(json_file)] = digest_hash(json_file)
+
+    packing = {"pages": 0, "requests": 0, "fallbacks": 0}
+
+    async def revise_group(group_files):
+        nonlocal failed
+        group = [(page_marker(json_file), assemble_text(load_json(json_file))) for json_file in group_files]
+        async with semaphore:
+            try:
+                results = await refine_group_async(async_client, group, limiters, llm_format, cache)
+            except Exception as e:
+                failed += len(group_files)
+                print(f"Error: Failed to process {', '.join(group_files)}: {e}")
+                return
+        packing["pages"] += len(group_files)
+        packing["requests"] += 1
+        if results is None:
+            packing["fallbacks"] += 1
+            print(f"Warning: A page marker was lost in {group[0][0]}..{group[-1][0]}, revising those pages one by one.")
+            # revise_page records the savings of these pages itself
+            await asyncio.gather(*(revise_page(json_file) for json_file in group_files))
+            return
+        if selective is not None:
+            savings.extend({"mode": "full", "calls_saved": 0, "tokens_saved": 0} for _ in group_files)
+        for json_file, (_, corrected_text, edits) in zip(group_files, results):
+            output_file = os.path.join(output_dir, os.path.basename(json_file))
+            if write_if_changed(output_file, revision_json(corrected_text, edits)):
+                print(f"Created {output_file}")
+            hashes[os.path.basename(json_file)] = digest_hash(json_file)
+
+    if pack_tokens:
+        # Pages selective revision would not send in full keep their own path
+        single, packable = [], []
+        for json_file in pending:
+            if selective is not None and plan_revision(load_json(json_file), selective, llm_format)["mode"] != "full":
+                single.append(json_file)
+            else:
+                packable.append(json_file)
+        texts = {page_marker(f): f for f in packable}
+        groups = [[texts[marker] for marker, _ in group]
+                  for group in pack_pages([(page_marker(f), assemble_text(load_json(f))) for f in packable], pack_tokens)]
+        await asyncio.gather(*(revise_page(json_file) for json_file in single),
+                             *(revise_group(group) for group in groups))
+    else:
+        await asyncio.gather(*(revise_page(json_file) for json_file in pending))
+    await async_client.close()
+    save_digest_hashes(output_dir, hashes)
+    if savings:
+        report_savings(savings)
+    if packing["requests"]:
+        print(f"Packing: {packing['pages']} pages in {packing['requests']} requests, "
+              f"{packing['fallbacks']} groups revised page by page.")
+        emit("revise", "packing", **packing)
+    return failed
+
+def revise_with_batch(input_files, output_dir, jsonl_path, llm_format=False, cache=None,
+                      poll_interval=DEFAULT_POLL_INTERVAL, force=False):
+    """
+    Revises many digests through the Batch API.
+
+    The correction requests go out as one batch. With llm_format, the formatting requests of
+    the corrected pages follow as a second batch written next to the first; otherwise the
+    pages are formatted locally. Pages are skipped and checkpointed as in revise_batch.
+
+    Returns:
+        int: number of pages that failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pending, hashes = pending_digests(input_files, output_dir, force)
+    save_digest_hashes(output_dir, hashes)
+    if not pending:
+        return 0
+
+    files = {page_marker(f): f for f in pending}
+    items = [(f"refine:{marker}", refine_request(assemble_text(load_json(f)))) for marker, f in files.items()]
+    contents, errors = run_batch(get_client(), items, jsonl_path, cache, poll_interval, stage="revise")
+
+    revisions = {}
+    for marker in files:
+        content = contents.get(f"refine:{marker}")
+        if content is None or "Edits:" not in content:
+            errors.setdefault(f"refine:{marker}", "The response has no Edits: section")
+            continue
+        revisions[marker] = content.split("Edits:", 1)
+
+    if llm_format and revisions:
+        # The formatting pass depends on the corrected text, so it is a second batch
+        format_path = os.path.splitext(jsonl_path)[0] + ".format.jsonl"
+        items = [(f"format:{marker}", format_request(corrected)) for marker, (corrected, _) in revisions.items()]
+        format_contents, format_errors = run_batch(get_client(), items, format_path, cache, poll_interval, stage="revise")
+        errors.update(format_errors)
+        for marker, (_, edits_section) in list(revisions.items()):
+            content = format_contents.get(f"format:{marker}")
+            if content is None or "Edits:" not in content:
+                errors.setdefault(f"format:{marker}", "The response has no Edits: section")
+                del revisions[marker]
+                continue
+            formatted_text, format_edits = content.split("Edits:", 1)
+            revisions[marker] = (formatted_text.strip(), combine_edits(edits_section, format_edits.strip()))
+    else:
+        for marker, (corrected, edits_section) in revisions.items():
+            formatted_text, format_edits = format_spacing(corrected)
+            revisions[marker] = (formatted_text, combine_edits(edits_section, format_edits))
+
+    for marker, (corrected_text, edits) in revisions.items():
+        output_file = os.path.join(output_dir, os.path.basename(files[marker]))
+        if write_if_changed(output_file, revision_json(corrected_text, edits)):
+            print(f"Created {output_file}")
+        hashes[os.path.basename(files[marker])] = digest_hash(files[marker])
+    save_digest_hashes(output_dir, hashes)
+    for custom_id, error in errors.items():
+        print(f"Error: Failed to process {custom_id}: {error}")
+    return len(files) - len(revisions)
+
+def reuse_duplicates(reused, output_dir):
+    """
+    Copies the revision of each duplicate page's original, as split off by dedupe.split_duplicates.
+
+    Returns:
+        int: number of duplicates whose original has no revision.
+    """
+    from dedupe import copy_result
+    failed = 0
+    for json_file, original in reused.items():
+        source = os.path.join(output_dir, original + ".json")
+        output_file = os.path.join(output_dir, os.path.basename(json_file))
+        if not os.path.exists(source):
+            failed += 1
+            print(f"Error: Failed to process {json_file}: {original}, which it duplicates, has no revision")
+            continue
+        if copy_result(source, output_file):
+            print(f"Created {output_file} from {original}")
+    if reused:
+        emit("revise", "duplicates", pages=len(reused), failed=failed)
+    return failed
+
+def revise_file(json_file, llm_format=False, cache=None, selective=None):
     # Load the OCR data from JSON file
     ocr_data = load_json(json_file)
 
+    if selective is not None:
+        # Revise only as much of the page as its OCR confidence calls for
+        corrected_text, edits, savings = revise_selective(ocr_data, selective, llm_format, cache)
+        print(revision_json(corrected_text, edits))
+        print(f"Selective revision: {savings['mode']}, about {savings['tokens_saved']} tokens saved.", file=sys.stderr)
+        return
+
     # Assemble OCR words into raw text while respecting breaks
     raw_text = assemble_text(ocr_data)
 
     # Refine the raw text using OpenAI API
-    corrected_text, edits = refine_text_with_openai(raw_text)
-
-    # Create the output as a JSON object
-    output = {
-        "text": corrected_text,
-        "edits": edits
-    }
+    corrected_text, edits = refine_text_with_openai(raw_text, llm_format, cache)
 
     # Print the JSON object to stdout
-    print(json.dumps(output, ensure_ascii=False, indent=2))
+    print(revision_json(corrected_text, edits))
 
-if __name__ == '__main__':
+def main():
     # Initialize the argument parser
     parser = argparse.ArgumentParser(description='Process a JSON OCR data to generate a page of text.')
-    parser.add_argument('json_file', type=str, help='The JSON file containing the OCR-extracted text.')
+    parser.add_argument('json_file', type=str, nargs='+',
+                        help='The JSON file containing the OCR-extracted text. With --output-dir, any number of files or directories.')
+    parser.add_argument('--llm-format', action='store_true',
+                        help='Clean up spacing with a gpt-4o-mini pass instead of the local formatter.')
+    add_cache_arguments(parser)
+    add_selective_arguments(parser)
+    add_batch_arguments(parser)
+    parser.add_argument('--duplicates', metavar='JSON',
+                        help="Duplicates map from dedupe.py; with --output-dir, duplicate pages reuse their original's revision.")
+    parser.add_argument('--output-dir', type=str, help='Revise all inputs concurrently, writing one JSON file per page here.')
+    parser.add_argument('--force', action='store_true',
+                        help='With --output-dir, revise every page again, even those whose digest has not changed '
+                             'since their revision.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum pages in flight (default is 8).')
+    parser.add_argument('--rpm', type=int, default=500, help='Requests-per-minute budget per model (default is 500).')
+    parser.add_argument('--tpm', type=int, default=30000, help='Tokens-per-minute budget per model (default is 30000).')
+    parser.add_argument('--pack-tokens', type=int, default=0,
+                        help='With --output-dir, pack consecutive pages into requests of up to this many text tokens '
+                             '(default is 0, one request per page).')
 
     # Parse the arguments
     args = parser.parse_args()
 
+    cache = cache_from_args(args)
+    selective = selective_from_args(args)
+
+    input_files, reused = collect_digests(args.json_file), {}
+    if args.duplicates:
+        if not args.output_dir:
+            parser.error('--duplicates requires --output-dir')
+        # dedupe loads PyMuPDF and NumPy, which only runs with a duplicates map need
+        from dedupe import load_duplicates, split_duplicates
+        input_files, reused = split_duplicates(
+            input_files, load_duplicates(args.duplicates),
+            lambda name: os.path.exists(os.path.join(args.output_dir, name + ".json")))
+
+    if args.batch:
+        if not args.output_dir:
+            parser.error('--batch requires --output-dir')
+        if selective is not None or args.pack_tokens:
+            parser.error('--batch cannot be combined with --selective or --pack-tokens')
+        failed = revise_with_batch(input_files, args.output_dir, args.batch, args.llm_format,
+                                   cache, args.poll_interval, args.force or args.refresh)
+        failed += reuse_duplicates(reused, args.output_dir)
+        sys.exit(1 if failed else 0)
+
+    if args.output_dir:
+        failed = asyncio.run(revise_batch(input_files, args.output_dir,
+                                          args.concurrency, args.rpm, args.tpm, args.llm_format, cache, selective,
+                                          args.pack_tokens, args.force or args.refresh))
+        failed += reuse_duplicates(reused, args.output_dir)
+        if cache is not None:
+            print(f"LLM cache: {cache.stats()}")
+        sys.exit(1 if failed else 0)
+
+    if len(args.json_file) != 1:
+        parser.error('multiple input files require --output-dir')
+
     # Run the main process
-    main(args.json_file)
+    revise_file(args.json_file[0], args.llm_format, cache, selective)
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Full-text index of the OCR digests and the revised pages.
+
+Words are indexed by a normalized form (lower case, ё folded into е, punctuation stripped)
+and by a crude stem with common Russian endings removed, so "Москвы" finds "Москва" and
+"Москве". Each posting keeps the page, the word position and, for OCR hits, the Vision
+bounding box of the word on slices/page_NNN.png.
+
+The index lives in one SQLite file and is updated incrementally: a page is re-indexed only
+when the hash of its file changed, and pages whose file disappeared are dropped.
+
+Usage:
+    python search_index.py update
+    python search_index.py query Шяуляй
+    python search_index.py query Баграм --prefix
+    python search_index.py query Шауляй --fuzzy
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+from cache import hash_key
+from fsutil import find_image
+
+DEFAULT_DB_PATH = os.path.join(".cache", "search.sqlite")
+SOURCES = {"ocr": "digests", "revised": "revised"}
+
+WORD = re.compile(r'[\w-]+')
+# Longest endings first so "ами" is removed before "и"
+ENDINGS = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие", "ой",
+    "ей", "ый", "ий", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ую", "юю", "ою", "ею", "ия", "ья",
+    "ье", "ию", "ью", "ии", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+MIN_STEM = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, source TEXT, page INTEGER, hash TEXT);
+CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, norm TEXT UNIQUE, stem TEXT);
+CREATE INDEX IF NOT EXISTS terms_stem ON terms (stem);
+CREATE TABLE IF NOT EXISTS postings (term INTEGER, source TEXT, page INTEGER, position INTEGER, surface TEXT,
+                                     x0 INTEGER, y0 INTEGER, x1 INTEGER, y1 INTEGER);
+CREATE INDEX IF NOT EXISTS postings_term ON postings (term);
+CREATE INDEX IF NOT EXISTS postings_page ON postings (source, page);
+"""
+
+def normalize(word):
+    """Lower case, ё as е, without surrounding punctuation. Returns '' for words with no letters or digits."""
+    return word.lower().replace("ё", "е").strip("-_")
+
+def stem(norm):
+    for ending in ENDINGS:
+        if norm.endswith(ending) and len(norm) - len(ending) >= MIN_STEM:
+            return norm[:-len(ending)]
+    return norm
+
+def page_number(path):
+    match = re.search(r'page_(\d+)', os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+def connect(db_path=DEFAULT_DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+def ocr_words(path):
+    """(position, surface word, box) for each word of a digest; the position is the word's index in the digest."""
+    with open(path, 'r', encoding='utf-8') as f:
+        words = json.load(f)
+    for position, word in enumerate(words):
+        for token in WORD.findall(word["word"]):
+            yield position, token, word.get("box")
+
+def revised_words(path):
+    """(position, surface word, None) for each word of a revised page's text."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = json.load(f)["text"]
+    for position, token in enumerate(WORD.findall(text)):
+        yield position, token, None
+
+def term_id(connection, terms, norm):
+    if norm not in terms:
+        connection.execute("INSERT OR IGNORE INTO terms (norm, stem) VALUES (?, ?)", (norm, stem(norm)))
+        terms[norm] = connection.execute("SELECT id FROM terms WHERE norm = ?", (norm,)).fetchone()[0]
+    return terms[norm]
+
+def index_file(connection, terms, source, path, page):
+    connection.execute("DELETE FROM postings WHERE source = ? AND page = ?", (source, page))
+    words = ocr_words(path) if source == "ocr" else revised_words(path)
+    rows = []
+    for position, surface, box in words:
+        norm = normalize(surface)
+        if norm:
+            rows.append((term_id(connection, terms, norm), source, page, position, surface, *(box or (None,) * 4)))
+    connection.executemany("INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+def update(connection, directories):
+    """
+    Re-indexes the pages whose files changed and drops pages whose files are gone.
+
+    Args:
+        directories (dict): Directory to index for each source ('ocr', 'revised').
+
+    Returns:
+        dict: Counts of 'indexed', 'unchanged' and 'removed' pages.
+    """
+    counts = {"indexed": 0, "unchanged": 0, "removed": 0}
+    known = {path: (source, page, file_hash)
+             for path, source, page, file_hash in connection.execute("SELECT path, source, page, hash FROM files")}
+    terms = {}
+    seen = set()
+    with connection:
+        for source, directory in directories.items():
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                page = page_number(name)
+                if page is None or not name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, name)
+                seen.add(path)
+                with open(path, 'rb') as f:
+                    file_hash = hash_key(f.read())
+                if path in known and known[path][2] == file_hash:
+                    counts["unchanged"] += 1
+                    continue
+                index_file(connection, terms, source, path, page)
+                connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, source, page, file_hash))
+                counts["indexed"] += 1
+        for path, (source, page, _) in known.items():
+            if path not in seen:
+                connection.execute("DELETE FROM postings WHERE source = ? AND page = ?", (source, page))
+                connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                counts["removed"] += 1
+    return counts
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or limit + 1 as soon as it is certain to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def matching_terms(connection, query, mode="stem", max_distance=None):
+    """
+    Ids of the indexed terms that match query.
+
+    Modes: 'stem' matches words with the same stem, 'prefix' matches words starting with the
+    query, 'fuzzy' matches words within max_distance edits (1 for short words, 2 otherwise)
+    among those sharing the query's first letter.
+    """
+    norm = normalize(query)
+    if not norm:
+        return []
+    if mode == "prefix":
+        rows = connection.execute("SELECT id FROM terms WHERE norm >= ? AND norm < ?", (norm, norm + "\uffff"))
+        return [row[0] for row in rows]
+    if mode == "fuzzy":
+        limit = max_distance if max_distance is not None else (1 if len(norm) <= 5 else 2)
+        rows = connection.execute("SELECT id, norm FROM terms WHERE norm >= ? AND norm < ?",
+                                  (norm[0], norm[0] + "\uffff"))
+        return [term for term, candidate in rows if edit_distance(norm, candidate, limit) <= limit]
+    rows = connection.execute("SELECT id FROM terms WHERE stem = ?", (stem(norm),))
+    return [row[0] for row in rows]
+
+def query(connection, text, mode="stem", source=None, max_distance=None, limit=200):
+    """
+    Returns postings for a query as dicts with source, page, position, word and box, in page order.
+    """
+    term_ids = matching_terms(connection, text, mode, max_distance)
+    if not term_ids:
+        return []
+    placeholders = ",".join("?" * len(term_ids))
+    sql = (f"SELECT source, page, position, surface, x0, y0, x1, y1 FROM postings WHERE term IN ({placeholders})"
+           + (" AND source = ?" if source else "") + " ORDER BY page, source, position LIMIT ?")
+    rows = connection.execute(sql, term_ids + ([source] if source else []) + [limit])
+    return [{"source": row[0], "page": row[1], "position": row[2], "word": row[3],
+             "box": list(row[4:]) if row[4] is not None else None} for row in rows]
+
+def image_link(page, slices_dir="slices"):
+    """The page's slice in whichever format it was sliced to, or None if it is missing."""
+    return find_image(slices_dir, f"page_{page:03d}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a full-text index of digests and revised pages.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help=f"Index database (default is {DEFAULT_DB_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update_parser = commands.add_parser("update", help="Index new and changed pages")
+    update_parser.add_argument("--digests-dir", default=SOURCES["ocr"], help="Directory of digests (default is 'digests')")
+    update_parser.add_argument("--revised-dir", default=SOURCES["revised"], help="Directory of revisions (default is 'revised')")
+    query_parser = commands.add_parser("query", help="Find a word")
+    query_parser.add_argument("word", help="Word to find")
+    mode = query_parser.add_mutually_exclusive_group()
+    mode.add_argument("--prefix", action="store_true", help="Match words starting with the query")
+    mode.add_argument("--fuzzy", action="store_true", help="Match words within a few edits of the query")
+    query_parser.add_argument("--max-distance", type=int, help="Edits allowed by --fuzzy (default is 1 for short words, 2 otherwise)")
+    query_parser.add_argument("--source", choices=sorted(SOURCES), help="Only search OCR digests or revised pages")
+    query_parser.add_argument("--slices-dir", default="slices", help="Directory of page images to link to (default is 'slices')")
+    query_parser.add_argument("--limit", type=int, default=200, help="Maximum hits to print (default is 200)")
+    args = parser.parse_args()
+
+    connection = connect(args.db)
+    if args.command == "update":
+        start = time.perf_counter()
+        counts = update(connection, {"ocr": args.digests_dir, "revised": args.revised_dir})
+        print(f"{counts['indexed']} pages indexed, {counts['unchanged']} unchanged, {counts['removed']} removed "
+              f"in {time.perf_counter() - start:.2f}s")
+        return
+
+    start = time.perf_counter()
+    mode = "prefix" if args.prefix else "fuzzy" if args.fuzzy else "stem"
+    hits = query(connection, args.word, mode, args.source, args.max_distance, args.limit)
+    elapsed = (time.perf_counter() - start) * 1000
+    for hit in hits:
+        location = ""
+        if hit["box"]:
+            image_path = image_link(hit['page'], args.slices_dir)
+            location = f"{image_path} {hit['box']}" if image_path else str(hit['box'])
+        print(f"page {hit['page']:>4}  {hit['source']:<8} word {hit['position']:>4}  {hit['word']:<20} {location}")
+    print(f"{len(hits)} hits in {elapsed:.1f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Confidence-driven selective revision.
+
+digest.py keeps the OCR confidence of every word. A page where almost every word is confident
+gains little from a full gpt-4o rewrite, so selective revision sorts pages by the share of
+low-confidence words:
+
+- below skip_share, the page only goes through the local formatter;
+- above full_share, the whole page is revised as before;
+- in between, only the uncertain words and a few words of context around them (never past
+  the end of their line) are sent, and the corrected fragments are spliced back into the page.
+  revise.plan_revision sends such a page in full after all when the fragments would not make
+  a smaller request.
+
+Pages that skip the LLM or are revised by span go through the local formatter even with
+--llm-format; only pages revised in full get the gpt-4o-mini formatting pass.
+"""
+import re
+
+from layout import word_separators
+
+# Uncertain words are marked in the fragments sent for correction
+MARK_OPEN, MARK_CLOSE = "⟦", "⟧"
+FRAGMENT_LINE = re.compile(r'^\s*(\d+)\s*[:.)]\s?(.*)$')
+
+DEFAULT_SELECTIVE = {
+    "word_threshold": 0.8,  # words below this confidence are uncertain
+    "skip_share": 0.02,     # pages with at most this share of uncertain words skip the LLM
+    "full_share": 0.25,     # pages with more than this share are revised in full
+    "context_words": 6,     # words of context on each side of an uncertain word
+}
+
+def add_selective_arguments(parser):
+    """Adds the --selective option and its thresholds."""
+    parser.add_argument('--selective', action='store_true',
+                        help='Use digest confidences to skip confident pages and send only uncertain spans of others. '
+                             'Those pages are formatted locally even with --llm-format.')
+    parser.add_argument('--word-threshold', type=float, default=DEFAULT_SELECTIVE["word_threshold"],
+                        help=f'Words below this confidence are uncertain (default is {DEFAULT_SELECTIVE["word_threshold"]}).')
+    parser.add_argument('--skip-share', type=float, default=DEFAULT_SELECTIVE["skip_share"],
+                        help='Pages with at most this share of uncertain words are only formatted locally '
+                             f'(default is {DEFAULT_SELECTIVE["skip_share"]}).')
+    parser.add_argument('--full-share', type=float, default=DEFAULT_SELECTIVE["full_share"],
+                        help='Pages with more than this share of uncertain words are revised in full '
+                             f'(default is {DEFAULT_SELECTIVE["full_share"]}).')
+    parser.add_argument('--context-words', type=int, default=DEFAULT_SELECTIVE["context_words"],
+                        help=f'Words of context around uncertain words (default is {DEFAULT_SELECTIVE["context_words"]}).')
+
+def selective_from_args(args):
+    """Builds the selective settings chosen by add_selective_arguments options, or None."""
+    if not args.selective:
+        return None
+    return {"word_threshold": args.word_threshold, "skip_share": args.skip_share,
+            "full_share": args.full_share, "context_words": args.context_words}
+
+def assemble_with_offsets(ocr_data):
+    """
+    Assembles the page exactly like revise.assemble_text, also returning where each word landed.
+
+    Returns:
+        tuple: (text, offsets) where offsets[i] is the (start, end) of word i in text.
+    """
+    parts = []
+    offsets = []
+    position = 0
+    for item, separator in zip(ocr_data, word_separators(ocr_data)):
+        word = item['word']
+        offsets.append((position, position + len(word)))
+        parts.append(word + separator)
+        position += len(word) + len(separator)
+
+    text = "".join(parts)
+    stripped = text.strip()
+    shift = len(text) - len(text.lstrip())
+    offsets = [(max(0, start - shift), max(0, min(end - shift, len(stripped)))) for start, end in offsets]
+    return stripped, offsets
+
+def line_bounds(ocr_data):
+    """Index of the first and last word of the line each word is on."""
+    bounds = []
+    start = 0
+    for index, separator in enumerate(word_separators(ocr_data)):
+        if "\n" in separator or index == len(ocr_data) - 1:
+            bounds.extend([(start, index)] * (index - start + 1))
+            start = index + 1
+    return bounds
+
+def uncertain_spans(ocr_data, word_threshold, context_words):
+    """
+    Groups uncertain words with their context into non-overlapping word ranges within a line.
+
+    Returns:
+        list: (first word, last word, uncertain word indices) tuples in page order.
+    """
+    bounds = line_bounds(ocr_data)
+    spans = []
+    for index, item in enumerate(ocr_data):
+        if item.get('confidence', 0.0) >= word_threshold:
+            continue
+        line_start, line_end = bounds[index]
+        first = max(line_start, index - context_words)
+        last = min(line_end, index + context_words)
+        if spans and spans[-1][1] >= first and bounds[spans[-1][0]] == bounds[index]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], last), spans[-1][2] + [index])
+        else:
+            spans.append((first, last, [index]))
+    return spans
+
+def plan_page(ocr_data, settings):
+    """
+    Decides how much of a page to send for revision.
+
+    Returns:
+        dict: 'mode' ('skip', 'spans' or 'full'), the assembled 'text', the word 'offsets',
+        the uncertain word 'spans' and the 'uncertain_share' the decision was based on.
+    """
+    text, offsets = assemble_with_offsets(ocr_data)
+    spans = uncertain_spans(ocr_data, settings["word_threshold"], settings["context_words"])
+    uncertain = sum(len(span[2]) for span in spans)
+    share = uncertain / len(ocr_data) if ocr_data else 0.0
+    if share <= settings["skip_share"]:
+        mode = "skip"
+    elif share > settings["full_share"]:
+        mode = "full"
+    else:
+        mode = "spans"
+    return {"mode": mode, "text": text, "offsets": offsets, "spans": spans, "uncertain_share": share}
+
+def fragments(ocr_data, plan):
+    """The text of each span with its uncertain words marked, as sent for correction."""
+    text, offsets = plan["text"], plan["offsets"]
+    result = []
+    for first, last, uncertain in plan["spans"]:
+        pieces = []
+        for index in range(first, last + 1):
+            start, end = offsets[index]
+            word = text[start:end]
+            pieces.append(f"{MARK_OPEN}{word}{MARK_CLOSE}" if index in uncertain else word)
+            if index < last:
+                pieces.append(text[end:offsets[index + 1][0]])
+        result.append("".join(pieces))
+    return result
+
+def parse_corrections(content):
+    """
+    Reads numbered fragment lines ('3: corrected text') and the Edits section from a response.
+
+    Returns:
+        tuple: ({fragment number: corrected text}, edits section)
+    """
+    body, _, edits = content.partition("Edits:")
+    corrections = {}
+    for line in body.splitlines():
+        match = FRAGMENT_LINE.match(line)
+        if match:
+            corrections[int(match.group(1))] = match.group(2).replace(MARK_OPEN, "").replace(MARK_CLOSE, "").strip()
+    return corrections, edits.strip()
+
+def splice_corrections(plan, corrections):
+    """
+    Replaces each span of the page with its correction. Missing, empty or implausibly long
+    corrections leave the original span in place.
+
+    Returns:
+        tuple: (text, number of spans replaced)
+    """
+    text, offsets = plan["text"], plan["offsets"]
+    replaced = 0
+    # Splice from the end so earlier offsets stay valid
+    for number, (first, last, _) in reversed(list(enumerate(plan["spans"], 1))):
+        start, end = offsets[first][0], offsets[last][1]
+        corrected = corrections.get(number)
+        if not corrected or len(corrected) > 2 * (end - start) + 20:
+            continue
+        if corrected != text[start:end]:
+            replaced += 1
+        text = text[:start] + corrected + text[end:]
+    return text, replaced
@@ -1,9 +1,100 @@
 import fitz  # PyMuPDF
 import os
+import re
+import json
 import argparse
 import sys
+from collections import defaultdict
+from functools import partial
+from multiprocessing import Pool
 
-def pdf_to_images(pdf_path, output_folder, start_page_num, output_format):
+from fsutil import IMAGE_EXTENSIONS, write_if_changed
+from instrument import timed
+
+# Image encoders by file extension; WebP goes through Pillow
+ENCODERS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp"}
+# Extension given to the output files when --encoder does not match --output-format
+ENCODER_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+DEFAULT_DPI = 72
+DEFAULT_QUALITY = 90
+# Preview resolution and ink threshold used to find the content bounding box
+CLIP_PREVIEW_DPI = 36
+CLIP_INK_THRESHOLD = 160
+CLIP_MARGIN = 12  # points kept around the content
+# Written next to the images: the render settings of the last complete run over a directory
+RENDER_SETTINGS_FILE = ".render_settings.json"
+
+def encoder_for(output_format):
+    """The encoder implied by the output file name's extension, PNG if it has none we know."""
+    return ENCODERS.get(os.path.splitext(output_format)[1].lower(), "png")
+
+def load_pixmap(image_path):
+    """Read a page image into a pixmap. MuPDF does not decode WebP, so those go through Pillow."""
+    if encoder_for(image_path) != "webp":
+        return fitz.Pixmap(image_path)
+    from PIL import Image
+    with Image.open(image_path) as image:
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        colorspace = fitz.csGRAY if image.mode == "L" else fitz.csRGB
+        return fitz.Pixmap(colorspace, image.width, image.height, image.tobytes(), False)
+
+def content_bbox(page):
+    """
+    Find the inked area of a page from a low-resolution grayscale preview.
+    Scanned pages are a single image, so this looks at pixels rather than at the PDF's drawing commands.
+
+    Returns:
+        fitz.Rect: The content area in page coordinates plus a small margin, or None for a blank page.
+    """
+    zoom = CLIP_PREVIEW_DPI / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+    samples, width, stride = pix.samples, pix.width, pix.stride
+    rows = [y for y in range(pix.height) if min(samples[y * stride:y * stride + width]) < CLIP_INK_THRESHOLD]
+    if not rows:
+        return None
+    columns = [x for x in range(width) if min(samples[x:pix.height * stride:stride]) < CLIP_INK_THRESHOLD]
+    bbox = fitz.Rect(columns[0], rows[0], columns[-1] + 1, rows[-1] + 1) / zoom
+    bbox = fitz.Rect(bbox.x0 - CLIP_MARGIN, bbox.y0 - CLIP_MARGIN, bbox.x1 + CLIP_MARGIN, bbox.y1 + CLIP_MARGIN)
+    return bbox & page.rect
+
+def render_page(page, dpi=DEFAULT_DPI, grayscale=False, clip_content=False):
+    """Render a page to a pixmap at the given resolution, optionally in grayscale and cropped to its content."""
+    zoom = dpi / 72
+    clip = content_bbox(page) if clip_content else None
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY if grayscale else fitz.csRGB,
+                           clip=clip, alpha=False)
+
+def encode_pixmap(pix, encoder="png", quality=DEFAULT_QUALITY):
+    """Encode a pixmap as PNG, JPEG or WebP bytes. Quality applies to the lossy encoders."""
+    if encoder == "png":
+        return pix.tobytes("png")
+    if encoder == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=quality)
+    if encoder == "webp":
+        return pix.pil_tobytes(format="WEBP", quality=quality)
+    raise ValueError(f"Unknown encoder '{encoder}'")
+
+def save_page(page, image_path, options=None):
+    """Render and encode one page to image_path, returning the number of bytes written."""
+    options = options or {}
+    pix = render_page(page, options.get("dpi", DEFAULT_DPI), options.get("grayscale", False),
+                      options.get("clip_content", False))
+    data = encode_pixmap(pix, options.get("encoder") or encoder_for(image_path),
+                         options.get("quality", DEFAULT_QUALITY))
+    with open(image_path, 'wb') as f:
+        f.write(data)
+    remove_other_formats(image_path)
+    return len(data)
+
+def remove_other_formats(image_path):
+    """Delete earlier renders of the same page in other formats, which later stages would otherwise find."""
+    stem, extension = os.path.splitext(image_path)
+    for other in IMAGE_EXTENSIONS:
+        if other != extension.lower() and os.path.exists(stem + other):
+            os.remove(stem + other)
+
+def pdf_to_images(pdf_path, output_folder, start_page_num, output_format, options=None):
     try:
         # Open the PDF file
         doc = fitz.open(pdf_path)
@@ -22,12 +113,12 @@ def pdf_to_images(pdf_path, output_folder, start_page_num, output_format):
     # Iterate over each page
     try:
         for page_num in range(len(doc)):
-            page = doc.load_page(page_num)  # load the page
-            pix = page.get_pixmap()  # render the page to an image
             # Use the output format string to generate the filename
             image_filename = output_format % (start_page_num + page_num)
             image_path = os.path.join(output_folder, image_filename)
-            pix.save(image_path)  # save the image as PNG
+            with timed("slice", "page", image=image_filename) as fields:
+                page = doc.load_page(page_num)  # load the page
+                fields["bytes_written"] = save_page(page, image_path, options)  # render, encode and save
             print(f"Saved: {image_path}")
     except Exception as e:
         print(f"Error: An error occurred while processing the PDF. {e}")
@@ -36,17 +127,161 @@ def pdf_to_images(pdf_path, output_folder, start_page_num, output_format):
     # Close the PDF file
     doc.close()
 
+def start_page_from_filename(pdf_path):
+    """Derive the first page number from a range-named PDF such as 'Deda-180-186.pdf'."""
+    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    match = re.search(r'[0-9]+', base_name)
+    return int(match.group()) if match else 1
+
+def render_settings(options, output_format):
+    """The settings that decide what a page image looks like, with the defaults filled in."""
+    options = options or {}
+    encoder = options.get("encoder") or encoder_for(output_format)
+    return {"dpi": options.get("dpi", DEFAULT_DPI), "grayscale": options.get("grayscale", False),
+            "clip_content": options.get("clip_content", False), "encoder": encoder,
+            "quality": None if encoder == "png" else options.get("quality", DEFAULT_QUALITY)}
+
+def load_render_settings(output_folder, output_format):
+    """
+    The settings the images in output_folder were rendered with. Folders rendered before the
+    settings were recorded were rendered with the defaults.
+    """
+    try:
+        with open(os.path.join(output_folder, RENDER_SETTINGS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return render_settings(None, output_format)
+
+def is_up_to_date(image_path, pdf_path):
+    """A page is up to date if its image exists and is newer than the source PDF."""
+    return os.path.exists(image_path) and os.path.getmtime(image_path) >= os.path.getmtime(pdf_path)
+
+# Documents opened by the current worker process, keyed by PDF path
+_worker_docs = {}
+
+def _render_page(task, options=None):
+    """Render a single page in a worker process, reusing one document handle per PDF."""
+    pdf_path, page_index, image_path = task
+    try:
+        with timed("slice", "page", image=os.path.basename(image_path)) as fields:
+            doc = _worker_docs.get(pdf_path)
+            if doc is None:
+                doc = _worker_docs[pdf_path] = fitz.open(pdf_path)
+            fields["bytes_written"] = save_page(doc.load_page(page_index), image_path, options)
+        return pdf_path, image_path, None
+    except Exception as e:
+        return pdf_path, image_path, str(e)
+
+def plan_pages(pdf_paths, output_folder, output_format, force=False, options=None):
+    """
+    List the pages to render for each PDF, skipping pages whose image is already newer than the PDF.
+    If the render settings changed since the images were rendered, every page is rendered again.
+
+    Returns:
+        tuple: (tasks, skipped) where tasks is a list of (pdf_path, page_index, image_path)
+        and skipped maps each PDF path to the number of up-to-date pages.
+    """
+    tasks = []
+    skipped = defaultdict(int)
+    recorded = load_render_settings(output_folder, output_format)
+    settings = render_settings(options, output_format)
+    if not force and recorded != settings:
+        changed = ", ".join(f"{name} {recorded.get(name)} -> {value}" for name, value in settings.items()
+                            if recorded.get(name) != value)
+        print(f"Render settings changed ({changed}); rendering every page again.")
+        force = True
+    for pdf_path in pdf_paths:
+        start_page_num = start_page_from_filename(pdf_path)
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+        for page_index in range(page_count):
+            image_path = os.path.join(output_folder, output_format % (start_page_num + page_index))
+            if not force and is_up_to_date(image_path, pdf_path):
+                skipped[pdf_path] += 1
+            else:
+                tasks.append((pdf_path, page_index, image_path))
+    return tasks, skipped
+
+def pdfs_to_images_parallel(pdf_paths, output_folder, output_format, jobs=None, force=False, options=None):
+    """
+    Render the pages of many PDFs across a process pool.
+    Page numbers are derived from the PDF file names, the same way 01_slice.sh does it.
+    Options are the render settings passed to save_page (dpi, grayscale, clip_content, encoder, quality).
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    try:
+        tasks, skipped = plan_pages(pdf_paths, output_folder, output_format, force, options)
+    except Exception as e:
+        print(f"Error: Unable to read PDF files. {e}")
+        sys.exit(1)
+
+    rendered = defaultdict(int)
+    failed = defaultdict(int)
+
+    if tasks:
+        # Keep consecutive pages of one PDF together so each worker reuses its open document
+        chunksize = max(1, len(tasks) // ((jobs or os.cpu_count() or 1) * 4))
+        with Pool(processes=jobs) as pool:
+            for done, (pdf_path, image_path, error) in enumerate(pool.imap_unordered(partial(_render_page, options=options), tasks, chunksize), 1):
+                if error:
+                    failed[pdf_path] += 1
+                    print(f"[{done}/{len(tasks)}] Error: {image_path}: {error}")
+                else:
+                    rendered[pdf_path] += 1
+                    print(f"[{done}/{len(tasks)}] Saved: {image_path}")
+
+    # Per-PDF summary
+    for pdf_path in pdf_paths:
+        print(f"{pdf_path}: {rendered[pdf_path]} rendered, {skipped[pdf_path]} up to date, {failed[pdf_path]} failed")
+    print(f"Total: {sum(rendered.values())} rendered, {sum(skipped.values())} up to date, {sum(failed.values())} failed")
+
+    if any(failed.values()):
+        sys.exit(1)
+    write_if_changed(os.path.join(output_folder, RENDER_SETTINGS_FILE),
+                     json.dumps(render_settings(options, output_format), indent=1) + "\n")
+
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Convert PDF pages to images.")
-    parser.add_argument("pdf_path", type=str, help="Path to the input PDF file")
+    parser.add_argument("pdf_path", type=str,
+                        help="Path to the input PDF file, or a directory of PDFs to render in parallel")
     parser.add_argument("output_folder", type=str, help="Folder to save output images")
     parser.add_argument("--start-page-num", type=int, default=1, help="Starting page number for output file names (default is 1)")
     parser.add_argument("--output-format", type=str, default="page_%03d.png",
-                        help="Format for output filenames, using a printf-style placeholder for the page number (default is 'page_%03d.png')")
+                        help="Format for output filenames, using a printf-style placeholder for the page number (default is 'page_%%03d.png')")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of worker processes when rendering a directory (default is the number of CPUs)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-render pages even if their images are newer than the PDF")
+
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI, help=f"Render resolution (default is {DEFAULT_DPI})")
+    parser.add_argument("--grayscale", action="store_true", help="Render in grayscale instead of RGB")
+    parser.add_argument("--clip-content", action="store_true",
+                        help="Crop each page to its inked area plus a small margin")
+    parser.add_argument("--encoder", choices=sorted(set(ENCODERS.values())), default=None,
+                        help="Image encoder, which also sets the extension of the output files "
+                             "(default follows the extension of --output-format)")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"JPEG/WebP quality from 1 to 100 (default is {DEFAULT_QUALITY})")
 
     # Parse arguments
     args = parser.parse_args()
+    if args.encoder and encoder_for(args.output_format) != args.encoder:
+        # Later stages find and decode slices by their extension
+        args.output_format = os.path.splitext(args.output_format)[0] + ENCODER_EXTENSIONS[args.encoder]
+    options = {"dpi": args.dpi, "grayscale": args.grayscale, "clip_content": args.clip_content,
+               "encoder": args.encoder, "quality": args.quality}
+
+    # A directory of PDFs is rendered in parallel, deriving page numbers from the file names
+    if os.path.isdir(args.pdf_path):
+        pdf_paths = sorted(os.path.join(args.pdf_path, name) for name in os.listdir(args.pdf_path)
+                           if name.lower().endswith(".pdf"))
+        if not pdf_paths:
+            print(f"Error: No PDF files found in '{args.pdf_path}'.")
+            sys.exit(1)
+        pdfs_to_images_parallel(pdf_paths, args.output_folder, args.output_format, args.jobs, args.force, options)
+        return
 
     # Validate PDF file path
     if not os.path.isfile(args.pdf_path):
@@ -54,7 +289,7 @@ def main():
         sys.exit(1)
 
     # Convert PDF to images
-    pdf_to_images(args.pdf_path, args.output_folder, args.start_page_num, args.output_format)
+    pdf_to_images(args.pdf_path, args.output_folder, args.start_page_num, args.output_format, options)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,38 @@
+"""Token counts used to budget OpenAI requests."""
+import sys
+from functools import lru_cache
+
+import tiktoken
+
+# Russian text averages roughly three characters per token with the gpt-4o tokenizer
+CHARS_PER_TOKEN = 3
+
+def estimate_tokens(text):
+    """Estimates the number of tokens in text without tokenizing it."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+@lru_cache(maxsize=None)
+def encoding_for(model):
+    """Returns the model's tokenizer, or None if it cannot be loaded (tiktoken downloads it on first use)."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Warning: Unable to load the tokenizer for {model}, estimating token counts instead. {e}",
+              file=sys.stderr)
+        return None
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Counts the tokens in text with the model's tokenizer."""
+    encoding = encoding_for(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def estimate_request_tokens(request):
+    """Estimates prompt plus completion tokens for a chat completion request."""
+    prompt_tokens = sum(estimate_tokens(message["content"]) + 4 for message in request["messages"])
+    # The pipeline's prompts ask for the text back plus a list of edits, so budget about as much output as input
+    return prompt_tokens + request.get("max_tokens", prompt_tokens)
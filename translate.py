@@ -0,0 +1,247 @@
+"""
+Translate the Russian chapter files into English.
+
+book/chapterN_ru.tex is split at blank lines into paragraphs, the same unit \\label{PAGE-PARAGRAPH}
+marks. In each paragraph the LaTeX markup (\\pageimage and \\label lines, \\footnotemark,
+\\footnotetext and other commands, braces, comments and escaped characters) is replaced by
+numbered placeholders such as ⟨0⟩, so the model only sees prose and cannot damage the markup.
+A translation is accepted only if it gives back every placeholder exactly once; the markup is
+then restored and the remaining text escaped for LaTeX. Paragraphs that are only markup are
+copied as they are.
+
+Paragraphs are translated concurrently under the same RateLimiter as revise.py. Translations
+are kept in a translation memory keyed by a hash of the model and the protected source
+paragraph, so after editing one Russian paragraph only that paragraph is sent again, and
+chapterN_en.tex is rewritten only when its content changed.
+
+Usage:
+    python translate.py                          # every chapter without an English file
+    python translate.py book/chapter5_ru.tex
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+from assemble import escape_latex
+from cache import hash_key
+from fsutil import write_atomic, write_if_changed
+from llm import complete_async, get_async_client
+from ratelimit import RateLimiter
+
+load_dotenv()
+
+TRANSLATE_MODEL = "gpt-4o"
+DEFAULT_BOOK_DIR = "book"
+DEFAULT_MEMORY_PATH = os.path.join(".cache", "translation_memory.json")
+
+PARAGRAPH_BREAK = re.compile(r'(\n[ \t]*\n\s*)')
+# Markup the model must not see: comments, math, structural commands with their arguments,
+# other command names, escaped characters, braces and ties
+MARKUP = re.compile(r"""
+    (?<!\\)%[^\n]*
+  | (?<!\\)\$[^$]*\$
+  | \\(?:pageimage|label|ref|pageref|hypertarget|hyperlink|includegraphics|footnotemark)\*?(?:\[[^\]]*\])?(?:\{[^{}]*\})*
+  | \\[a-zA-Z]+\*?
+  | \\.
+  | [{}~]
+""", re.VERBOSE)
+COMMENT_END = re.compile(r'(?<!\\)%[^\n]*$')
+PLACEHOLDER = re.compile(r'⟨(\d+)⟩')
+LETTER = re.compile(r'[^\W\d_]')
+
+SYSTEM_PROMPT = """You translate a Russian family memoir into English, one paragraph at a time.
+Keep the author's voice, first person and plain style; keep names of people and places transliterated.
+Tokens like ⟨0⟩ stand for LaTeX markup: keep every one of them exactly once, in the place that matches the source.
+Reply with the English translation only."""
+
+def split_paragraphs(text):
+    """Splits a chapter into alternating paragraphs and the blank-line separators between them."""
+    return PARAGRAPH_BREAK.split(text)
+
+def protect(paragraph):
+    """
+    Replaces the markup in a paragraph by numbered placeholders. Adjacent pieces of markup,
+    with only whitespace between them, share one placeholder, and markup that fills whole lines
+    or ends in a comment takes its line break with it.
+
+    Returns:
+        tuple: (protected text, list of the markup each placeholder stands for)
+    """
+    pieces = []
+    for match in MARKUP.finditer(paragraph):
+        if pieces and not paragraph[pieces[-1][1]:match.start()].strip():
+            pieces[-1][1] = match.end()
+        else:
+            pieces.append([match.start(), match.end()])
+    for piece in pieces:
+        start, end = piece
+        whole_lines = start == 0 or paragraph[start - 1] == "\n"
+        # A comment must keep its line break, or it would swallow the text after it
+        if (whole_lines or COMMENT_END.search(paragraph, start, end)) and paragraph[end:end + 1] == "\n":
+            piece[1] = end + 1
+
+    parts, markup = [], []
+    position = 0
+    for start, end in pieces:
+        parts.append(paragraph[position:start])
+        parts.append(f"⟨{len(markup)}⟩")
+        markup.append(paragraph[start:end])
+        position = end
+    parts.append(paragraph[position:])
+    return "".join(parts), markup
+
+def needs_translation(protected):
+    return bool(LETTER.search(PLACEHOLDER.sub("", protected)))
+
+def restore(translation, markup):
+    """Puts the markup back into a translated paragraph, escaping the translated prose for LaTeX."""
+    found = [int(number) for number in PLACEHOLDER.findall(translation)]
+    if sorted(found) != list(range(len(markup))):
+        raise ValueError(f"translation has placeholders {found}, expected 0-{len(markup) - 1} once each")
+    parts = PLACEHOLDER.split(translation)
+    # split() alternates prose and placeholder numbers
+    return "".join(escape_latex(part) if index % 2 == 0 else markup[int(part)] for index, part in enumerate(parts))
+
+def translate_request(protected):
+    return {
+        "model": TRANSLATE_MODEL,
+        "temperature": 0,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": protected},
+        ],
+    }
+
+def memory_key(protected):
+    return hash_key(TRANSLATE_MODEL, SYSTEM_PROMPT, protected)
+
+def load_memory(path):
+    """Loads the translation memory, or an empty one if there is none yet."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_memory(path, memory):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_atomic(path, json.dumps(memory, ensure_ascii=False, indent=1))
+
+def english_path_for(russian_path):
+    return re.sub(r'_ru\.tex$', '_en.tex', russian_path)
+
+async def translate_chapter(async_client, russian_path, memory, limiter, semaphore, refresh=False):
+    """
+    Translates one chapter file, answering paragraphs from the translation memory unless refresh is set.
+
+    Returns:
+        tuple: (English text or None if any paragraph failed, paragraphs sent, paragraphs from memory, errors)
+    """
+    with open(russian_path, 'r', encoding='utf-8') as f:
+        chunks = split_paragraphs(f.read())
+    counts = {"sent": 0, "memory": 0}
+    errors = []
+
+    async def translate(paragraph):
+        body = paragraph.rstrip()
+        protected, markup = protect(body)
+        if not needs_translation(protected):
+            return paragraph
+        key = memory_key(protected)
+        if refresh or key not in memory:
+            async with semaphore:
+                translation = (await complete_async(async_client, translate_request(protected), limiter,
+                                                    stage="translate")).strip()
+            # Check the placeholders before the translation is remembered
+            restore(translation, markup)
+            memory[key] = translation
+            counts["sent"] += 1
+        else:
+            counts["memory"] += 1
+        return restore(memory[key], markup) + paragraph[len(body):]
+
+    async def translate_or_report(index, paragraph):
+        try:
+            return await translate(paragraph)
+        except Exception as e:
+            line = "".join(chunks[:index]).count("\n") + 1
+            errors.append(f"{russian_path}:{line}: {e}")
+            return None
+
+    # Paragraphs are the even chunks; the separators between them are kept as they are
+    translations = await asyncio.gather(*(translate_or_report(index, chunks[index])
+                                          for index in range(0, len(chunks), 2)))
+    chunks[::2] = translations
+    text = None if errors else "".join(chunks)
+    return text, counts["sent"], counts["memory"], errors
+
+async def translate_chapters(russian_paths, memory_path=DEFAULT_MEMORY_PATH, concurrency=8, rpm=500, tpm=30000,
+                             refresh=False):
+    """
+    Translates chapter files into their chapterN_en.tex counterparts, one chapter after another
+    with its paragraphs in parallel. The translation memory is saved after every chapter.
+
+    Returns:
+        int: number of chapters that could not be translated.
+    """
+    memory = load_memory(memory_path)
+    async_client = get_async_client()
+    limiter = RateLimiter(rpm, tpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+    try:
+        for russian_path in russian_paths:
+            text, sent, remembered, errors = await translate_chapter(async_client, russian_path, memory, limiter,
+                                                                     semaphore, refresh)
+            save_memory(memory_path, memory)
+            for error in errors:
+                print(f"Error: {error}")
+            if text is None:
+                failed += 1
+                print(f"Skipped {english_path_for(russian_path)}: {len(errors)} paragraphs failed")
+                continue
+            english_path = english_path_for(russian_path)
+            status = "Wrote" if write_if_changed(english_path, text) else "Unchanged"
+            print(f"{status} {english_path}: {sent} paragraphs translated, {remembered} from memory")
+    finally:
+        await async_client.close()
+    return failed
+
+def untranslated_chapters(book_dir):
+    """The chapterN_ru.tex files in book_dir that have no chapterN_en.tex yet, in chapter order."""
+    names = [name for name in os.listdir(book_dir) if re.fullmatch(r'chapter\d+_ru\.tex', name)]
+    names.sort(key=lambda name: int(re.search(r'\d+', name).group()))
+    paths = [os.path.join(book_dir, name) for name in names]
+    return [path for path in paths if not os.path.exists(english_path_for(path))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate Russian chapter files into English chapter files.")
+    parser.add_argument('chapters', nargs='*',
+                        help='chapterN_ru.tex files to translate (default is every chapter in --book-dir without '
+                             'an English file)')
+    parser.add_argument('--book-dir', default=DEFAULT_BOOK_DIR, help=f"Directory of the book sources (default is '{DEFAULT_BOOK_DIR}')")
+    parser.add_argument('--memory', default=DEFAULT_MEMORY_PATH,
+                        help=f'Translation memory file (default is {DEFAULT_MEMORY_PATH})')
+    parser.add_argument('--refresh', action='store_true', help='Translate every paragraph again, replacing remembered translations')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum paragraphs in flight (default is 8).')
+    parser.add_argument('--rpm', type=int, default=500, help='Requests-per-minute budget (default is 500).')
+    parser.add_argument('--tpm', type=int, default=30000, help='Tokens-per-minute budget (default is 30000).')
+    args = parser.parse_args()
+
+    chapters = args.chapters or untranslated_chapters(args.book_dir)
+    for path in chapters:
+        if not path.endswith('_ru.tex') or not os.path.exists(path):
+            parser.error(f"'{path}' is not an existing chapterN_ru.tex file")
+    if not chapters:
+        print("Every chapter already has an English file.")
+        return
+
+    failed = asyncio.run(translate_chapters(chapters, args.memory, args.concurrency, args.rpm, args.tpm, args.refresh))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Book-wide columnar word store.
+
+Every digest is a JSON list of word dicts, so book-wide questions (how confident is the OCR,
+where does a word occur, what is the text of page 212) mean parsing hundreds of files. The
+store keeps the same data for the whole book as flat columns, one file each:
+
+    text.bin     every word in UTF-8, each followed by a newline
+    offsets.u32  byte offset of each word in text.bin, plus the end of the buffer
+    conf.f32     word confidences
+    breaks.u8    detected break types (0 when there is none)
+    boxes.i32    bounding boxes as x0, y0, x1, y1
+    index.json   page names and the range of word rows each page occupies
+
+The columns are memory-mapped and read through typed memoryviews, so opening the store costs
+nothing and reading a page touches only its rows. Values are stored in native byte order; the
+store is a local cache of digests/, rebuilt with `python wordstore.py build`.
+
+Usage:
+    python wordstore.py build
+    python wordstore.py stats
+    python wordstore.py text page_212
+    python wordstore.py search Шяуляй
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import argparse
+from array import array
+from bisect import bisect_right
+
+from fsutil import write_atomic
+
+DEFAULT_STORE_DIR = "wordstore"
+STORE_VERSION = 1
+LOW_CONFIDENCE = 0.8
+SEPARATOR = b"\n"
+BREAK_SEPARATORS = {1: b" ", 3: b"\n", 5: b"\n\n"}
+
+# Column files and their memoryview formats
+COLUMNS = {"offsets": ("offsets.u32", "I"), "conf": ("conf.f32", "f"),
+           "breaks": ("breaks.u8", "B"), "boxes": ("boxes.i32", "i")}
+
+def page_number(path):
+    match = re.search(r'(\d+)', os.path.basename(path))
+    return int(match.group(1)) if match else 0
+
+def build(digests_dir, store_dir=DEFAULT_STORE_DIR):
+    """
+    Writes the store for every digest in digests_dir, in page order.
+
+    Returns:
+        dict: The store index.
+    """
+    names = sorted((name for name in os.listdir(digests_dir) if name.endswith(".json")), key=page_number)
+    text = bytearray()
+    offsets, conf, breaks, boxes = array("I"), array("f"), array("B"), array("i")
+    pages = []
+
+    for name in names:
+        with open(os.path.join(digests_dir, name), 'r', encoding='utf-8') as f:
+            words = json.load(f)
+        start = len(conf)
+        for word in words:
+            offsets.append(len(text))
+            text += word["word"].encode('utf-8') + SEPARATOR
+            conf.append(word.get("confidence", 0.0))
+            breaks.append(word.get("detected_break") or 0)
+            boxes.extend(word.get("box") or (0, 0, 0, 0))
+        pages.append([os.path.splitext(name)[0], start, len(conf)])
+    offsets.append(len(text))
+
+    os.makedirs(store_dir, exist_ok=True)
+    write_atomic(os.path.join(store_dir, "text.bin"), bytes(text))
+    for column, values in (("offsets", offsets), ("conf", conf), ("breaks", breaks), ("boxes", boxes)):
+        write_atomic(os.path.join(store_dir, COLUMNS[column][0]), values.tobytes())
+    index = {"version": STORE_VERSION, "words": len(conf), "pages": pages}
+    # The index goes last: a store is complete once it matches the columns
+    write_atomic(os.path.join(store_dir, "index.json"), json.dumps(index, ensure_ascii=False))
+    return index
+
+class WordStore:
+    """Read-only, memory-mapped view of a built store."""
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        with open(os.path.join(store_dir, "index.json"), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get("version") != STORE_VERSION:
+            raise ValueError(f"Word store in '{store_dir}' has version {index.get('version')}, expected {STORE_VERSION}")
+        self.words = index["words"]
+        self.pages = {name: (start, end) for name, start, end in index["pages"]}
+        self.page_names = [name for name, _, _ in index["pages"]]
+        self.page_starts = [start for _, start, _ in index["pages"]]
+
+        self._maps = []
+        self.text = self._map(store_dir, "text.bin")
+        for column, (filename, fmt) in COLUMNS.items():
+            setattr(self, column, memoryview(self._map(store_dir, filename)).cast(fmt))
+
+    def _map(self, store_dir, filename):
+        with open(os.path.join(store_dir, filename), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def close(self):
+        for column in COLUMNS:
+            getattr(self, column).release()
+        for mapped in self._maps:
+            mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def word_bytes(self, row):
+        return self.text[self.offsets[row]:self.offsets[row + 1] - len(SEPARATOR)]
+
+    def word(self, row):
+        return self.word_bytes(row).decode('utf-8')
+
+    def box(self, row):
+        return list(self.boxes[4 * row:4 * row + 4])
+
+    def page_of(self, row):
+        return self.page_names[bisect_right(self.page_starts, row) - 1]
+
+    def page_words(self, name):
+        """The page as digest.py wrote it: a list of word dicts."""
+        start, end = self.pages[name]
+        return [{"word": self.word(row), "confidence": self.conf[row], "detected_break": self.breaks[row] or '',
+                 "box": self.box(row)} for row in range(start, end)]
+
+    def page_text(self, name):
+        """The page's text, assembled like revise.assemble_text from the detected breaks; layout fields are not stored."""
+        start, end = self.pages[name]
+        parts = []
+        for row in range(start, end):
+            parts.append(self.word_bytes(row))
+            parts.append(BREAK_SEPARATORS.get(self.breaks[row], b""))
+        return b"".join(parts).decode('utf-8').strip()
+
+    def page_stats(self, threshold=LOW_CONFIDENCE):
+        """Per page: (name, words, mean confidence, share of words below threshold)."""
+        stats = []
+        for name in self.page_names:
+            start, end = self.pages[name]
+            values = self.conf[start:end]
+            count = end - start
+            stats.append((name, count, sum(values) / count if count else 0.0,
+                          sum(1 for c in values if c < threshold) / count if count else 0.0))
+        return stats
+
+    def search(self, phrase):
+        """
+        Finds a whole word or a run of consecutive words.
+
+        Returns:
+            list: (page name, first row, box of the first word) for each occurrence.
+        """
+        needle = SEPARATOR.join(word.encode('utf-8') for word in phrase.split()) + SEPARATOR
+        hits = []
+        position = self.text.find(needle)
+        while position != -1:
+            row = bisect_right(self.offsets, position) - 1
+            # Only matches that start at a word boundary are whole words
+            if self.offsets[row] == position:
+                hits.append((self.page_of(row), row, self.box(row)))
+            position = self.text.find(needle, position + 1)
+        return hits
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the book-wide word store.")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR, help=f"Store directory (default is '{DEFAULT_STORE_DIR}')")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Build the store from digests")
+    build_parser.add_argument("--digests-dir", default="digests", help="Directory of digests (default is 'digests')")
+    stats_parser = commands.add_parser("stats", help="Print per-page and book confidence statistics")
+    stats_parser.add_argument("--threshold", type=float, default=LOW_CONFIDENCE,
+                              help=f"Confidence below which a word counts as low (default is {LOW_CONFIDENCE})")
+    text_parser = commands.add_parser("text", help="Print the assembled text of pages")
+    text_parser.add_argument("pages", nargs="+", help="Page names such as page_012")
+    search_parser = commands.add_parser("search", help="Find a word or phrase")
+    search_parser.add_argument("phrase", nargs="+", help="Word or consecutive words to find")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if not os.path.isdir(args.digests_dir):
+            print(f"Error: The directory '{args.digests_dir}' does not exist.")
+            sys.exit(1)
+        index = build(args.digests_dir, args.store)
+        print(f"Stored {index['words']} words from {len(index['pages'])} pages in {args.store}")
+        return
+
+    try:
+        store = WordStore(args.store)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: Unable to open the word store. {e}")
+        sys.exit(1)
+
+    with store:
+        if args.command == "stats":
+            stats = store.page_stats(args.threshold)
+            for name, count, mean, low in stats:
+                print(f"{name:<12}{count:>6} words  mean {mean:.4f}  low {low:6.1%}")
+            total = sum(count for _, count, _, _ in stats)
+            if total:
+                mean = sum(store.conf) / total
+                low = sum(1 for c in store.conf if c < args.threshold) / total
+                print(f"{'book':<12}{total:>6} words  mean {mean:.4f}  low {low:6.1%}")
+        elif args.command == "text":
+            for name in args.pages:
+                if name not in store.pages:
+                    print(f"Error: No page '{name}' in the store.")
+                    sys.exit(1)
+                print(f"[[{name}]]\n{store.page_text(name)}\n")
+        elif args.command == "search":
+            for name, row, box in store.search(" ".join(args.phrase)):
+                print(f"{name}  word {row - store.pages[name][0]}  box {box}")
+
+if __name__ == "__main__":
+    main()